@@ -0,0 +1,179 @@
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import core
+from columnar import is_parquet_path
+
+# --- 批次情境計算 (命令列) ---
+# 讀取多個與 load_data_from_excel_authority 相同格式的 xlsx (B1–B6 純量、第 8 列起為工作站) 或 Parquet 情境檔，
+# 對每個檔案計算 輸出量 × CO₂ 係數 網格，並以多個行程平行處理，結果逐檔寫入同一個 CSV / Parquet。
+
+RESULT_COLUMNS = [
+    "file", "demand", "carbon_factor", "reliability", "total_energy", "carbon_emission",
+    "total_process_time", "total_idle_time", "n_stations", "load_seconds", "compute_seconds", "file_seconds"
+]
+
+
+class ScenarioLoadError(Exception):
+    pass
+
+
+# 網格參數：「start:stop:step」(含 stop) 或以逗號分隔的數值
+def parse_grid(spec):
+    spec = str(spec).strip()
+    if ":" in spec:
+        parts = [float(x) for x in spec.split(":")]
+        if len(parts) != 3 or parts[2] <= 0:
+            raise argparse.ArgumentTypeError(f"網格格式應為 start:stop:step，收到 {spec!r}")
+        start, stop, step = parts
+        return np.arange(start, stop + step / 2, step)
+    try:
+        return np.array([float(x) for x in spec.split(",") if x.strip()])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"無法解析網格 {spec!r}")
+
+
+# 展開目錄與萬用字元，回傳排序後且不重複的 xlsx / Parquet 清單 (略過 Excel 暫存檔 ~$*.xlsx)
+def collect_files(patterns):
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, "*.xlsx")) + glob.glob(os.path.join(pattern, "*.parquet"))
+        else:
+            matches = glob.glob(pattern)
+        files.extend(
+            m for m in matches
+            if (m.lower().endswith(".xlsx") or is_parquet_path(m)) and not os.path.basename(m).startswith("~$")
+        )
+    return sorted(set(files))
+
+
+def _raise_notice(level, message):
+    raise ScenarioLoadError(message)
+
+
+# 單一檔案：讀取 + 網格計算，回傳欄位陣列 (在 worker 行程中執行)
+def run_scenario(path, demands, carbon_factors):
+    start = time.perf_counter()
+    # 不存在的路徑會被 load_authority_with_model 換成內建預設資料，必須先擋下
+    if not os.path.exists(path):
+        raise ScenarioLoadError(f"找不到檔案：{path}")
+    df, excel_auth, model = core.load_authority_with_model(path, notify=_raise_notice)
+    if model is None:
+        model = core.compile_station_model(df)
+    loaded = time.perf_counter()
+
+    d_grid, cf_grid = np.meshgrid(demands, carbon_factors, indexing="ij")
+    res = core.calculate_metrics_batch(d_grid.ravel(), cf_grid.ravel(), model, excel_auth)
+    done = time.perf_counter()
+
+    size = d_grid.size
+    return {
+        "file": [path] * size,
+        "demand": d_grid.ravel(),
+        "carbon_factor": cf_grid.ravel(),
+        "reliability": res["reliability"],
+        "total_energy": res["total_energy"],
+        "carbon_emission": res["carbon_emission"],
+        "total_process_time": res["total_process_time"],
+        "total_idle_time": res["total_idle_time"],
+        "n_stations": np.full(size, model.n),
+        "load_seconds": np.full(size, loaded - start),
+        "compute_seconds": np.full(size, done - loaded),
+        "file_seconds": np.full(size, done - start)
+    }
+
+
+# 依副檔名決定輸出格式，逐批寫入 (不需把所有結果留在記憶體)
+class ResultWriter:
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.lower().endswith(".parquet")
+        self._writer = None
+        self._header_written = False
+        self.rows = 0
+
+    def write(self, columns):
+        import pandas as pd
+
+        frame = pd.DataFrame(columns, columns=RESULT_COLUMNS)
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        else:
+            frame.to_csv(self.path, mode="a" if self._header_written else "w", header=not self._header_written, index=False)
+            self._header_written = True
+        self.rows += len(frame)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批次計算多個情境 Excel 的可靠度、能耗與碳排放")
+    parser.add_argument("inputs", nargs="+", help="xlsx / Parquet 檔案、目錄或萬用字元 (例如 'scenarios/*.xlsx')")
+    parser.add_argument("-o", "--output", required=True, help="輸出檔 (.csv 或 .parquet)")
+    parser.add_argument("--demand", type=parse_grid, default=parse_grid("2500"), help="輸出量網格，例如 1000:5500:100 或 2500,2592")
+    parser.add_argument("--carbon-factor", type=parse_grid, default=parse_grid("0.474"), help="CO₂ 係數網格，例如 0.3:0.6:0.01")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1, help="平行行程數 (預設為 CPU 核心數)")
+    args = parser.parse_args(argv)
+
+    files = collect_files(args.inputs)
+    if not files:
+        parser.error("找不到任何 xlsx / Parquet 檔案")
+
+    writer = ResultWriter(args.output)
+    failures = 0
+    start = time.perf_counter()
+    total = len(files)
+
+    # 依完成順序產生 (檔案, 結果欄位, 錯誤)
+    def outcomes():
+        if args.workers <= 1:
+            for path in files:
+                try:
+                    yield path, run_scenario(path, args.demand, args.carbon_factor), None
+                except Exception as e:
+                    yield path, None, e
+            return
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = {pool.submit(run_scenario, path, args.demand, args.carbon_factor): path for path in files}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, e
+
+    try:
+        for done, (path, columns, error) in enumerate(outcomes(), start=1):
+            if error is not None:
+                failures += 1
+                message = f"失敗：{error}"
+            else:
+                writer.write(columns)
+                message = f"{columns['file_seconds'][0]:.2f}s"
+            print(f"[{done}/{total}] {message}  {os.path.basename(path)}", file=sys.stderr, flush=True)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"完成：{total - failures}/{total} 個檔案，{writer.rows} 筆結果，耗時 {elapsed:.2f}s → {args.output}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+#在終端機輸入：python batch_runner.py "scenarios/*.xlsx" --demand 1000:5500:100 --carbon-factor 0.4:0.6:0.05 -o results.csv
@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+import core
+from storage import save_workbook
+from validation import validate_station_table
+
+# --- 效能基準測試 ---
+# 以合成產線 (欄位與 get_default_data() 相同) 量測各條計算 / I/O 路徑在不同工作站數下的耗時，
+# 結果存成 JSON 基準檔；之後以 --compare 比對，超過容許比例即視為退步 (結束碼 1)。
+
+DEFAULT_SIZES = (5, 20, 50, 100, 200, 500)
+DEFAULT_BASELINE = "benchmark_baseline.json"
+CASES = ("compile_model", "calculate_metrics", "sensitivity_sweep", "validation", "excel_load", "upload_read", "save")
+
+
+# 產生合成產線：capacities 為 0 到最大產能的等差狀態，probs 前幾個狀態為小機率、最後一個補足到 1
+def generate_line(n_stations, n_states=6, p_range=(0.95, 0.99), working_power_range=(2.0, 4.0),
+                  idle_power_range=(0.3, 0.6), max_cap_range=(2500, 3600), seed=0):
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n_stations):
+        max_cap = float(rng.integers(*max_cap_range))
+        caps = np.round(np.linspace(0, max_cap, n_states), 0)
+        low = rng.uniform(0.001, 0.012, n_states - 1)
+        probs = np.round(np.append(low, 1 - low.sum()), 6)
+        time_limit = float(rng.integers(10, 101))
+        rows.append({
+            "name": f"工作站{i + 1}",
+            "processTime": time_limit / 3000 * rng.uniform(0.5, 1.0),
+            "timeLimit": time_limit,
+            "capacities": str([int(c) for c in caps]),
+            "probs": str([float(p) for p in probs]),
+            "p": round(float(rng.uniform(*p_range)), 4),
+            "working_power": round(float(rng.uniform(*working_power_range)), 4),
+            "idle_power": round(float(rng.uniform(*idle_power_range)), 4)
+        })
+    return pd.DataFrame(rows)
+
+
+# 寫出權威格式活頁簿 (B1–B6 純量、第 7 列標題、第 8 列起為工作站)，供 load_data_from_excel_authority 讀取
+def write_authority_workbook(df, path, demand=2500, carbon_factor=0.474):
+    from openpyxl import Workbook
+
+    res = core.calculate_metrics(demand, carbon_factor, df)
+    model = core.compile_station_model(df)
+
+    wb = Workbook()
+    ws = wb.active
+    scalars = [("d", demand), ("I", demand / model.product_p), ("CO2", carbon_factor),
+               ("Rd", res["reliability"]), ("E", res["total_energy"]), ("CO2 排放", res["carbon_emission"])]
+    for r, (label, value) in enumerate(scalars, start=1):
+        ws.cell(row=r, column=1, value=label)
+        ws.cell(row=r, column=2, value=value)
+    header = ["name", "processTime", "working_power", "idle_power", "p", "capacities", "probs", "timeLimit"]
+    for c, col in enumerate(header, start=1):
+        ws.cell(row=7, column=c, value=col)
+    for r, row in enumerate(df[header].itertuples(index=False), start=8):
+        for c, value in enumerate(row, start=1):
+            ws.cell(row=r, column=c, value=value)
+    wb.save(path)
+    return path
+
+
+# 重複執行直到至少 min_time 秒 (且至少 min_repeats 次)，回傳各次耗時 (ms)
+def time_case(func, setup=None, min_repeats=3, min_time=0.2, max_repeats=200):
+    durations = []
+    start_all = time.perf_counter()
+    while len(durations) < max_repeats:
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000.0)
+        if len(durations) >= min_repeats and time.perf_counter() - start_all >= min_time:
+            break
+    return durations
+
+
+def run_size(n_stations, cases, workdir, seed=0):
+    df = generate_line(n_stations, seed=seed)
+    model = core.compile_station_model(df)
+    sweep_demands = np.arange(1000, 5501)
+
+    xlsx_path = os.path.join(workdir, f"authority_{n_stations}.xlsx")
+    write_authority_workbook(df, xlsx_path)
+    upload_path = os.path.join(workdir, f"upload_{n_stations}.xlsx")
+    df.to_excel(upload_path, index=False)
+    with open(upload_path, "rb") as f:
+        upload_bytes = f.read()
+    save_path = os.path.join(workdir, f"save_{n_stations}.xlsx")
+    save_frames = [df, df.assign(timeLimit=df["timeLimit"] + 1)]
+    save_count = [0]
+
+    def save_once():
+        # 交替寫入兩個版本，避免版本歷史因內容相同而略過
+        save_workbook(save_frames[save_count[0] % 2], save_path)
+        save_count[0] += 1
+
+    bench = {
+        "compile_model": (lambda: core.compile_station_model(df), None),
+        "calculate_metrics": (lambda: core.calculate_metrics(2500, 0.474, model), None),
+        "sensitivity_sweep": (lambda: core.calculate_metrics_batch(sweep_demands, 0.474, model), None),
+        "validation": (lambda: validate_station_table(df), None),
+        # I/O 路徑量測冷啟動：每次執行前清空對應快取
+        "excel_load": (lambda: core.load_data_from_excel_authority(xlsx_path), core.clear_workbook_cache),
+        "upload_read": (lambda: core.load_uploaded_workbook(upload_bytes), core.get_upload_cache().clear),
+        "save": (save_once, None),
+    }
+
+    results = []
+    for case in cases:
+        func, setup = bench[case]
+        durations = time_case(func, setup)
+        results.append({
+            "case": case,
+            "stations": n_stations,
+            "repeats": len(durations),
+            "median_ms": float(np.median(durations)),
+            "min_ms": float(np.min(durations)),
+            "max_ms": float(np.max(durations))
+        })
+    return results
+
+
+def environment():
+    import pandas as pd
+
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+# 與基準檔比較：median 超過基準 (1 + tolerance) 倍者列為退步
+def compare(results, baseline, tolerance):
+    base = {(r["case"], r["stations"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        ref = base.get((r["case"], r["stations"]))
+        if ref is None:
+            continue
+        ratio = r["median_ms"] / ref["median_ms"] if ref["median_ms"] > 0 else float("inf")
+        r["baseline_median_ms"] = ref["median_ms"]
+        r["ratio"] = ratio
+        if ratio > 1 + tolerance:
+            regressions.append(r)
+    return regressions
+
+
+def _int_list(spec):
+    return [int(x) for x in spec.split(",") if x.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="合成產線效能基準測試")
+    parser.add_argument("--sizes", type=_int_list, default=list(DEFAULT_SIZES), help="工作站數，例如 5,50,500")
+    parser.add_argument("--cases", default=",".join(CASES), help=f"量測項目 (預設全部：{','.join(CASES)})")
+    parser.add_argument("-o", "--output", help=f"寫出結果為基準檔 (例如 {DEFAULT_BASELINE})")
+    parser.add_argument("--compare", help="與既有基準檔比較")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="容許的變慢比例 (預設 0.25 = 25%%)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    cases = [c.strip() for c in args.cases.split(",") if c.strip()]
+    unknown = [c for c in cases if c not in CASES]
+    if unknown:
+        parser.error(f"未知的量測項目：{', '.join(unknown)}")
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        for n in args.sizes:
+            for r in run_size(n, cases, workdir, seed=args.seed):
+                results.append(r)
+                print(f"{r['case']:<18} n={r['stations']:<4} median {r['median_ms']:9.3f} ms  min {r['min_ms']:9.3f} ms  ({r['repeats']} 次)", file=sys.stderr, flush=True)
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for r in regressions:
+            print(f"退步：{r['case']} n={r['stations']} {r['baseline_median_ms']:.3f} → {r['median_ms']:.3f} ms (×{r['ratio']:.2f})", file=sys.stderr)
+        print(f"比較完成：{len(regressions)} 項超過容許值 {args.tolerance:.0%}", file=sys.stderr)
+        exit_code = 1 if regressions else 0
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment(), "tolerance": args.tolerance, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"已寫出基準檔 → {args.output}", file=sys.stderr)
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+#在終端機輸入：python benchmark.py --sizes 5,50,500 -o benchmark_baseline.json
+#之後比較：python benchmark.py --compare benchmark_baseline.json
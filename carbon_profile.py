@@ -0,0 +1,144 @@
+import hashlib
+import io
+
+import numpy as np
+
+# --- 逐時碳排強度 (時間解析碳排放) ---
+# 以逐時電網碳排強度 (例如一年 8,760 筆) 取代單一 CO₂ 係數：
+# 1. 由各站加工 / 閒置時間與功率，算出一次生產在「開工後第 k 小時」的耗電量 (kWh)
+# 2. 碳排放(開工時刻 s) = Σ_k 耗電量[k] × 碳排強度[s + k]，所有可行開工時刻以一次相關運算 (np.correlate) 算完
+# 排程假設：各站依序使用自己的時段 (先加工、後閒置，長度為 max(時間上限, 加工時間))，
+# 或所有站同時開工 (layout="concurrent")；各站總耗電量與 calculate_metrics 的 energies 相同。
+
+DEFAULT_INTENSITY_PATH = "/mnt/data/carbon_intensity.csv"
+INTENSITY_UNITS = {"kg/kWh": 1.0, "g/kWh": 1e-3}
+LAYOUTS = ("sequential", "concurrent")
+
+
+# 讀取逐時碳排強度 CSV：取最後一個數值欄位為強度，可解析為時間的第一個欄位作為時間軸 (可無)
+# source 可為路徑或 bytes；缺值以線性內插補齊。回傳 {"values", "timestamps", "digest", "filled"}，values 單位為 kg/kWh
+def load_intensity_csv(source, unit="kg/kWh"):
+    import pandas as pd
+
+    if unit not in INTENSITY_UNITS:
+        raise ValueError(f"不支援的碳排強度單位：{unit}")
+    if isinstance(source, (bytes, bytearray)):
+        raw = bytes(source)
+    else:
+        with open(source, "rb") as f:
+            raw = f.read()
+
+    frame = pd.read_csv(io.BytesIO(raw))
+    if pd.to_numeric(pd.Series(frame.columns), errors="coerce").notna().any():
+        # 沒有標題列 (第一列就是資料)
+        frame = pd.read_csv(io.BytesIO(raw), header=None)
+    numeric = frame.apply(pd.to_numeric, errors="coerce")
+    value_cols = [c for c in frame.columns if numeric[c].notna().mean() > 0.5]
+    if not value_cols:
+        raise ValueError("CSV 中找不到數值欄位")
+
+    values = numeric[value_cols[-1]]
+    filled = int(values.isna().sum())
+    values = values.interpolate(limit_direction="both").to_numpy(dtype=float)
+    if len(values) == 0 or np.isnan(values).all():
+        raise ValueError("CSV 中沒有碳排強度資料")
+
+    timestamps = None
+    for col in frame.columns:
+        if col in value_cols:
+            continue
+        parsed = pd.to_datetime(frame[col], errors="coerce")
+        if parsed.notna().mean() > 0.9:
+            timestamps = parsed
+            break
+
+    return {
+        "values": values * INTENSITY_UNITS[unit],
+        "timestamps": timestamps,
+        "digest": hashlib.blake2b(raw, digest_size=16).hexdigest() + unit,
+        "filled": filled
+    }
+
+
+# 一次生產的逐時耗電量 (kWh)：第 k 個元素為開工後 [k, k+1) 小時內的耗電量
+# 各站功率為分段常數 (加工功率 -> 閒置功率)，累積耗電量 F(t) 為分段線性；
+# 以斜率變化點 (t_e, Δ) 寫成 F(t) = Σ_{t_e < t} Δ·(t - t_e)，整數時間點一次以 searchsorted 求值
+def hourly_energy_profile(process_times, idle_times, working_power, idle_power, layout="sequential"):
+    if layout not in LAYOUTS:
+        raise ValueError(f"未知的排程方式：{layout}")
+    pt = np.asarray(process_times, dtype=float)
+    idle = np.asarray(idle_times, dtype=float)
+    wp = np.broadcast_to(np.asarray(working_power, dtype=float), pt.shape)
+    ip = np.broadcast_to(np.asarray(idle_power, dtype=float), pt.shape)
+    span = pt + idle
+    if len(pt) == 0:
+        return np.zeros(0)
+
+    if layout == "sequential":
+        start = np.concatenate(([0.0], np.cumsum(span)[:-1]))
+    else:
+        start = np.zeros_like(span)
+
+    t_events = np.concatenate((start, start + pt, start + span))
+    slopes = np.concatenate((wp, ip - wp, -ip))
+    order = np.argsort(t_events, kind="stable")
+    t_events = t_events[order]
+    slopes = slopes[order]
+
+    run_hours = max(int(np.ceil((start + span).max())), 1)
+    grid = np.arange(run_hours + 1, dtype=float)
+    idx = np.searchsorted(t_events, grid, side="left")
+    slope_sum = np.concatenate(([0.0], np.cumsum(slopes)))
+    weighted_sum = np.concatenate(([0.0], np.cumsum(slopes * t_events)))
+    cumulative = grid * slope_sum[idx] - weighted_sum[idx]
+    return np.maximum(np.diff(cumulative), 0.0)
+
+
+# 每個可行開工時刻 (整點，整次生產落在資料範圍內) 的碳排放 (kg)
+def start_time_emissions(hourly_energy, intensity):
+    intensity = np.asarray(intensity, dtype=float)
+    hourly_energy = np.asarray(hourly_energy, dtype=float)
+    if len(hourly_energy) == 0 or len(intensity) < len(hourly_energy):
+        return np.zeros(0)
+    return np.correlate(intensity, hourly_energy, mode="valid")
+
+
+# 碳排放最低的 k 個開工時刻；separate 時各時段互不重疊 (相鄰幾個小時的開工只算一個時段)
+def best_windows(emissions, run_hours, k=5, separate=True):
+    emissions = np.asarray(emissions, dtype=float)
+    order = np.argsort(emissions, kind="stable")
+    if not separate:
+        return order[:k].tolist()
+
+    chosen = []
+    taken = np.zeros(len(emissions), dtype=bool)
+    for s in order.tolist():
+        if taken[s]:
+            continue
+        chosen.append(s)
+        if len(chosen) == k:
+            break
+        taken[max(0, s - run_hours + 1):s + run_hours] = True
+    return chosen
+
+
+# 整合：回傳逐時耗電量、各開工時刻碳排放與最佳時段
+# {"hourly_energy", "emissions", "run_hours", "total_energy", "best": [{"start", "emission"}...], "min", "max", "mean"}
+def evaluate_start_times(process_times, idle_times, working_power, idle_power, intensity, layout="sequential", k=5):
+    hourly_energy = hourly_energy_profile(process_times, idle_times, working_power, idle_power, layout)
+    emissions = start_time_emissions(hourly_energy, intensity)
+    run_hours = len(hourly_energy)
+    out = {
+        "hourly_energy": hourly_energy,
+        "emissions": emissions,
+        "run_hours": run_hours,
+        "total_energy": float(hourly_energy.sum()),
+        "best": [],
+        "min": None, "max": None, "mean": None
+    }
+    if len(emissions):
+        out["best"] = [{"start": s, "emission": float(emissions[s])} for s in best_windows(emissions, run_hours, k)]
+        out["min"] = float(emissions.min())
+        out["max"] = float(emissions.max())
+        out["mean"] = float(emissions.mean())
+    return out
@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from station_model import StationModel
+
+# --- Parquet / Arrow 情境格式 ---
+# 工作站表格以 Parquet 儲存：純量欄位為 float64 / string，capacities、probs 為原生 list<float64>，
+# 載入時直接由 Arrow 欄位編譯 StationModel，不必逐格解析 "[0, 700, 1400]" 字串；
+# 檔案以 memory map 讀取。xlsx 仍可匯入 / 匯出 (見 storage 與 core)。
+# pyarrow 只在讀寫 Parquet 時才載入。
+
+FORMAT_VERSION = "1"
+SCALAR_COLUMNS = ["p", "working_power", "idle_power", "processTime", "timeLimit"]
+LIST_COLUMNS = ["capacities", "probs"]
+SCALAR_DEFAULTS = {"p": 0.96, "working_power": 2.89, "idle_power": 0.4335}
+# Parquet 檔案開頭 / 結尾的識別碼
+PARQUET_MAGIC = b"PAR1"
+
+
+def is_parquet_path(path):
+    return str(path).lower().endswith((".parquet", ".pq"))
+
+
+def is_parquet_bytes(bytes_data):
+    return bytes(bytes_data[:4]) == PARQUET_MAGIC
+
+
+def _schema():
+    import pyarrow as pa
+
+    fields = [pa.field("name", pa.string())]
+    fields += [pa.field(col, pa.float64()) for col in SCALAR_COLUMNS]
+    fields += [pa.field(col, pa.list_(pa.float64())) for col in LIST_COLUMNS]
+    return pa.schema(fields)
+
+
+# 列表欄位 (字串 / list / tuple / ndarray 皆可) 轉成 list<float64>；整欄一次拆解，無法解析的列拋出 ValueError
+# 數值以 float() 相同的規則解析 (pd.to_numeric 的快速解析在末位可能有誤差，存檔時不能用)
+def _list_array(series, column):
+    import pyarrow as pa
+
+    def as_text(v):
+        if isinstance(v, (list, tuple, np.ndarray)):
+            return ", ".join(repr(float(x)) for x in v)
+        return v
+
+    text = series.astype(object).map(as_text)
+    text = text.where(text.notna(), "").astype(str).str.replace("[", "", regex=False).str.replace("]", "", regex=False)
+    tokens = text.str.split(",").explode().str.strip()
+    row_ids = np.repeat(np.arange(len(text)), text.str.count(",").to_numpy() + 1)
+    keep = (tokens != "").to_numpy()
+    tokens = tokens[keep].tolist()
+    row_ids = row_ids[keep]
+
+    try:
+        flat = np.array(tokens, dtype=float)
+    except ValueError:
+        bad = set()
+        for row, token in zip(row_ids.tolist(), tokens):
+            try:
+                float(token)
+            except ValueError:
+                bad.add(row)
+        rows = ", ".join(str(i + 1) for i in sorted(bad)[:10])
+        raise ValueError(f"{column} 欄位第 {rows} 列無法解析為數值列表")
+
+    offsets = np.zeros(len(text) + 1, dtype=np.int32)
+    np.cumsum(np.bincount(row_ids, minlength=len(text)), out=offsets[1:])
+    return pa.ListArray.from_arrays(pa.array(offsets), pa.array(flat, type=pa.float64()))
+
+
+# DataFrame -> Arrow Table (固定欄位順序與型別；其他欄位照 pandas 型別附在後面)
+# excel_scalars (B1–B6 權威值) 存在 schema metadata 中
+def to_arrow_table(df, excel_scalars=None):
+    import pandas as pd
+    import pyarrow as pa
+
+    schema = _schema()
+    n = len(df)
+    arrays = []
+    for field in schema:
+        col = field.name
+        if col in LIST_COLUMNS:
+            series = df[col] if col in df.columns else pd.Series([""] * n, dtype=object)
+            arrays.append(_list_array(series, col))
+        elif col == "name":
+            names = df[col].astype(str).tolist() if col in df.columns else [f"工作站{i + 1}" for i in range(n)]
+            arrays.append(pa.array(names, type=pa.string()))
+        elif col in df.columns:
+            arrays.append(pa.array(pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float), type=pa.float64()))
+        else:
+            arrays.append(pa.nulls(n, type=pa.float64()))
+
+    fields = list(schema)
+    for col in df.columns:
+        if col not in schema.names:
+            extra = pa.Array.from_pandas(df[col])
+            fields.append(pa.field(str(col), extra.type))
+            arrays.append(extra)
+
+    metadata = {b"scenario.format": FORMAT_VERSION.encode("ascii")}
+    if excel_scalars:
+        metadata[b"scenario.excel_scalars"] = json.dumps(excel_scalars, default=float).encode("utf-8")
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields, metadata=metadata))
+
+
+def write_parquet(df, path_or_file, excel_scalars=None):
+    import pyarrow.parquet as pq
+
+    pq.write_table(to_arrow_table(df, excel_scalars), path_or_file, compression="zstd")
+
+
+# 讀取 Parquet (路徑以 memory map 讀取；bytes 直接包成 Arrow buffer，不另外複製)
+def read_table(source):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return pq.read_table(pa.BufferReader(pa.py_buffer(source)))
+    return pq.read_table(source, memory_map=True)
+
+
+def table_excel_scalars(table):
+    raw = (table.schema.metadata or {}).get(b"scenario.excel_scalars")
+    return json.loads(raw) if raw else None
+
+
+def _list_offsets_values(table, col):
+    import pyarrow as pa
+
+    column = table.column(col).combine_chunks() if table.num_rows else pa.array([], type=pa.list_(pa.float64()))
+    column = column.fill_null(pa.scalar([], type=column.type))
+    offsets = column.offsets.to_numpy()
+    values = column.values.to_numpy(zero_copy_only=False)[offsets[0]:offsets[-1]]
+    return offsets - offsets[0], values
+
+
+def _list_tuples(table, col):
+    if col not in table.column_names:
+        return ((),) * table.num_rows
+    offsets, values = _list_offsets_values(table, col)
+    flat = values.tolist()
+    return tuple(tuple(flat[a:b]) for a, b in zip(offsets[:-1].tolist(), offsets[1:].tolist()))
+
+
+# 整欄轉成與 get_default_data 相同的 "[0, 700, 1400]" 字串 (資料編輯器以文字欄位編輯)
+def _list_strings(table, col):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if col not in table.column_names:
+        return ["[]"] * table.num_rows
+    offsets, values = _list_offsets_values(table, col)
+    text = pc.cast(pa.array(values, type=pa.float64()), pa.string())
+    joined = pc.binary_join(pa.ListArray.from_arrays(pa.array(offsets.astype(np.int32)), text), ", ")
+    return pc.binary_join_element_wise("[", joined, "]", "").to_pylist()
+
+
+def _scalar_column(table, col):
+    if col not in table.column_names:
+        return np.full(table.num_rows, SCALAR_DEFAULTS.get(col, np.nan), dtype=float)
+    return table.column(col).to_numpy().astype(float)
+
+
+# 由 Arrow Table 直接編譯工作站模型 (列表欄位取 offsets / values，不經過字串)
+def model_from_table(table):
+    names = table.column("name").to_pylist() if "name" in table.column_names else [f"工作站{i + 1}" for i in range(table.num_rows)]
+    cols = {col: _scalar_column(table, col) for col in SCALAR_COLUMNS}
+    return StationModel.from_columns(
+        names,
+        cols["processTime"], cols["timeLimit"],
+        cols["p"], cols["working_power"], cols["idle_power"],
+        _list_tuples(table, "capacities"), _list_tuples(table, "probs")
+    )
+
+
+# Arrow Table -> 編輯器使用的 DataFrame (列表欄位轉為字串，其餘照原型別)
+def table_to_frame(table):
+    frame = table.drop_columns([c for c in LIST_COLUMNS if c in table.column_names]).to_pandas()
+    for col in LIST_COLUMNS:
+        frame[col] = _list_strings(table, col)
+    order = [c for c in ["name"] + SCALAR_COLUMNS + LIST_COLUMNS if c in frame.columns]
+    return frame[order + [c for c in frame.columns if c not in order]]
+
+
+# 讀取情境檔：回傳 (df, excel_scalars, model)；表格為空時 model 為 None
+def read_scenario(source):
+    table = read_table(source)
+    model = model_from_table(table) if table.num_rows else None
+    return table_to_frame(table), table_excel_scalars(table), model
+
+
+# xlsx <-> Parquet 轉換：權威格式 xlsx 的 B1–B6 純量一併寫入 Parquet metadata；
+# 輸出為 xlsx 時寫成一般表格 (與儲存按鈕相同)
+def main(argv=None):
+    import core
+    from storage import atomic_write_excel, atomic_write_parquet
+
+    parser = argparse.ArgumentParser(description="工作站情境檔 xlsx / Parquet 互轉")
+    parser.add_argument("source", help="來源檔 (.xlsx 或 .parquet)")
+    parser.add_argument("target", help="輸出檔 (.xlsx 或 .parquet)")
+    args = parser.parse_args(argv)
+    # 來源不存在時 core 會回傳內建預設資料，不能當成轉換結果寫出
+    if not os.path.exists(args.source):
+        parser.error(f"找不到來源檔：{args.source}")
+
+    def fail(level, message):
+        raise SystemExit(message)
+
+    if is_parquet_path(args.source):
+        df, excel_scalars, _ = read_scenario(args.source)
+    else:
+        df, excel_scalars = core.load_data_from_excel_authority(args.source, notify=fail)
+
+    if is_parquet_path(args.target):
+        atomic_write_parquet(df, args.target, excel_scalars)
+    else:
+        atomic_write_excel(df, args.target)
+    print(f"{args.source} -> {args.target}：{len(df)} 個工作站", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+#在終端機輸入：python columnar.py 專題excel.xlsx 專題.parquet
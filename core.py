@@ -0,0 +1,505 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from reliability import exact_reliability, input_chain, build_reliability_index, lookup_reliability, find_critical_demands
+from station_model import StationModel, parse_list_from_string, compile_station_model, as_station_model
+from staged_metrics import StagedEvaluator, evaluate_metrics
+from columnar import is_parquet_path, is_parquet_bytes, read_scenario
+
+# --- 核心計算與 I/O (不依賴 Streamlit) ---
+# 可直接在批次作業或測試中 import；pandas / openpyxl / pyarrow 只在需要時才載入。
+
+# 預設 Excel 路徑；同目錄下同名的 .parquet 存在時優先讀取 (見 default_scenario_path)
+DEFAULT_EXCEL_PATH = "/mnt/data/專題excel.xlsx"
+DEFAULT_PARQUET_PATH = os.path.splitext(DEFAULT_EXCEL_PATH)[0] + ".parquet"
+
+__all__ = [
+    "DEFAULT_EXCEL_PATH", "DEFAULT_PARQUET_PATH", "default_scenario_path",
+    "StationModel", "StagedEvaluator", "MetricsCache",
+    "get_default_data", "parse_list_from_string", "parse_list_from_excel_cell",
+    "load_data_from_excel_authority", "load_authority_with_model", "workbook_cache_stats", "clear_workbook_cache",
+    "parse_workbook_sheets",
+    "compile_station_model", "as_station_model", "station_fingerprint",
+    "calculate_metrics", "calculate_metrics_batch", "calculate_metrics_grid", "critical_demands",
+    "get_metrics_cache", "calculate_metrics_cached", "calculate_metrics_batch_cached",
+    "get_upload_cache", "upload_digest", "load_uploaded_workbook",
+]
+
+logger = logging.getLogger(__name__)
+
+
+def get_default_data():
+    import pandas as pd
+
+    return pd.DataFrame([
+        {"name": "工作站1", "processTime": 0.00168622689869149, "timeLimit": 10, "capacities": "[0, 700, 1400, 2100, 2800, 3500]", "probs": "[0.001, 0.003, 0.005, 0.007, 0.012, 0.972]", "p": 0.96, "working_power": 2.89, "idle_power": 0.4335},
+        {"name": "工作站2", "processTime": 0.0100654252642174, "timeLimit": 30, "capacities": "[0, 675, 1350, 2025, 2700, 3375]", "probs": "[0.001, 0.003, 0.005, 0.007, 0.012, 0.972]", "p": 0.96, "working_power": 2.89, "idle_power": 0.4335},
+        {"name": "工作站3", "processTime": 0.032277587250353, "timeLimit": 100, "capacities": "[0, 600, 1200, 1800, 2400, 3000]", "probs": "[0.001, 0.003, 0.005, 0.007, 0.012, 0.972]", "p": 0.96, "working_power": 2.89, "idle_power": 0.4335},
+        {"name": "工作站4", "processTime": 0.00873202294775631, "timeLimit": 25, "capacities": "[0, 565, 1130, 1695, 2260, 2825]", "probs": "[0.001, 0.003, 0.005, 0.007, 0.012, 0.972]", "p": 0.96, "working_power": 2.89, "idle_power": 0.4335},
+        {"name": "工作站5", "processTime": 0.0252244980324892, "timeLimit": 70, "capacities": "[0, 540, 1080, 1620, 2160, 2700]", "probs": "[0.001, 0.003, 0.005, 0.007, 0.012, 0.972]", "p": 0.96, "working_power": 2.89, "idle_power": 0.4335}
+    ])
+
+
+# 輔助函式：解析 Excel 字串列表
+def parse_list_from_excel_cell(cell_value):
+    if cell_value is None: return []
+    if isinstance(cell_value, (int, float)): return [cell_value]
+    s = str(cell_value).strip()
+    # 修改重點：同樣先移除方括號
+    s = s.replace('[', '').replace(']', '')
+    try:
+        return [float(x.strip()) for x in s.split(',') if x.strip()]
+    except:
+        return []
+
+
+# 預設的提示方式：寫入 log (UI 端可傳入 notify 改為 toast / error)
+def _log_notice(level, message):
+    logger.log(logging.ERROR if level == "error" else logging.WARNING, message)
+
+
+# 以唯讀串流模式解析權威格式工作表 (B1–B6 純量、第 8 列起為工作站)，只走訪一次所有列
+# 回傳 (df, excel_scalars)
+def _parse_authority_sheet(ws_val):
+    import pandas as pd
+
+    scalar_cells = []
+    stations = []
+    for row_idx, row in enumerate(ws_val.iter_rows(min_row=1, max_col=8, values_only=True), start=1):
+        row = tuple(row) + (None,) * (8 - len(row))
+        if row_idx <= 6:
+            scalar_cells.append(row[1])
+            continue
+        if row_idx < 8:
+            continue
+        if not row[0]: break
+        name, p_t, w_p, i_p, p_val, cap_str, prob_str, t_lim = row
+
+        stations.append({
+            "name": str(name),
+            "processTime": float(p_t) if p_t is not None else 0.0,
+            "working_power": float(w_p) if w_p is not None else 0.0,
+            "idle_power": float(i_p) if i_p is not None else 0.0,
+            "p": float(p_val) if p_val is not None else 0.96,
+            "capacities": parse_list_from_excel_cell(cap_str),
+            "probs": parse_list_from_excel_cell(prob_str),
+            "timeLimit": float(t_lim) if t_lim is not None else 0.0
+        })
+
+    scalar_cells += [None] * (6 - len(scalar_cells))
+    excel_scalars = dict(zip(("d", "I", "carbon_factor", "reliability", "total_energy", "carbon_emission"), scalar_cells))
+    return pd.DataFrame(stations), excel_scalars
+
+
+# 一般表格格式工作表 (第一列為欄位名稱，例如儲存按鈕寫出的檔案)，遇到空白列即停止
+def _parse_table_sheet(ws_val):
+    import pandas as pd
+
+    rows = ws_val.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return pd.DataFrame()
+    columns = [str(c) if c is not None else "" for c in header]
+    width = max((i + 1 for i, c in enumerate(columns) if c), default=0)
+    records = []
+    for row in rows:
+        row = tuple(row[:width]) + (None,) * (width - len(row))
+        if all(v is None for v in row):
+            break
+        records.append(row)
+    return pd.DataFrame(records, columns=columns[:width])
+
+
+def _is_table_sheet(ws_val):
+    first = next(ws_val.iter_rows(min_row=1, max_row=1, values_only=True), ())
+    header = {str(c) for c in first if c is not None}
+    return {"name", "capacities"} <= header
+
+
+# 以唯讀串流模式解析權威格式 xlsx 的使用中工作表
+# 回傳 (df, excel_scalars)；讀取錯誤直接拋出，由呼叫端決定如何處理
+def _parse_authority_workbook(path):
+    from openpyxl import load_workbook
+
+    wb_val = load_workbook(path, read_only=True, data_only=True)
+    try:
+        return _parse_authority_sheet(wb_val.active)
+    finally:
+        wb_val.close()
+
+
+# 解析活頁簿中的每一個工作表 (多產線)：權威格式或一般表格格式皆可，空白工作表略過
+# source 為路徑或檔案物件；回傳 [(工作表名稱, df, excel_scalars 或 None)...]
+def parse_workbook_sheets(source):
+    from openpyxl import load_workbook
+
+    wb_val = load_workbook(source, read_only=True, data_only=True)
+    try:
+        sheets = []
+        for ws_val in wb_val.worksheets:
+            if _is_table_sheet(ws_val):
+                df, excel_scalars = _parse_table_sheet(ws_val), None
+            else:
+                df, excel_scalars = _parse_authority_sheet(ws_val)
+                if excel_scalars.get('I') is None or excel_scalars.get('reliability') is None:
+                    excel_scalars = None
+            if not df.empty:
+                sheets.append((ws_val.title, df, excel_scalars))
+        return sheets
+    finally:
+        wb_val.close()
+
+
+# 讀取情境檔：Parquet 直接由 Arrow 欄位編譯模型，xlsx 依權威格式解析
+# 回傳 (df, excel_scalars, model)
+def _parse_scenario_file(path):
+    if is_parquet_path(path):
+        df, excel_scalars, model = read_scenario(path)
+        return df, excel_scalars or {}, model
+    df, excel_scalars = _parse_authority_workbook(path)
+    return df, excel_scalars, compile_station_model(df) if not df.empty else None
+
+
+# 預設情境檔：Parquet 版本存在時優先使用 (不必經過 openpyxl)
+def default_scenario_path():
+    return DEFAULT_PARQUET_PATH if os.path.exists(DEFAULT_PARQUET_PATH) else DEFAULT_EXCEL_PATH
+
+
+# --- 已解析活頁簿快取 (同一程序內跨 session 共用) ---
+# key 為絕對路徑；檔案 mtime / 大小不變時直接命中，改變時再比對內容雜湊，雜湊也不同才重新解析
+_WORKBOOK_CACHE = {}
+_WORKBOOK_LOCK = threading.Lock()
+_WORKBOOK_STATS = {"hits": 0, "rehashes": 0, "parses": 0}
+
+
+def _file_digest(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# 回傳快取項目 {"df", "excel_scalars", "model", "digest", ...}；解析失敗時拋出例外 (不快取)
+def _cached_workbook(path):
+    key = os.path.abspath(path)
+    stat = os.stat(key)
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    with _WORKBOOK_LOCK:
+        entry = _WORKBOOK_CACHE.get(key)
+        if entry is not None and entry["signature"] == signature:
+            _WORKBOOK_STATS["hits"] += 1
+            return entry
+
+    digest = _file_digest(key)
+    with _WORKBOOK_LOCK:
+        entry = _WORKBOOK_CACHE.get(key)
+        if entry is not None and entry["digest"] == digest:
+            # 只是被重新存檔 / touch，內容沒變
+            entry["signature"] = signature
+            _WORKBOOK_STATS["rehashes"] += 1
+            return entry
+
+    df, excel_scalars, model = _parse_scenario_file(key)
+    entry = {
+        "signature": signature,
+        "digest": digest,
+        "df": df,
+        "excel_scalars": excel_scalars,
+        "model": model
+    }
+    with _WORKBOOK_LOCK:
+        _WORKBOOK_CACHE[key] = entry
+        _WORKBOOK_STATS["parses"] += 1
+    return entry
+
+
+def workbook_cache_stats():
+    with _WORKBOOK_LOCK:
+        return dict(_WORKBOOK_STATS, size=len(_WORKBOOK_CACHE))
+
+
+def clear_workbook_cache():
+    with _WORKBOOK_LOCK:
+        _WORKBOOK_CACHE.clear()
+        for k in _WORKBOOK_STATS:
+            _WORKBOOK_STATS[k] = 0
+
+
+# 核心載入函式 (Authority Load)
+# 回傳 (df, excel_scalars, model)；model 為已編譯的 StationModel (使用預設資料時為 None)
+# 讀取失敗或為空時回傳預設資料，並透過 notify(level, message) 提示
+def load_authority_with_model(path=DEFAULT_EXCEL_PATH, notify=None):
+    if notify is None:
+        notify = _log_notice
+
+    # 修正：如果路徑不存在，回傳預設資料
+    if not os.path.exists(path):
+        return get_default_data(), None, None
+
+    try:
+        entry = _cached_workbook(path)
+    except Exception as e:
+        notify("error", f"⚠️ 讀取 Excel 發生未預期錯誤：{e}。已退回內建預設資料。")
+        return get_default_data(), None, None
+
+    # 修正：如果讀出來是空的，強制回傳預設資料
+    if entry["df"].empty:
+        notify("warning", "⚠️ 偵測到 Excel 檔案為空，已載入預設資料")
+        return get_default_data(), None, None
+
+    excel_scalars = entry["excel_scalars"]
+    if excel_scalars.get('I') is None or excel_scalars.get('reliability') is None:
+        excel_scalars = None
+    else:
+        excel_scalars = dict(excel_scalars)
+
+    # 快取內容跨 session 共用，交給呼叫端的 df 一律是複本
+    return entry["df"].copy(), excel_scalars, entry["model"]
+
+
+# 回傳 (df, excel_scalars)
+def load_data_from_excel_authority(path=DEFAULT_EXCEL_PATH, notify=None):
+    df, excel_scalars, _ = load_authority_with_model(path, notify)
+    return df, excel_scalars
+
+
+# 計算邏輯 (Block B)：各階段實作見 staged_metrics；傳入 evaluator 時只重算輸入有變動的階段
+# excel_auth 為 load_data_from_excel_authority 讀到的權威值 (可為 None)
+# index 為 get_reliability_index 的斷點索引 (可為 None)：傳入時 Rd 以輸出量二分搜尋查表
+# 程式算出的 I 與 Excel 不符時，結果會多一個 "input_mismatch" 欄位 (算出的 I, Excel 的 I)
+def calculate_metrics(demand, carbon_factor, _station_data, excel_auth=None, evaluator=None, index=None):
+    model = as_station_model(_station_data)
+
+    if evaluator is None:
+        return evaluate_metrics(demand, carbon_factor, model, excel_auth, index)
+    return evaluator.evaluate(demand, carbon_factor, model, excel_auth, index)
+
+
+# 批次計算 (Block B 向量化版)：demands 與 carbon_factors 可為純量或陣列 (依 NumPy 規則廣播)
+# 回傳欄位與 calculate_metrics 相同，但皆為陣列；各站欄位多一個最後維度 n
+def calculate_metrics_batch(demands, carbon_factors, _station_data, excel_auth=None, index=None):
+    model = as_station_model(_station_data)
+    d_arr, cf_arr = np.broadcast_arrays(np.asarray(demands, dtype=float), np.asarray(carbon_factors, dtype=float))
+    shape = d_arr.shape
+    d_flat = d_arr.ravel()
+    cf_flat = cf_arr.ravel()
+
+    # 能耗與可靠度只與輸出量有關，相同的 d 只算一次
+    u_demands, inv = np.unique(d_flat, return_inverse=True)
+    if len(u_demands) == len(d_flat):
+        u_demands, inv = d_flat, slice(None)
+
+    inputs = input_chain(u_demands, model.p_list)
+    rounded_inputs = np.ceil(inputs)
+
+    process_times = rounded_inputs * model.process_time
+    idle_times = np.maximum(0, model.time_limit - process_times)
+    energies = model.working_power * process_times + model.idle_power * idle_times
+    total_energy = energies.sum(axis=1)
+
+    if index is None:
+        reliability = exact_reliability(rounded_inputs, model.caps, model.tails)
+    else:
+        reliability = lookup_reliability(index, u_demands)
+
+    out = {
+        "inputs": inputs[inv],
+        "rounded_inputs": rounded_inputs[inv].astype(np.int64),
+        "process_times": process_times[inv],
+        "idle_times": idle_times[inv],
+        "energies": energies[inv],
+        "total_energy": total_energy[inv],
+        "carbon_emission": total_energy[inv] * cf_flat,
+        "reliability": reliability[inv],
+        "total_process_time": process_times.sum(axis=1)[inv],
+        "total_idle_time": idle_times.sum(axis=1)[inv]
+    }
+
+    # Excel 權威情境 (d 與 CO₂ 係數皆吻合) 交由單點計算處理覆寫規則
+    if excel_auth is not None:
+        try:
+            auth_rows = np.nonzero(
+                np.isclose(d_flat, excel_auth['d'], rtol=0, atol=1e-9) &
+                np.isclose(cf_flat, excel_auth['carbon_factor'], rtol=0, atol=1e-9)
+            )[0]
+        except:
+            auth_rows = []
+        for row in auth_rows:
+            single = calculate_metrics(d_flat[row], cf_flat[row], model, excel_auth)
+            for key in out:
+                out[key][row] = single[key]
+
+    for key in out:
+        out[key] = out[key].reshape(shape + out[key].shape[1:])
+    out["time_max_limit"] = float(model.time_limit.sum())
+
+    return out
+
+
+# 輸出量 x CO₂ 係數 二維情境網格：Rd 與能耗只與輸出量有關，沿輸出量軸批次計算一次，
+# 碳排放再以外積展開成 len(demands) x len(carbon_factors)；網格不套用 Excel 權威值覆寫
+def calculate_metrics_grid(demands, carbon_factors, _station_data):
+    model = as_station_model(_station_data)
+    d = np.asarray(demands, dtype=float)
+    cf = np.asarray(carbon_factors, dtype=float)
+    per_demand = calculate_metrics_batch(d, 1.0, model)
+    total_energy = per_demand["total_energy"]
+    return {
+        "demands": d,
+        "carbon_factors": cf,
+        "reliability": per_demand["reliability"],
+        "total_energy": total_energy,
+        "carbon_emission": np.multiply.outer(total_energy, cf)
+    }
+
+
+# 可靠度斷點索引：只與 p 及容量 / 機率有關，依這兩部分的指紋在共用快取中保存 (能耗欄位變動不重建)
+def get_reliability_index(_station_data, cache=None):
+    if cache is None:
+        cache = get_metrics_cache()
+    model = as_station_model(_station_data)
+    key = ("reliability_index", model.stage_fingerprints["chain"], model.stage_fingerprints["states"])
+    return cache.get_or_compute(key, lambda: build_reliability_index(model.p_list, model.capacities, model.probs))
+
+
+# 以斷點索引找出 Rd 維持 0.9 / 0.8 以上的最大輸出量
+def critical_demands(_station_data, levels=(0.9, 0.8)):
+    return find_critical_demands(get_reliability_index(_station_data), levels)
+
+
+# --- 計算結果快取 (同一程序內跨 session 共用) ---
+# LRU 快取：以工作站設定指紋 + 參數為 key，命中時直接回傳 (回傳值請勿修改)
+class MetricsCache:
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+
+        value = compute()
+
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+
+# 模組只會被 import 一次，因此同一個 server 程序內所有使用者共用這份快取
+_METRICS_CACHE = MetricsCache(maxsize=256)
+
+
+def get_metrics_cache():
+    return _METRICS_CACHE
+
+
+# 工作站設定指紋：正規化後的工作站資料取 BLAKE2 雜湊 (編譯模型時已算好)
+def station_fingerprint(_station_data):
+    return as_station_model(_station_data).fingerprint
+
+
+# Excel 權威值會覆寫計算結果，因此也必須是快取 key 的一部分
+def authority_fingerprint(excel_auth):
+    if excel_auth is None:
+        return None
+    return json.dumps(excel_auth, sort_keys=True, default=str)
+
+
+def calculate_metrics_cached(demand, carbon_factor, _station_data, excel_auth=None, evaluator=None, cache=None, index=None):
+    if cache is None:
+        cache = get_metrics_cache()
+    model = as_station_model(_station_data)
+    key = ("metrics", model.fingerprint, float(demand), float(carbon_factor), authority_fingerprint(excel_auth))
+    return cache.get_or_compute(key, lambda: calculate_metrics(demand, carbon_factor, model, excel_auth, evaluator, index))
+
+
+def calculate_metrics_batch_cached(demands, carbon_factors, _station_data, excel_auth=None, cache=None, index=None):
+    if cache is None:
+        cache = get_metrics_cache()
+    model = as_station_model(_station_data)
+    d_arr = np.asarray(demands, dtype=float)
+    cf_arr = np.asarray(carbon_factors, dtype=float)
+    key = (
+        "batch", model.fingerprint,
+        d_arr.shape, hashlib.blake2b(d_arr.tobytes(), digest_size=16).hexdigest(),
+        cf_arr.shape, hashlib.blake2b(cf_arr.tobytes(), digest_size=16).hexdigest(),
+        authority_fingerprint(excel_auth)
+    )
+    return cache.get_or_compute(key, lambda: calculate_metrics_batch(d_arr, cf_arr, model, excel_auth, index))
+
+
+# --- 上傳檔案快取 (同一程序內跨 session 共用) ---
+# 以檔案內容的 BLAKE2 摘要識別上傳檔，相同內容 (不論檔名) 只解析一次；最多保留 16 份
+_UPLOAD_CACHE = MetricsCache(maxsize=16)
+
+
+def get_upload_cache():
+    return _UPLOAD_CACHE
+
+
+def upload_digest(bytes_data):
+    return hashlib.blake2b(bytes_data, digest_size=16).hexdigest()
+
+
+# 解析上傳的 xlsx / Parquet (依檔案內容判斷)，回傳快取項目 {"digest", "df", "model"} (內容請勿修改)
+# model 為已編譯的 StationModel，欄位不足以編譯時為 None；讀取失敗或為空時拋出例外 (不快取)
+def load_uploaded_workbook(bytes_data, digest=None):
+    if digest is None:
+        digest = upload_digest(bytes_data)
+
+    def parse():
+        import io
+        import pandas as pd
+
+        if is_parquet_bytes(bytes_data):
+            df, _, model = read_scenario(bytes_data)
+        else:
+            df = pd.read_excel(io.BytesIO(bytes_data))
+            model = None
+        if df.empty:
+            raise ValueError("上傳的檔案中沒有資料")
+        if model is None:
+            try:
+                model = compile_station_model(df)
+            except Exception:
+                model = None
+        return {"digest": digest, "df": df, "model": model}
+
+    return _UPLOAD_CACHE.get_or_compute(("upload", digest), parse)
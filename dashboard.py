@@ -1,22 +1,35 @@
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 import pandas as pd
 import numpy as np
-import plotly.graph_objects as go
-import math
-import itertools
 import os
-import shutil
 import ast
-from datetime import datetime
-from openpyxl import load_workbook
 import time
-import io  # 新增 io 模組以處理檔案串流
+import core
+from core import DEFAULT_EXCEL_PATH, get_default_data, compile_station_model, critical_demands, get_metrics_cache
+from reliability import monte_carlo_reliability
+from staged_metrics import STAGES, StagedEvaluator
+from storage import submit_save
+from history import get_history
+from validation import validate_station_table, error_page, page_count
+from topology import build_topology_figure, selected_station
+from perf import PerfRecorder
+from optimizer import optimize_upgrades
+from editor_delta import has_changes, change_signature, apply_editor_changes
+from columnar import is_parquet_path
+from plant import load_plant_lines, evaluate_plant
+from telemetry import TelemetryFeed, open_source
+from carbon_profile import DEFAULT_INTENSITY_PATH, INTENSITY_UNITS, load_intensity_csv, evaluate_start_times
 
 # --- 0. 基本設定 ---
 st.set_page_config(page_title="製造系統可靠性戰情室", page_icon="🏭", layout="wide", initial_sidebar_state="expanded")
 
-# 預設 Excel 路徑
-DEFAULT_EXCEL_PATH = "/mnt/data/專題excel.xlsx"
+# 效能量測：每個 session 一個紀錄器，各階段以 perf_rec.span(...) / perf_rec.timed(...) 量測
+if "perf_recorder" not in st.session_state:
+    st.session_state.perf_recorder = PerfRecorder()
+perf_rec = st.session_state.perf_recorder
+perf_rec.new_run()
+rerun_start = time.perf_counter()
 
 # --- 1. 全局 CSS (保留原版樣式 + 新增 Modal 樣式) ---
 st.markdown(
@@ -170,41 +183,6 @@ st.markdown(
     .alert-yellow { border-color: #ffd86b; background-color: rgba(255, 216, 107, 0.25); box-shadow: 0 0 15px rgba(255, 216, 107, 0.15); }
     .alert-red { border-color: #ff6b6b; background-color: rgba(255, 107, 107, 0.25); box-shadow: 0 0 15px rgba(255, 107, 107, 0.15); }
 
-    /* 拓樸節點樣式 */
-    .topo-node {
-        width: 60px; height: 60px;
-        border-radius: 50%;
-        display: flex; align-items: center; justify-content: center;
-        font-weight: bold; color: #fff;
-        margin: 0 auto 10px auto;
-        border: 3px solid rgba(255,255,255,0.3);
-        box-shadow: 0 4px 10px rgba(0,0,0,0.3);
-        transition: all 0.3s ease;
-        position: relative;
-        z-index: 2;
-    }
-    .topo-connector {
-        position: absolute;
-        top: 30px; left: 50%;
-        width: 100%; height: 2px;
-        background: rgba(255,255,255,0.2);
-        z-index: 1;
-    }
-    /* 拓樸狀態 */
-    .node-green { background: linear-gradient(135deg, #4cd37a, #218838); box-shadow: 0 0 15px rgba(76, 211, 122, 0.4); }
-    .node-yellow { background: linear-gradient(135deg, #ffd86b, #e0a800); box-shadow: 0 0 15px rgba(255, 216, 107, 0.4); }
-    .node-red { background: linear-gradient(135deg, #ff6b6b, #c82333); box-shadow: 0 0 15px rgba(255, 107, 107, 0.6); }
-    
-    /* 失效節點 */
-    @keyframes failBlink { 0% { border-color: #ff0000; transform: scale(1.1); } 50% { border-color: #fff; transform: scale(1.2); } 100% { border-color: #ff0000; transform: scale(1.1); } }
-    .node-fail {
-        background: #8B0000 !important;
-        animation: failBlink 0.8s infinite, kpiShake 0.4s infinite !important;
-        box-shadow: 0 0 30px rgba(255, 0, 0, 0.8) !important;
-        z-index: 10;
-    }
-    .node-fail::after { content: "FAIL"; position: absolute; top: -20px; color: #ff6b6b; font-weight: 900; font-size: 14px; text-shadow: 0 2px 4px #000; }
-
     .detail-card-highlight {
         border: 2px solid #3fe6ff;
         background: rgba(63, 230, 255, 0.1);
@@ -294,205 +272,58 @@ st.markdown(
 )
 
 # --- 2. 輔助函式與核心計算邏輯 ---
+# 計算與 Excel 讀取邏輯位於 core (不依賴 Streamlit)，此處只負責把 session 狀態與提示接上
 
-def parse_list_from_string(s):
-    if isinstance(s, list):
-        return s
-    if pd.isna(s) or s == "":
-        return []
-    s = str(s).strip()
-    # 修改重點：先移除可能存在的方括號，統一格式
-    s = s.replace('[', '').replace(']', '')
-    try:
-        # 直接用逗號分隔並轉為浮點數列表
-        return [float(x.strip()) for x in s.split(',') if x.strip()]
-    except:
-        return None
-
-def get_default_data():
-    return pd.DataFrame([
-        {"name": "工作站1", "processTime": 0.00168622689869149, "timeLimit": 10, "capacities": "[0, 700, 1400, 2100, 2800, 3500]", "probs": "[0.001, 0.003, 0.005, 0.007, 0.012, 0.972]", "p": 0.96, "working_power": 2.89, "idle_power": 0.4335},
-        {"name": "工作站2", "processTime": 0.0100654252642174, "timeLimit": 30, "capacities": "[0, 675, 1350, 2025, 2700, 3375]", "probs": "[0.001, 0.003, 0.005, 0.007, 0.012, 0.972]", "p": 0.96, "working_power": 2.89, "idle_power": 0.4335},
-        {"name": "工作站3", "processTime": 0.032277587250353, "timeLimit": 100, "capacities": "[0, 600, 1200, 1800, 2400, 3000]", "probs": "[0.001, 0.003, 0.005, 0.007, 0.012, 0.972]", "p": 0.96, "working_power": 2.89, "idle_power": 0.4335},
-        {"name": "工作站4", "processTime": 0.00873202294775631, "timeLimit": 25, "capacities": "[0, 565, 1130, 1695, 2260, 2825]", "probs": "[0.001, 0.003, 0.005, 0.007, 0.012, 0.972]", "p": 0.96, "working_power": 2.89, "idle_power": 0.4335},
-        {"name": "工作站5", "processTime": 0.0252244980324892, "timeLimit": 70, "capacities": "[0, 540, 1080, 1620, 2160, 2700]", "probs": "[0.001, 0.003, 0.005, 0.007, 0.012, 0.972]", "p": 0.96, "working_power": 2.89, "idle_power": 0.4335}
-    ])
-
-# 輔助函式：解析 Excel 字串列表
-def parse_list_from_excel_cell(cell_value):
-    if cell_value is None: return []
-    if isinstance(cell_value, (int, float)): return [cell_value]
-    s = str(cell_value).strip()
-    # 修改重點：同樣先移除方括號
-    s = s.replace('[', '').replace(']', '')
-    try:
-        return [float(x.strip()) for x in s.split(',') if x.strip()]
-    except:
-        return []
-
-# 核心載入函式 (Authority Load)
-def load_data_from_excel_authority():
-    path = DEFAULT_EXCEL_PATH
-    
-    # 修正：如果路徑不存在，回傳預設資料
-    if not os.path.exists(path):
-        return get_default_data(), None
+# core 的提示轉成 Streamlit 元件
+def _st_notify(level, message):
+    if level == "error":
+        st.error(message)
+    else:
+        st.toast(message, icon="📂")
 
+# 重跑資料編輯器：fragment 重跑中只重跑編輯器，整頁執行中 (不允許 fragment 範圍) 改為整頁重跑
+def _rerun_editor():
     try:
-        wb_val = load_workbook(path, data_only=True)
-        ws_val = wb_val.active
-        
-        excel_scalars = {
-            "d": ws_val['B1'].value,
-            "I": ws_val['B2'].value,
-            "carbon_factor": ws_val['B3'].value,
-            "reliability": ws_val['B4'].value,
-            "total_energy": ws_val['B5'].value,
-            "carbon_emission": ws_val['B6'].value
-        }
-
-        stations = []
-        for row in ws_val.iter_rows(min_row=8, max_col=8, values_only=True):
-            if not row[0]: break 
-            name, p_t, w_p, i_p, p_val, cap_str, prob_str, t_lim = row
-            
-            stations.append({
-                "name": str(name),
-                "processTime": float(p_t) if p_t is not None else 0.0,
-                "working_power": float(w_p) if w_p is not None else 0.0,
-                "idle_power": float(i_p) if i_p is not None else 0.0,
-                "p": float(p_val) if p_val is not None else 0.96, 
-                "capacities": parse_list_from_excel_cell(cap_str),
-                "probs": parse_list_from_excel_cell(prob_str),
-                "timeLimit": float(t_lim) if t_lim is not None else 0.0
-            })
-            
-        df = pd.DataFrame(stations)
-        
-        # 修正：如果讀出來是空的，強制回傳預設資料
-        if df.empty:
-            st.toast("⚠️ 偵測到 Excel 檔案為空，已載入預設資料", icon="📂")
-            return get_default_data(), None
-
-        if excel_scalars['I'] is None or excel_scalars['reliability'] is None:
-            excel_scalars = None 
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
 
-        return df, excel_scalars
+# 即時遙測預設來源
+DEFAULT_TELEMETRY_SOURCE = "/mnt/data/telemetry.jsonl"
 
-    except Exception as e:
-        st.error(f"⚠️ 讀取 Excel 發生未預期錯誤：{e}。已退回內建預設資料。")
-        return get_default_data(), None
+# 核心載入函式 (Authority Load)：同一檔案在程序內只解析一次，新 session 直接取用快取
+# 預設檔有 Parquet 版本時優先讀取 Parquet
+def load_data_from_excel_authority():
+    return core.load_authority_with_model(core.default_scenario_path(), notify=_st_notify)
 
 # 初始化 Session State
 if "df_data" not in st.session_state:
-    df_loaded, excel_auth_data = load_data_from_excel_authority()
+    with perf_rec.span("excel_load"):
+        df_loaded, excel_auth_data, model_loaded = load_data_from_excel_authority()
     st.session_state.df_data = df_loaded
     st.session_state.excel_authority = excel_auth_data 
+    if model_loaded is not None:
+        # 沿用快取中已編譯的模型，儀表板不必再編譯一次
+        st.session_state.station_model = model_loaded
+        st.session_state.station_model_src = df_loaded
 
     if excel_auth_data:
         with st.expander("🛠️ Excel 讀取與驗證資訊 (開發人員)", expanded=False):
             st.write("Excel 權威值 (Read-Only):", excel_auth_data)
 
-# 計算邏輯 (Block B)
-def calculate_metrics(demand, carbon_factor, _station_data):
-    excel_auth = st.session_state.get("excel_authority", None)
-    
-    is_excel_scenario = False
-    if excel_auth is not None:
-        try:
-            d_match = math.isclose(demand, excel_auth['d'], abs_tol=1e-9)
-            c_match = math.isclose(carbon_factor, excel_auth['carbon_factor'], abs_tol=1e-9)
-            if d_match and c_match:
-                is_excel_scenario = True
-        except:
-            pass
-
-    n = len(_station_data)
-    p_list = [d.get('p', 0.96) for d in _station_data]
-    
-    product_p = 1.0
-    for p_val in p_list:
-        product_p *= p_val
-    
-    total_input = demand / product_p
-    
-    if is_excel_scenario and excel_auth['I'] is not None:
-        diff = abs(total_input - excel_auth['I'])
-        if diff > 1e-6: 
-            st.error(f"⚠️ 計算邏輯驗證失敗！程式算出的 I ({total_input:.4f}) 與 Excel ({excel_auth['I']:.4f}) 不符。")
-            total_input = excel_auth['I']
-
-    inputs = []
-    current_input = total_input
-    for i in range(n):
-        inputs.append(current_input)
-        current_input *= p_list[i] 
-    
-    rounded_inputs = [math.ceil(x) for x in inputs]
-
-    process_times = []
-    idle_times = []
-    energies = []
-
-    for i in range(n):
-        w_p = _station_data[i].get('working_power', 2.89)
-        i_p = _station_data[i].get('idle_power', 0.4335)
-        p_t_unit = _station_data[i]['processTime'] 
-        t_limit = _station_data[i]['timeLimit']
+# 計算邏輯 (Block B)：套用本 session 的 Excel 權威值，並顯示 I 驗證失敗的提示
+# Rd 由斷點索引二分搜尋查得 (索引依工作站設定快取，與臨界點共用)
+def calculate_metrics(demand, carbon_factor, _station_data, evaluator=None):
+    index = core.get_reliability_index(_station_data)
+    result = core.calculate_metrics_cached(demand, carbon_factor, _station_data, st.session_state.get("excel_authority", None), evaluator, index=index)
+    if "input_mismatch" in result:
+        total_input, excel_input = result["input_mismatch"]
+        st.error(f"⚠️ 計算邏輯驗證失敗！程式算出的 I ({total_input:.4f}) 與 Excel ({excel_input:.4f}) 不符。")
+    return result
 
-        p_time = rounded_inputs[i] * p_t_unit
-        i_time = max(0, t_limit - p_time)
-        
-        energy = (w_p * p_time) + (i_p * i_time)
-        
-        process_times.append(p_time)
-        idle_times.append(i_time)
-        energies.append(energy)
-
-    calc_total_energy = sum(energies)
-    calc_carbon = calc_total_energy * carbon_factor
-
-    total_probability = 0
-    indices_ranges = [range(len(d["capacities"])) for d in _station_data]
-    
-    limit_count = 0
-    for state_indices in itertools.product(*indices_ranges):
-        limit_count += 1
-        if limit_count > 100000: break 
-        
-        current_prob = 1.0
-        valid = True
-        for i, state_idx in enumerate(state_indices):
-            cap = _station_data[i]["capacities"][state_idx]
-            prob = _station_data[i]["probs"][state_idx]
-            if cap < rounded_inputs[i]:
-                valid = False
-                break
-            current_prob *= prob
-        if valid:
-            total_probability += current_prob
-
-    if is_excel_scenario:
-        if excel_auth['reliability'] is not None:
-            total_probability = excel_auth['reliability']
-        if excel_auth['total_energy'] is not None:
-            calc_total_energy = excel_auth['total_energy']
-        if excel_auth['carbon_emission'] is not None:
-            calc_carbon = excel_auth['carbon_emission']
-
-    return {
-        "inputs": inputs,
-        "rounded_inputs": rounded_inputs,
-        "process_times": process_times,
-        "idle_times": idle_times,
-        "energies": energies,
-        "total_energy": calc_total_energy,
-        "carbon_emission": calc_carbon,
-        "reliability": total_probability,
-        "time_max_limit": sum(d["timeLimit"] for d in _station_data),
-        "total_process_time": sum(process_times),
-        "total_idle_time": sum(idle_times)
-    }
+def calculate_metrics_batch(demands, carbon_factors, _station_data):
+    index = core.get_reliability_index(_station_data)
+    return core.calculate_metrics_batch_cached(demands, carbon_factors, _station_data, st.session_state.get("excel_authority", None), index=index)
 
 # --- 3. 頂部 Hero Section ---
 st.markdown("""
@@ -503,46 +334,38 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- 分頁順序 ---
-tab_dashboard, tab_editor = st.tabs(["📊 戰情儀表板 (Dashboard)", "📝 資料管理 (Excel 編輯)"])
+tab_dashboard, tab_editor, tab_plant = st.tabs(["📊 戰情儀表板 (Dashboard)", "📝 資料管理 (Excel 編輯)", "🏭 廠區總覽 (Plant)"])
 
 # --- TAB 1: 戰情儀表板 (Dashboard) ---
 with tab_dashboard:
     try:
         source_df = st.session_state.df_data
-        STATION_DATA = []
-        
-        # 這裡會遍歷資料，如果資料是空的就會導致 STATION_DATA 為空
-        for _, row in source_df.iterrows():
-            caps = parse_list_from_string(row['capacities'])
-            probs = parse_list_from_string(row['probs'])
-            if caps is None: caps = []
-            if probs is None: probs = []
-            
-            p_val = row['p'] if 'p' in row else 0.96
-            wp_val = row['working_power'] if 'working_power' in row else 2.89
-            ip_val = row['idle_power'] if 'idle_power' in row else 0.4335
-
-            STATION_DATA.append({
-                "name": str(row['name']),
-                "processTime": float(row['processTime']),
-                "timeLimit": float(row['timeLimit']),
-                "capacities": caps,
-                "probs": probs,
-                "p": float(p_val),
-                "working_power": float(wp_val),
-                "idle_power": float(ip_val)
-            })
+
+        # 只有在 df_data 被替換時才重新編譯工作站模型，其餘 rerun 直接沿用
+        if st.session_state.get("station_model_src") is not source_df:
+            with perf_rec.span("compile_model"):
+                st.session_state.station_model = compile_station_model(source_df)
+            st.session_state.station_model_src = source_df
+        model = st.session_state.station_model
+        # 記錄儀表板目前呈現的模型 (編輯器局部更新模型後據此提示尚未套用)
+        st.session_state.dashboard_model = model
             
-        FIXED_N = len(STATION_DATA)
+        FIXED_N = model.n
 
     except Exception as e:
         st.error(f"資料讀取錯誤: {e}")
-        STATION_DATA = []
+        model = None
         FIXED_N = 5
 
-    if not STATION_DATA:
+    if model is None or model.n == 0:
         st.warning("無有效工作站資料，請先至「資料管理」分頁設定。")
     else:
+        metrics_cache = get_metrics_cache()
+
+        # 可靠度臨界點：只在工作站設定變動時重建斷點索引
+        with perf_rec.span("critical_demands"):
+            crit_points = metrics_cache.get_or_compute(("critical", model.fingerprint), lambda: critical_demands(model))
+
         # --- 側欄控制 ---
         with st.sidebar:
             # 刪除 "調整後右側即時更新" 的小字
@@ -557,85 +380,145 @@ unsafe_allow_html=True
 
             demand = st.number_input("輸出量 (d)", min_value=1, value=2500, step=100)
             carbon_factor = st.number_input("CO₂ 係數 (kg/kWh)", min_value=0.001, value=0.474, step=0.001, format="%.3f")
+
+            rel_mode = st.radio("可靠度計算模式", ["精確計算", "蒙地卡羅估計"], horizontal=True)
+            if rel_mode == "蒙地卡羅估計":
+                mc_ci_width = st.select_slider("信賴區間寬度 (95%)", options=[0.01, 0.005, 0.002, 0.001], value=0.002)
             
             st.info("💡 功率與成功率 P 已改為在 Excel 中個別設定")
 
+            # 即時遙測：追蹤持續增長的 CSV / JSONL 檔或本機 UDP (udp://host:port)，以遙測值覆寫各站狀態
+            live_mode = st.toggle("📡 即時遙測模式", key="live_mode")
+            if live_mode:
+                live_spec = st.text_input("遙測來源", value=DEFAULT_TELEMETRY_SOURCE, key="live_source",
+                                          help="持續增長的 .jsonl / .csv 檔，或 udp://127.0.0.1:9999")
+                live_refresh = st.select_slider("更新間隔 (秒)", options=[0.5, 1.0, 2.0, 5.0], value=1.0, key="live_refresh")
+                live_key = (live_spec, model.fingerprint)
+                if st.session_state.get("telemetry_key") != live_key:
+                    old_feed = st.session_state.get("telemetry_feed")
+                    if old_feed is not None:
+                        old_feed.close()
+                    try:
+                        st.session_state.telemetry_feed = TelemetryFeed(model, open_source(live_spec))
+                        st.session_state.telemetry_key = live_key
+                    except Exception as e:
+                        st.session_state.telemetry_feed = None
+                        st.session_state.telemetry_key = None
+                        st.error(f"無法開啟遙測來源：{e}")
+                        live_mode = False
+                if live_mode and st.button("↩️ 清除遙測覆寫", use_container_width=True):
+                    st.session_state.telemetry_feed = TelemetryFeed(model, st.session_state.telemetry_feed.source)
+
             st.divider()
             
-            res = calculate_metrics(demand, carbon_factor, STATION_DATA)
+            # 每個 session 一個增量計算器：快取未命中時只重算輸入有變動的階段
+            if "staged_evaluator" not in st.session_state:
+                st.session_state.staged_evaluator = StagedEvaluator()
+            evaluator = st.session_state.staged_evaluator
+            evaluations_before = evaluator.evaluations
+
+            with perf_rec.span("calculate_metrics"):
+                res = calculate_metrics(demand, carbon_factor, model, evaluator)
+
+            if evaluator.evaluations > evaluations_before:
+                reused_stages, computed_stages = evaluator.last_reused, evaluator.last_computed
+            else:
+                reused_stages, computed_stages = STAGES, ()
+
+            # 蒙地卡羅模式：同樣以容量 / 機率指紋 + 取整輸入量快取 (固定亂數種子，結果可重現)
+            mc_res = None
+            if rel_mode == "蒙地卡羅估計":
+                mc_key = ("monte_carlo", model.stage_fingerprints["states"], tuple(res["rounded_inputs"]), mc_ci_width)
+                with perf_rec.span("monte_carlo"):
+                    mc_res = metrics_cache.get_or_compute(mc_key, lambda: monte_carlo_reliability(
+                        res["rounded_inputs"], model.caps, model.tails, ci_width=mc_ci_width, seed=0
+                    ))
             
             if res['reliability'] < 0.8:
                 st.error(f"可靠度過低：{res['reliability']:.4f}")
             else:
                 st.success(f"可靠度正常：{res['reliability']:.4f}")
 
+            for level, cp in crit_points.items():
+                if cp is not None:
+                    st.caption(f"Rd ≥ {level} 的最大輸出量：{cp['demand']}")
+
+            with st.expander("🛠️ 計算快取狀態 (開發人員)", expanded=False):
+                cache_stats = metrics_cache.stats()
+                st.caption(f"命中 {cache_stats['hits']} / 未命中 {cache_stats['misses']} (命中率 {cache_stats['hit_rate']:.1%})")
+                st.caption(f"項目 {cache_stats['size']} / {cache_stats['maxsize']}，已淘汰 {cache_stats['evictions']}")
+                st.caption(f"本次沿用階段：{', '.join(reused_stages) or '無'}")
+                st.caption(f"本次重新計算：{', '.join(computed_stages) or '無'}")
+                upload_stats = core.get_upload_cache().stats()
+                st.caption(f"上傳檔快取：{upload_stats['size']} / {upload_stats['maxsize']} 份，命中 {upload_stats['hits']}")
+                wb_stats = core.workbook_cache_stats()
+                st.caption(f"活頁簿快取：{wb_stats['size']} 個檔案，命中 {wb_stats['hits']}、重新驗證 {wb_stats['rehashes']}、解析 {wb_stats['parses']}")
+
         # --- 邏輯計算 ---
-        sys_reliability = res['reliability']
+        sys_reliability = res['reliability'] if mc_res is None else mc_res['estimate']
         sys_carbon = res['carbon_emission']
 
-        if sys_reliability >= 0.9:
-            sys_status = "green"
-            sys_anim = ""
-        elif sys_reliability >= 0.8:
-            sys_status = "yellow"
-            sys_anim = "kpi-pulse"
-        else:
-            sys_status = "red"
-            sys_anim = "kpi-shake"
-
-        failed_nodes = []
-        node_states = []
-        for i, station in enumerate(STATION_DATA):
-            station_input = res["rounded_inputs"][i]
-            max_cap = max(station["capacities"]) if station["capacities"] else 0
-            is_failed = station_input > max_cap
-            if is_failed:
-                failed_nodes.append({"id": i, "name": station["name"], "req": station_input, "cap": max_cap})
-                node_class = "node-fail"
+        # 各站節點樣式與產能不足清單 (即時遙測模式下每次更新都重算)
+        def station_states(model, res, sys_reliability):
+            if sys_reliability >= 0.9:
+                sys_status = "green"
+                sys_anim = ""
+            elif sys_reliability >= 0.8:
+                sys_status = "yellow"
+                sys_anim = "kpi-pulse"
             else:
-                node_class = f"node-{sys_status} {sys_anim}"
-            node_states.append(node_class)
+                sys_status = "red"
+                sys_anim = "kpi-shake"
+
+            failed_nodes = []
+            node_states = []
+            for i, name in enumerate(model.names):
+                station_input = res["rounded_inputs"][i]
+                max_cap = model.max_caps[i]
+                is_failed = station_input > max_cap
+                if is_failed:
+                    failed_nodes.append({"id": i, "name": name, "req": station_input, "cap": max_cap})
+                    node_class = "node-fail"
+                else:
+                    node_class = f"node-{sys_status} {sys_anim}"
+                node_states.append(node_class)
+            return node_states, failed_nodes
 
         # --- 拓樸圖顯示 ---
+        # 整條產線畫在單一圖中 (蛇形換行、可平移縮放)；點選節點只重跑此 fragment，不重跑整個頁面
         st.markdown("### 🕸️ 生產線即時拓樸監控")
         if "selected_node_idx" not in st.session_state:
             st.session_state.selected_node_idx = None
 
-        topo_cols = st.columns(FIXED_N)
-        for i, col in enumerate(topo_cols):
-            station = STATION_DATA[i]
-            with col:
-                tooltip_text = f"Name: {station['name']}\nInput: {res['rounded_inputs'][i]}"
-                connector_html = '<div class="topo-connector"></div>' if i < FIXED_N - 1 else ''
-                st.markdown(
-f"""
-<div style="position: relative; width: 100%; text-align: center;">
-<div class="topo-node {node_states[i]}" title="{tooltip_text}">{STATION_DATA[i]["name"]}</div>
-{connector_html}
-</div>
-""", 
-unsafe_allow_html=True
+        @st.fragment
+        @perf_rec.timed("topology")
+        def topology_view(model, res, node_states, failed_nodes):
+            clicked = selected_station(st.session_state.get("topo_chart"))
+            if clicked is not None and clicked < model.n:
+                st.session_state.selected_node_idx = clicked
+            idx = st.session_state.selected_node_idx
+
+            with perf_rec.span("topology_figure"):
+                fig = build_topology_figure(
+                    model.names, node_states, res["rounded_inputs"], model.max_caps, model.p,
+                    selected=idx, per_row=st.session_state.get("topo_per_row", 10)
                 )
-                btn_type = "primary" if st.session_state.selected_node_idx == i else "secondary"
-                
-                # 修改按鈕文字為 "詳細內容"
-                if st.button("詳細內容", key=f"btn_node_{i}", type=btn_type, use_container_width=True):
-                    st.session_state.selected_node_idx = i
-                    st.rerun()
+            st.plotly_chart(
+                fig, use_container_width=True, key="topo_chart",
+                on_select="rerun", selection_mode="points",
+                config={"scrollZoom": True, "displaylogo": False}
+            )
+            if model.n > 10:
+                st.slider("每列工作站數", 4, 30, key="topo_per_row", value=10)
 
-        # 詳細資訊卡
-        detail_container = st.container()
-        with detail_container:
+            # 詳細資訊卡
             if failed_nodes:
                 st.error(f"🚨 **系統阻塞警告！** 共 {len(failed_nodes)} 個工作站產能不足")
-            idx = st.session_state.selected_node_idx
-            if idx is not None and 0 <= idx < len(STATION_DATA):
-                d_st = STATION_DATA[idx]
+            if idx is not None and 0 <= idx < model.n:
                 
-                # 修正：移除所有縮排，避免被當作程式碼區塊
                 st.markdown(f"""
 <div class="detail-card-highlight">
-<h5 style="margin-bottom: 15px; color: #fff;">🔍 {d_st["name"]} 詳細數據</h5>
+<h5 style="margin-bottom: 15px; color: #fff;">🔍 {model.names[idx]} 詳細數據</h5>
 <div style="display: flex; justify-content: space-between; text-align: center; gap: 10px;">
 <div style="flex: 1;">
 <div style="font-size: 0.9rem; color: rgba(255,255,255,0.7); margin-bottom: 4px;">輸入量</div>
@@ -651,118 +534,422 @@ unsafe_allow_html=True
 </div>
 <div style="flex: 1;">
 <div style="font-size: 0.9rem; color: rgba(255,255,255,0.7); margin-bottom: 4px;">成功率 p</div>
-<div style="font-size: 1.5rem; font-weight: 700; color: #fff;">{d_st.get('p', 0.96)}</div>
+<div style="font-size: 1.5rem; font-weight: 700; color: #fff;">{float(model.p[idx])}</div>
 </div>
 </div>
 </div>
 """, unsafe_allow_html=True)
+            else:
+                st.caption("點選拓樸圖中的工作站以查看詳細數據")
+
 
         # --- KPI SECTION START ---
-        if sys_reliability >= 0.9:
-            rd_style = "kpi-border-green"; rd_anim_cls = ""; rd_alert_cls = "alert-green"; rd_icon = "✅"; rd_msg = "可靠度狀態優秀 (高於 0.9)"
-        elif sys_reliability >= 0.8:
-            rd_style = "kpi-border-yellow"; rd_anim_cls = "kpi-pulse"; rd_alert_cls = "alert-yellow"; rd_icon = "⚠️"; rd_msg = "可靠度狀態尚可 (0.8-0.9)"
-        else:
-            rd_style = "kpi-border-red"; rd_anim_cls = "kpi-shake"; rd_alert_cls = "alert-red"; rd_icon = "❗"; rd_msg = "可靠度狀態危險 (低於 0.8)"
+        @st.fragment
+        @perf_rec.timed("kpi")
+        def kpi_view(res, mc_res, demand, sys_reliability, sys_carbon):
+            if sys_reliability >= 0.9:
+                rd_style = "kpi-border-green"; rd_anim_cls = ""; rd_alert_cls = "alert-green"; rd_icon = "✅"; rd_msg = "可靠度狀態優秀 (高於 0.9)"
+            elif sys_reliability >= 0.8:
+                rd_style = "kpi-border-yellow"; rd_anim_cls = "kpi-pulse"; rd_alert_cls = "alert-yellow"; rd_icon = "⚠️"; rd_msg = "可靠度狀態尚可 (0.8-0.9)"
+            else:
+                rd_style = "kpi-border-red"; rd_anim_cls = "kpi-shake"; rd_alert_cls = "alert-red"; rd_icon = "❗"; rd_msg = "可靠度狀態危險 (低於 0.8)"
+
+            if sys_carbon < 250:
+                co2_style = "kpi-border-green"; co2_anim_cls = ""; co2_alert_cls = "alert-green"; co2_icon = "✅"; co2_msg = "碳排放狀態正常 (低於 250kg)"
+            elif sys_carbon <= 300:
+                co2_style = "kpi-border-yellow"; co2_anim_cls = "kpi-pulse"; co2_alert_cls = "alert-yellow"; co2_icon = "⚠️"; co2_msg = "碳排放偏高 (250-300kg)"
+            else:
+                co2_style = "kpi-border-red"; co2_anim_cls = "kpi-shake"; co2_alert_cls = "alert-red"; co2_icon = "❗"; co2_msg = "碳排放過高！超過 300kg"
+
+            # 2. KPI 四格佈局 (無縮排)
+            k1, k2, k3, k4 = st.columns([1,1,1,1], gap="large")
+
+            with k1:
+                if mc_res is None:
+                    st.markdown(f'<div class="kpi-box {rd_style} {rd_anim_cls}"><div class="kpi-label">系統可靠度 (Rd)</div><div class="kpi-value">{res["reliability"]:.4f}</div></div>', unsafe_allow_html=True)
+                else:
+                    mc_note = f'95% CI [{mc_res["ci_low"]:.4f}, {mc_res["ci_high"]:.4f}]<br>{mc_res["samples"]:,} 樣本 · {mc_res["throughput"] / 1e6:.1f} M 樣本/秒'
+                    st.markdown(f'<div class="kpi-box {rd_style} {rd_anim_cls}"><div class="kpi-label">系統可靠度 (Rd, 蒙地卡羅)</div><div class="kpi-value">{mc_res["estimate"]:.4f}</div><div style="color:#bcd7ea; font-size:13px; margin-top:6px;">{mc_note}</div></div>', unsafe_allow_html=True)
+            with k2:
+                st.markdown(f'<div class="kpi-box"><div class="kpi-label">輸出量 d</div><div class="kpi-value">{demand}</div></div>', unsafe_allow_html=True)
+            with k3:
+                st.markdown(f'<div class="kpi-box"><div class="kpi-label">總功率 (kW)</div><div class="kpi-value">{res["total_energy"]:.3f}</div></div>', unsafe_allow_html=True)
+            with k4:
+                st.markdown(f'<div class="kpi-box {co2_style} {co2_anim_cls}"><div class="kpi-label">碳排放 (kg)</div><div class="kpi-value">{res["carbon_emission"]:.3f}</div></div>', unsafe_allow_html=True)
+
+            # 3. Alert Banners
+            st.markdown("<div style='height:10px'></div>", unsafe_allow_html=True)
+            st.markdown(f'<div class="alert-full {rd_alert_cls}"><div class="icon">{rd_icon}</div><div class="alert-text">{rd_msg}</div></div>', unsafe_allow_html=True)
+            st.markdown(f'<div class="alert-full {co2_alert_cls}"><div class="icon">{co2_icon}</div><div class="alert-text">{co2_msg}</div></div>', unsafe_allow_html=True)
 
-        if sys_carbon < 250:
-            co2_style = "kpi-border-green"; co2_anim_cls = ""; co2_alert_cls = "alert-green"; co2_icon = "✅"; co2_msg = "碳排放狀態正常 (低於 250kg)"
-        elif sys_carbon <= 300:
-            co2_style = "kpi-border-yellow"; co2_anim_cls = "kpi-pulse"; co2_alert_cls = "alert-yellow"; co2_icon = "⚠️"; co2_msg = "碳排放偏高 (250-300kg)"
-        else:
-            co2_style = "kpi-border-red"; co2_anim_cls = "kpi-shake"; co2_alert_cls = "alert-red"; co2_icon = "❗"; co2_msg = "碳排放過高！超過 300kg"
-
-        # 2. KPI 四格佈局 (無縮排)
-        k1, k2, k3, k4 = st.columns([1,1,1,1], gap="large")
-
-        with k1:
-            st.markdown(f'<div class="kpi-box {rd_style} {rd_anim_cls}"><div class="kpi-label">系統可靠度 (Rd)</div><div class="kpi-value">{res["reliability"]:.4f}</div></div>', unsafe_allow_html=True)
-        with k2:
-            st.markdown(f'<div class="kpi-box"><div class="kpi-label">輸出量 d</div><div class="kpi-value">{demand}</div></div>', unsafe_allow_html=True)
-        with k3:
-            st.markdown(f'<div class="kpi-box"><div class="kpi-label">總功率 (kW)</div><div class="kpi-value">{res["total_energy"]:.3f}</div></div>', unsafe_allow_html=True)
-        with k4:
-            st.markdown(f'<div class="kpi-box {co2_style} {co2_anim_cls}"><div class="kpi-label">碳排放 (kg)</div><div class="kpi-value">{res["carbon_emission"]:.3f}</div></div>', unsafe_allow_html=True)
-
-        # 3. Alert Banners
-        st.markdown("<div style='height:10px'></div>", unsafe_allow_html=True)
-        st.markdown(f'<div class="alert-full {rd_alert_cls}"><div class="icon">{rd_icon}</div><div class="alert-text">{rd_msg}</div></div>', unsafe_allow_html=True)
-        st.markdown(f'<div class="alert-full {co2_alert_cls}"><div class="icon">{co2_icon}</div><div class="alert-text">{co2_msg}</div></div>', unsafe_allow_html=True)
         # --- KPI SECTION END ---
 
+        if live_mode:
+            # 即時遙測：只有此 fragment 依固定頻率重跑 (輪詢來源、合併事件、局部更新模型)，拓樸與 KPI 跟著更新；
+            # 事件再多也只在每次重跑時批次套用一次，不會每個事件都重跑整頁
+            @st.fragment(run_every=live_refresh)
+            @perf_rec.timed("live_monitor")
+            def live_monitor(demand, carbon_factor):
+                feed = st.session_state.telemetry_feed
+                # 來源或事件有問題時只顯示警告，不讓 fragment 在每次重跑時都拋出例外
+                try:
+                    with perf_rec.span("telemetry_poll"):
+                        feed.poll()
+                    live_model = feed.model
+                    # 每次輪詢的模型指紋都不同，不寫入跨工作階段共用的結果快取；
+                    # 遙測改寫過的模型也不套用 Excel 權威值 (B1/B3 覆寫的是原始檔案的結果)
+                    with perf_rec.span("calculate_metrics"):
+                        live_res = core.calculate_metrics(demand, carbon_factor, live_model, None, evaluator)
+                except Exception as e:
+                    st.warning(f"⚠️ 即時遙測更新失敗：{e}。可按「清除遙測覆寫」還原為原設定。")
+                    return
+                computed = evaluator.last_computed
+
+                st.caption(
+                    f"📡 即時遙測：累計 {feed.events:,} 筆事件 ({feed.rate():,.0f} 筆/秒)，本次 {feed.last_batch:,} 筆、"
+                    f"更新 {feed.last_touched} 站 ({feed.last_apply_ms:.1f} ms)；遙測覆寫中 {len(feed.overrides)} 站，"
+                    f"重新計算：{', '.join(computed) or '無'}"
+                    + (f"；無法辨識 {feed.rejected:,} 筆" if feed.rejected else "")
+                )
+                node_states, failed_nodes = station_states(live_model, live_res, live_res["reliability"])
+                topology_view(live_model, live_res, node_states, failed_nodes)
+                kpi_view(live_res, None, demand, live_res["reliability"], live_res["carbon_emission"])
+
+            live_monitor(demand, carbon_factor)
+        else:
+            node_states, failed_nodes = station_states(model, res, sys_reliability)
+            topology_view(model, res, node_states, failed_nodes)
+            kpi_view(res, mc_res, demand, sys_reliability, sys_carbon)
+
+        # --- 低碳生產時段 ---
+        # 以逐時碳排強度 (上傳 CSV 或本地預設檔) 計算每個可行開工時刻的碳排放，一次向量化算完整年
+        @st.fragment
+        @perf_rec.timed("carbon_windows")
+        def carbon_window_view(model, res, carbon_factor):
+            import plotly.graph_objects as go
+
+            st.markdown("### 🕒 低碳生產時段")
+            w1, w2, w3 = st.columns([2, 1, 1])
+            with w1:
+                intensity_file = st.file_uploader(
+                    "逐時碳排強度 CSV (例如 8,760 筆；若未上傳則讀取本地預設檔)", type=["csv"], key="intensity_upload"
+                )
+            with w2:
+                unit = st.radio("強度單位", list(INTENSITY_UNITS), horizontal=True, key="intensity_unit")
+            with w3:
+                layout_label = st.radio("排程方式", ["各站依序", "各站同時"], horizontal=True, key="intensity_layout",
+                                        help="依序：各站依序使用自己的時段；同時：所有站同時開工")
+            layout = "sequential" if layout_label == "各站依序" else "concurrent"
+
+            if intensity_file is not None:
+                raw = intensity_file.getvalue()
+            elif os.path.exists(DEFAULT_INTENSITY_PATH):
+                with open(DEFAULT_INTENSITY_PATH, "rb") as f:
+                    raw = f.read()
+            else:
+                st.caption(f"尚未提供逐時碳排強度資料 (上傳 CSV 或放置於 {DEFAULT_INTENSITY_PATH})。")
+                return
+
+            cache = get_metrics_cache()
+            try:
+                with perf_rec.span("intensity_load"):
+                    intensity = cache.get_or_compute(("intensity", core.upload_digest(raw), unit), lambda: load_intensity_csv(raw, unit))
+            except Exception as e:
+                st.error(f"碳排強度資料讀取失敗：{e}")
+                return
+
+            window_key = ("start_windows", model.stage_fingerprints["energy"], tuple(res["rounded_inputs"]), intensity["digest"], layout)
+            with perf_rec.span("start_windows_eval"):
+                windows = cache.get_or_compute(window_key, lambda: evaluate_start_times(
+                    res["process_times"], res["idle_times"], model.working_power, model.idle_power, intensity["values"], layout
+                ))
+
+            n_hours = len(intensity["values"])
+            if not windows["best"]:
+                st.warning(f"一次生產需 {windows['run_hours']} 小時，超過碳排強度資料長度 ({n_hours} 小時)。")
+                return
+
+            timestamps = intensity["timestamps"]
+
+            def hour_label(h):
+                if timestamps is None:
+                    return f"第 {h} 小時"
+                return (timestamps.iloc[0] + pd.Timedelta(hours=h)).strftime("%Y-%m-%d %H:00")
+
+            m1, m2, m3, m4 = st.columns(4)
+            m1.metric("單一係數碳排放 (kg)", f"{res['carbon_emission']:.2f}", help=f"總能耗 × CO₂ 係數 {carbon_factor:.3f}")
+            m2.metric("最佳開工碳排放 (kg)", f"{windows['min']:.2f}",
+                      delta=f"{windows['min'] - windows['mean']:.2f} vs 平均", delta_color="inverse")
+            m3.metric("平均開工碳排放 (kg)", f"{windows['mean']:.2f}")
+            m4.metric("最差開工碳排放 (kg)", f"{windows['max']:.2f}")
+            st.caption(f"一次生產約 {windows['run_hours']} 小時、{windows['total_energy']:.2f} kWh；共評估 {len(windows['emissions']):,} 個開工時刻"
+                       + (f" (碳排強度補齊 {intensity['filled']} 筆缺值)" if intensity["filled"] else ""))
+
+            c_left, c_right = st.columns([3, 2], gap="large")
+            with c_left:
+                x = np.arange(len(windows["emissions"]))
+                if timestamps is not None:
+                    x = timestamps.iloc[0] + pd.to_timedelta(x, unit="h")
+                best_starts = [b["start"] for b in windows["best"]]
+                fig = go.Figure()
+                fig.add_trace(go.Scattergl(x=x, y=windows["emissions"], mode="lines", name="開工時刻碳排放",
+                                           line=dict(color="#60d3ff", width=1)))
+                fig.add_trace(go.Scatter(
+                    x=[x[s] for s in best_starts], y=[windows["emissions"][s] for s in best_starts],
+                    mode="markers", name="最佳時段", marker=dict(symbol="star", size=14, color="#35e6b0", line=dict(color="#000000", width=1))
+                ))
+                fig.add_hline(y=res["carbon_emission"], line=dict(color="#ffa64d", dash="dash"), annotation_text="單一係數")
+                fig.update_layout(
+                    height=320, margin=dict(l=50, r=20, t=30, b=40),
+                    paper_bgcolor="#ffffff", plot_bgcolor="#ffffff", font=dict(color="#333333"),
+                    yaxis_title="碳排放 (kg)", legend=dict(orientation="h", y=1.12)
+                )
+                st.plotly_chart(fig, use_container_width=True)
+            with c_right:
+                st.dataframe(pd.DataFrame([
+                    {
+                        "開工": hour_label(b["start"]),
+                        "完工": hour_label(b["start"] + windows["run_hours"]),
+                        "碳排放 (kg)": round(b["emission"], 3),
+                        "較平均減少": f"{1 - b['emission'] / windows['mean']:.1%}" if windows["mean"] else "-"
+                    }
+                    for b in windows["best"]
+                ]), hide_index=True, use_container_width=True)
+
+        carbon_window_view(model, res, carbon_factor)
+
         st.divider()
 
         # --- 圖表 ---
-        st.header("📈 數據視覺化分析")
+        @st.fragment
+        @perf_rec.timed("charts")
+        def charts_view(model, res, carbon_factor, crit_points):
+            import plotly.graph_objects as go  # 只有在繪製圖表時才載入 plotly
+
+            st.header("📈 數據視覺化分析")
+
+            def layout_common(title):
+                return dict(
+                    title=dict(text=title, x=0.5, xanchor="center", font=dict(size=18, color="#000000", family="Inter")),
+                    paper_bgcolor='#ffffff', plot_bgcolor='#ffffff',
+                    margin=dict(l=40, r=20, t=55, b=40), font=dict(color="#333333"), height=340
+                )
+
+            stations = list(model.names)
+            r1c1, r1c2 = st.columns([1,1], gap="large")
+            r2c1, r2c2 = st.columns([1,1], gap="large")
+
+            with r1c1, perf_rec.span("chart:inputs"):
+                fig1 = go.Figure(go.Bar(x=stations, y=res["inputs"], marker_color='#60d3ff', name="輸入量"))
+                fig1.update_layout(**layout_common("各工作站輸入量"))
+                st.plotly_chart(fig1, use_container_width=True)
+
+            with r1c2, perf_rec.span("chart:process_time"):
+                fig2 = go.Figure()
+                fig2.add_trace(go.Bar(x=stations, y=res["process_times"], name='平均加工時間 (hr)', marker_color='#35e6b0', hovertemplate='%{y:.3f} hr'))
+                fig2.add_trace(go.Bar(x=stations, y=model.time_limit, name='時間上限 (hr)', marker_color='#ffa64d', opacity=0.95))
+                fig2.update_layout(barmode='group', **layout_common("加工時間 vs 時間上限"))
+                st.plotly_chart(fig2, use_container_width=True)
+
+            with r2c1, perf_rec.span("chart:energy"):
+                colors = ['#ff6b6b' if e > 4 else '#ffd66b' if e > 2 else '#8ef0c2' for e in res["energies"]]
+                fig3 = go.Figure(go.Bar(x=stations, y=res["energies"], marker_color=colors, name="能耗 (kWh)"))
+                fig3.update_layout(**layout_common("功率分布"))
+                st.plotly_chart(fig3, use_container_width=True)
+
+            with r2c2, perf_rec.span("chart:sensitivity"):
+                # 批次計算每個整數輸出量 (階梯曲線，Rd 以斷點索引查表)，碳排放一併顯示於滑鼠提示
+                d_range = np.arange(1000, 5501)
+                with perf_rec.span("sensitivity_sweep"):
+                    sweep = calculate_metrics_batch(d_range, carbon_factor, model)
+
+                fig4 = go.Figure()
+                fig4.add_trace(go.Scatter(
+                    x=d_range, y=sweep["reliability"], customdata=sweep["carbon_emission"], mode='lines', name='可靠度曲線',
+                    line=dict(color='#00e5ff', width=3, shape='hv'),
+                    hovertemplate='d=%{x}<br>Rd=%{y:.4f}<br>CO₂=%{customdata:.1f} kg<extra></extra>'
+                ))
+            
+                # 臨界點：Rd 仍維持在 0.9 / 0.8 以上的最大輸出量
+                for level, cp in crit_points.items():
+                    if cp is None:
+                        continue
+                    fig4.add_trace(go.Scatter(
+                        x=[cp["demand"]], y=[cp["reliability"]], mode='markers+text', name=f'臨界點 Rd≥{level} (d={cp["demand"]})',
+                        text=[f'★ 臨界點 {level}'], textposition='top center',
+                        marker=dict(symbol='star', size=20, color='#ffd700', line=dict(color='#ff0000', width=2))
+                    ))
+
+                fig4.update_layout(**layout_common("系統可靠度敏感度分析"))
+                st.plotly_chart(fig4, use_container_width=True)
+
+        charts_view(model, res, carbon_factor, crit_points)
+
+        # --- 輸出量 x CO₂ 係數 情境熱圖 ---
+        # 整個網格一次向量化計算 (Rd / 能耗沿輸出量軸算一次，碳排放以外積展開)，疊上 Rd 0.8 / 0.9 與碳排 250 / 300 kg 等值線
+        GRID_DEMANDS = 500
+        GRID_FACTORS = 200
+
+        @st.fragment
+        @perf_rec.timed("scenario_grid")
+        def scenario_grid_view(model, demand, carbon_factor):
+            import plotly.graph_objects as go
+
+            st.header("🗺️ 輸出量 × CO₂ 係數 情境熱圖")
+            g1, g2, g3 = st.columns([2, 2, 1])
+            with g1:
+                d_lo, d_hi = st.slider("輸出量範圍 (d)", 100, 10000, (1000, 5500), step=100, key="grid_demand_range")
+            with g2:
+                cf_lo, cf_hi = st.slider("CO₂ 係數範圍 (kg/kWh)", 0.05, 1.5, (0.2, 0.8), step=0.01, key="grid_factor_range")
+            with g3:
+                metric = st.radio("顯示指標", ["可靠度 Rd", "總能耗 (kWh)", "碳排放 (kg)"], key="grid_metric")
+
+            d_axis = np.linspace(d_lo, d_hi, GRID_DEMANDS)
+            cf_axis = np.linspace(cf_lo, cf_hi, GRID_FACTORS)
+            grid_key = ("grid", model.fingerprint, d_lo, d_hi, GRID_DEMANDS, cf_lo, cf_hi, GRID_FACTORS)
+            with perf_rec.span("scenario_grid_eval"):
+                grid = get_metrics_cache().get_or_compute(grid_key, lambda: core.calculate_metrics_grid(d_axis, cf_axis, model))
+
+            # 熱圖以 y = CO₂ 係數、x = 輸出量排列 (GRID_FACTORS x GRID_DEMANDS)
+            rel_z = np.broadcast_to(grid["reliability"], (GRID_FACTORS, GRID_DEMANDS))
+            carbon_z = grid["carbon_emission"].T
+            if metric == "可靠度 Rd":
+                z, colorscale, hover = rel_z, "RdYlGn", "Rd=%{z:.4f}"
+            elif metric == "總能耗 (kWh)":
+                z, colorscale, hover = np.broadcast_to(grid["total_energy"], (GRID_FACTORS, GRID_DEMANDS)), "Blues", "E=%{z:.1f} kWh"
+            else:
+                z, colorscale, hover = carbon_z, "YlOrRd", "CO₂=%{z:.1f} kg"
 
-        def layout_common(title):
-            return dict(
-                title=dict(text=title, x=0.5, xanchor="center", font=dict(size=18, color="#000000", family="Inter")),
-                paper_bgcolor='#ffffff', plot_bgcolor='#ffffff',
-                margin=dict(l=40, r=20, t=55, b=40), font=dict(color="#333333"), height=340
+            fig = go.Figure(go.Heatmap(
+                x=d_axis, y=cf_axis, z=z, colorscale=colorscale,
+                hovertemplate=f"d=%{{x:.0f}}<br>CO₂ 係數=%{{y:.3f}}<br>{hover}<extra></extra>"
+            ))
+            contours = [(rel_z, 0.9, "#00e5ff", "Rd 0.9"), (rel_z, 0.8, "#ffffff", "Rd 0.8"),
+                        (carbon_z, 250, "#ffd700", "250 kg"), (carbon_z, 300, "#ff3b3b", "300 kg")]
+            for cz, level, color, label in contours:
+                fig.add_trace(go.Contour(
+                    x=d_axis, y=cf_axis, z=cz, showscale=False, name=label, showlegend=True,
+                    contours=dict(coloring="lines", start=level, end=level, size=1, showlabels=False),
+                    line=dict(color=color, width=2, dash="dash" if label.startswith("Rd") else "solid"),
+                    hoverinfo="skip"
+                ))
+            fig.add_trace(go.Scatter(
+                x=[demand], y=[carbon_factor], mode="markers", name="目前設定",
+                marker=dict(symbol="star", size=16, color="#ffffff", line=dict(color="#000000", width=1))
+            ))
+            fig.update_layout(
+                height=460, margin=dict(l=50, r=20, t=30, b=50),
+                paper_bgcolor="#ffffff", plot_bgcolor="#ffffff", font=dict(color="#333333"),
+                xaxis_title="輸出量 d", yaxis_title="CO₂ 係數 (kg/kWh)",
+                legend=dict(orientation="h", y=1.08)
+            )
+            st.plotly_chart(fig, use_container_width=True)
+
+        scenario_grid_view(model, demand, carbon_factor)
+
+        @st.fragment
+        @perf_rec.timed("status_table")
+        def status_table_view(model, res):
+            st.header("📋 工作站狀態表")
+            df_res = pd.DataFrame({
+                "工作站": list(model.names), 
+                "輸入量": res["inputs"], 
+                "取整輸入量": res["rounded_inputs"],
+                "加工時間 (hr)": res["process_times"], 
+                "閒置時間 (hr)": res["idle_times"], 
+                "能耗 (kWh)": res["energies"]
+            })
+        
+            st.dataframe(
+                df_res.style.format(
+                    subset=["輸入量", "取整輸入量", "加工時間 (hr)", "閒置時間 (hr)", "能耗 (kWh)"],
+                    formatter="{:.3f}"
+                ),
+                use_container_width=True
             )
 
-        stations = [d["name"] for d in STATION_DATA]
-        r1c1, r1c2 = st.columns([1,1], gap="large")
-        r2c1, r2c2 = st.columns([1,1], gap="large")
-
-        with r1c1:
-            fig1 = go.Figure(go.Bar(x=stations, y=res["inputs"], marker_color='#60d3ff', name="輸入量"))
-            fig1.update_layout(**layout_common("各工作站輸入量"))
-            st.plotly_chart(fig1, use_container_width=True)
-
-        with r1c2:
-            fig2 = go.Figure()
-            fig2.add_trace(go.Bar(x=stations, y=res["process_times"], name='平均加工時間 (hr)', marker_color='#35e6b0', hovertemplate='%{y:.3f} hr'))
-            fig2.add_trace(go.Bar(x=stations, y=[d["timeLimit"] for d in STATION_DATA], name='時間上限 (hr)', marker_color='#ffa64d', opacity=0.95))
-            fig2.update_layout(barmode='group', **layout_common("加工時間 vs 時間上限"))
-            st.plotly_chart(fig2, use_container_width=True)
-
-        with r2c1:
-            colors = ['#ff6b6b' if e > 4 else '#ffd66b' if e > 2 else '#8ef0c2' for e in res["energies"]]
-            fig3 = go.Figure(go.Bar(x=stations, y=res["energies"], marker_color=colors, name="能耗 (kWh)"))
-            fig3.update_layout(**layout_common("功率分布"))
-            st.plotly_chart(fig3, use_container_width=True)
-
-        with r2c2:
-            d_range = [int(x) for x in np.linspace(1000, 5500, 10)]
-            d_range.sort()
-            r_vals = []
-            for d_val in d_range:
-                tmp = calculate_metrics(d_val, carbon_factor, STATION_DATA)
-                r_vals.append(tmp['reliability'])
-
-            fig4 = go.Figure()
-            fig4.add_trace(go.Scatter(x=d_range, y=r_vals, mode='lines+markers', name='可靠度曲線', line=dict(color='#00e5ff', width=3), marker=dict(size=8)))
-            
-            crit_d = 2592
-            crit_res = calculate_metrics(crit_d, carbon_factor, STATION_DATA)
-            fig4.add_trace(go.Scatter(
-                x=[crit_d], y=[crit_res['reliability']], mode='markers+text', name='臨界點 (d=2592)',
-                text=['★ 臨界點'], textposition='top center',
-                marker=dict(symbol='star', size=20, color='#ffd700', line=dict(color='#ff0000', width=2))
+        status_table_view(model, res)
+
+        # --- 升級方案最佳化 ---
+        # 在碳排放預算內找出讓 Rd 最高的產能 / p / 功率升級組合，並列出 (Rd, 碳排放, 升級項目數) 的 Pareto 方案
+        @st.fragment
+        @perf_rec.timed("upgrade_optimizer")
+        def optimizer_view(model, demand, carbon_factor, res):
+            import plotly.graph_objects as go
+
+            st.header("🧭 升級方案最佳化")
+            with st.form("upgrade_form", border=False):
+                c1, c2, c3 = st.columns(3)
+                with c1:
+                    budget = st.number_input("碳排放預算 (kg)", min_value=1.0, value=250.0, step=10.0)
+                with c2:
+                    max_cost = st.slider("升級項目數上限", 1, 8, 3, help="每站的產能倍率、狀態分佈、p、功率各算一階，例如 p +0.02 計 2 項")
+                with c3:
+                    st.caption(f"目前 Rd {res['reliability']:.4f}，碳排放 {res['carbon_emission']:.1f} kg")
+                    submitted = st.form_submit_button("🔍 搜尋升級方案", use_container_width=True)
+
+            opt_key = ("upgrade", model.fingerprint, float(demand), float(carbon_factor), float(budget), int(max_cost))
+            if submitted:
+                with perf_rec.span("optimize_upgrades"):
+                    st.session_state.upgrade_result = get_metrics_cache().get_or_compute(opt_key, lambda: optimize_upgrades(
+                        model, demand, carbon_factor, carbon_budget=budget, max_cost=max_cost
+                    ))
+                st.session_state.upgrade_key = opt_key
+
+            if st.session_state.get("upgrade_key") != opt_key:
+                st.caption("設定預算與升級項目數上限後按「搜尋升級方案」")
+                return
+
+            result = st.session_state.upgrade_result
+            st.caption(
+                f"候選組合 {result['candidates']:.3g} 種，實際展開 {result['evaluated']:,} 個標籤 "
+                f"(峰值 {result['labels_peak']:,})，耗時 {result['elapsed'] * 1000:.0f} ms"
+            )
+            best = result["best"]
+            if best is None:
+                st.warning("在此預算與升級項目數內找不到 Rd > 0 的方案")
+                return
+
+            base = result["baseline"]
+            b1, b2, b3 = st.columns(3)
+            b1.metric("最佳 Rd", f"{best['reliability']:.4f}", f"{best['reliability'] - base['reliability']:+.4f}")
+            b2.metric("碳排放 (kg)", f"{best['carbon_emission']:.1f}", f"{best['carbon_emission'] - base['carbon_emission']:+.1f}", delta_color="inverse")
+            b3.metric("升級項目數", best["cost"])
+            for s in best["stations"]:
+                st.markdown(f"- **{s['name']}**：{s['change']}")
+
+            pareto = result["pareto"]
+            fig = go.Figure()
+            fig.add_trace(go.Scatter(
+                x=[p["carbon_emission"] for p in pareto], y=[p["reliability"] for p in pareto],
+                mode="markers", name="Pareto 方案",
+                marker=dict(size=10, color=[p["cost"] for p in pareto], colorscale="Viridis", showscale=True,
+                            colorbar=dict(title="項目數")),
+                customdata=[p["cost"] for p in pareto],
+                hovertemplate="CO₂=%{x:.1f} kg<br>Rd=%{y:.4f}<br>項目數=%{customdata}<extra></extra>"
+            ))
+            fig.add_trace(go.Scatter(
+                x=[base["carbon_emission"]], y=[base["reliability"]], mode="markers", name="目前設定",
+                marker=dict(symbol="x", size=14, color="#ff6b6b")
             ))
+            fig.add_hline(y=0.9, line_dash="dash", line_color="#35e6b0", annotation_text="Rd 0.9")
+            for band in (250, 300):
+                fig.add_vline(x=band, line_dash="dot", line_color="#ffa64d", annotation_text=f"{band} kg")
+            fig.update_layout(
+                paper_bgcolor="#ffffff", plot_bgcolor="#ffffff", font=dict(color="#333333"), height=360,
+                margin=dict(l=40, r=20, t=30, b=40), xaxis_title="碳排放 (kg)", yaxis_title="Rd"
+            )
+            st.plotly_chart(fig, use_container_width=True)
 
-            fig4.update_layout(**layout_common("系統可靠度敏感度分析"))
-            st.plotly_chart(fig4, use_container_width=True)
-            
-        st.header("📋 工作站狀態表")
-        df_res = pd.DataFrame({
-            "工作站": stations, 
-            "輸入量": res["inputs"], 
-            "取整輸入量": res["rounded_inputs"],
-            "加工時間 (hr)": res["process_times"], 
-            "閒置時間 (hr)": res["idle_times"], 
-            "能耗 (kWh)": res["energies"]
-        })
-        
-        st.dataframe(
-            df_res.style.format(
-                subset=["輸入量", "取整輸入量", "加工時間 (hr)", "閒置時間 (hr)", "能耗 (kWh)"],
-                formatter="{:.3f}"
-            ),
-            use_container_width=True
-        )
+            st.dataframe(pd.DataFrame({
+                "Rd": [p["reliability"] for p in pareto],
+                "碳排放 (kg)": [p["carbon_emission"] for p in pareto],
+                "能耗 (kWh)": [p["total_energy"] for p in pareto],
+                "升級項目數": [p["cost"] for p in pareto],
+                "升級內容": ["；".join(f"{s['name']}：{s['change']}" for s in p["stations"]) or "不變更" for p in pareto]
+            }), use_container_width=True, hide_index=True)
+
+        optimizer_view(model, demand, carbon_factor, res)
 
         # --- 9. 數學模型與公式詳解 ---
         st.divider()
@@ -825,248 +1012,488 @@ unsafe_allow_html=True
 
 # --- TAB 2: 資料管理邏輯 START ---
 with tab_editor:
-    st.subheader("Excel 資料編輯器")
+    # 整個編輯器為一個 fragment：表格輸入、單位切換、Modal 翻頁只重跑此區塊，不重算儀表板；
+    # 上傳、重置、儲存、還原等會改變資料來源的操作才以 st.rerun() 整頁重跑
+    @st.fragment
+    @perf_rec.timed("editor")
+    def editor_view():
+        st.subheader("Excel 資料編輯器")
     
-    col_upload, col_settings = st.columns([2, 1])
-    with col_upload:
-        uploaded_file = st.file_uploader("📂 上傳 Excel 檔案 (若未上傳則嘗試讀取本地預設檔)", type=["xlsx"])
+        col_upload, col_settings = st.columns([2, 1])
+        with col_upload:
+            uploaded_file = st.file_uploader("📂 上傳 Excel / Parquet 檔案 (若未上傳則嘗試讀取本地預設檔)", type=["xlsx", "parquet"])
     
-    # 狀態變數初始化
-    if "processed_file_id" not in st.session_state: st.session_state.processed_file_id = None
-    if "save_modal_state" not in st.session_state: st.session_state.save_modal_state = "hidden"
-    if "save_error_msgs" not in st.session_state: st.session_state.save_error_msgs = []
-    if "io_error_msg" not in st.session_state: st.session_state.io_error_msg = ""
-    if "upload_error_msg" not in st.session_state: st.session_state.upload_error_msg = ""
-    if "upload_read_ok" not in st.session_state: st.session_state.upload_read_ok = True
-
-    # === 上傳處理邏輯 (修正區塊) ===
-    if uploaded_file:
-        # 使用檔名 + 大小作為簡單的唯一識別，確保相同檔案或新檔案變更都能偵測
-        current_obj_id = f"{uploaded_file.name}_{uploaded_file.size}"
+        # 狀態變數初始化
+        if "processed_file_id" not in st.session_state: st.session_state.processed_file_id = None
+        if "save_modal_state" not in st.session_state: st.session_state.save_modal_state = "hidden"
+        if "save_error_report" not in st.session_state: st.session_state.save_error_report = None
+        if "save_error_page" not in st.session_state: st.session_state.save_error_page = 0
+        if "io_error_msg" not in st.session_state: st.session_state.io_error_msg = ""
+        if "upload_error_msg" not in st.session_state: st.session_state.upload_error_msg = ""
+        if "upload_read_ok" not in st.session_state: st.session_state.upload_read_ok = True
+
+        # === 上傳處理邏輯 (修正區塊) ===
+        if uploaded_file:
+            # 以內容摘要 (BLAKE2) 識別上傳檔：同大小的修改也能偵測，重新上傳相同內容不會重複解析
+            uploaded_file.seek(0) # 確保從頭讀取
+            bytes_data = uploaded_file.getvalue()
+            current_obj_id = core.upload_digest(bytes_data)
         
-        # 只要 ID 不同，就視為新的上傳操作 (即使檔名相同但內容變了大小變了，或者使用者重新上傳了)
-        if current_obj_id != st.session_state.processed_file_id:
+            # 只要內容摘要不同，就視為新的上傳操作
+            if current_obj_id != st.session_state.processed_file_id:
             
-            # 1. 嘗試讀取前先標記狀態，避免在 except 之前出錯導致狀態不明
-            st.session_state.upload_read_ok = False
+                # 1. 嘗試讀取前先標記狀態，避免在 except 之前出錯導致狀態不明
+                st.session_state.upload_read_ok = False
             
-            try:
-                uploaded_file.seek(0) # 確保從頭讀取
-                bytes_data = uploaded_file.getvalue()
-                new_df = pd.read_excel(io.BytesIO(bytes_data))
-                
-                if new_df.empty:
-                    raise ValueError("上傳的 Excel 檔案中沒有資料")
-
-                # 2. 讀取成功：更新所有相關狀態
-                st.session_state.df_data = new_df
-                st.session_state.processed_file_id = current_obj_id
-                st.session_state.upload_read_ok = True
-                st.session_state.save_modal_state = "hidden" # 隱藏舊的錯誤 Modal
-                if "last_uploaded_name" not in st.session_state:
-                      st.session_state.last_uploaded_name = uploaded_file.name
+                try:
+                    # 已解析過的內容 (任何 session) 直接取用快取
+                    with perf_rec.span("upload_parse"):
+                        parsed = core.load_uploaded_workbook(bytes_data, current_obj_id)
+                    new_df = parsed["df"].copy()
+
+                    # 2. 讀取成功：更新所有相關狀態
+                    st.session_state.df_data = new_df
+                    if parsed["model"] is not None:
+                        st.session_state.station_model = parsed["model"]
+                        st.session_state.station_model_src = new_df
+                    st.session_state.processed_file_id = current_obj_id
+                    st.session_state.upload_read_ok = True
+                    st.session_state.save_modal_state = "hidden" # 隱藏舊的錯誤 Modal
+                    if "last_uploaded_name" not in st.session_state:
+                          st.session_state.last_uploaded_name = uploaded_file.name
                 
-                # 3. 立即重新執行以更新介面 (Dashboard, Editor, Charts)
-                st.rerun()
+                    # 3. 立即重新執行以更新介面 (Dashboard, Editor, Charts)
+                    st.rerun()
                 
-            except Exception as e:
-                # 4. 讀取失敗：更新 ID 避免無窮迴圈，但標記失敗
-                st.session_state.processed_file_id = current_obj_id
-                st.session_state.upload_read_ok = False # 確保失敗時標記為 False
-                st.session_state.upload_error_msg = str(e)[:300]
+                except Exception as e:
+                    # 4. 讀取失敗：更新 ID 避免無窮迴圈，但標記失敗
+                    st.session_state.processed_file_id = current_obj_id
+                    st.session_state.upload_read_ok = False # 確保失敗時標記為 False
+                    st.session_state.upload_error_msg = str(e)[:300]
                 
-                # 5. 設定 Modal 狀態並 Rerun 以顯示 Modal (不更新 df_data)
-                st.session_state.save_modal_state = "upload_error"
-                st.rerun()
+                    # 5. 設定 Modal 狀態並 Rerun 以顯示 Modal (不更新 df_data)
+                    st.session_state.save_modal_state = "upload_error"
+                    st.rerun()
 
-    df_source = st.session_state.df_data.copy()
-
-    if 'p' not in df_source.columns:
-        df_source['p'] = 0.96
-    if 'working_power' not in df_source.columns:
-        df_source['working_power'] = 2.89
-    if 'idle_power' not in df_source.columns:
-        df_source['idle_power'] = 0.4335
-
-    for col in ['name', 'processTime', 'timeLimit', 'capacities', 'probs']:
-        if col not in df_source.columns:
-            if col == 'name': df_source[col] = [f"工作站{i+1}" for i in range(len(df_source))]
-            elif col == 'processTime': df_source[col] = 0.1
-            elif col == 'timeLimit': df_source[col] = 100
-            else: df_source[col] = "[]"
-
-    target_order = ['name', 'p', 'working_power', 'idle_power', 'processTime', 'timeLimit', 'capacities', 'probs']
-    remaining_cols = [c for c in df_source.columns if c not in target_order]
-    df_source = df_source[target_order + remaining_cols]
-
-    c1, c2, c3 = st.columns([1, 1, 2])
-    with c1:
-        time_unit = st.selectbox("ProcessTime 來源單位", ["Hour (小時)", "Minute (分鐘)"], index=0)
+        df_source = st.session_state.df_data.copy()
+
+        if 'p' not in df_source.columns:
+            df_source['p'] = 0.96
+        if 'working_power' not in df_source.columns:
+            df_source['working_power'] = 2.89
+        if 'idle_power' not in df_source.columns:
+            df_source['idle_power'] = 0.4335
+
+        for col in ['name', 'processTime', 'timeLimit', 'capacities', 'probs']:
+            if col not in df_source.columns:
+                if col == 'name': df_source[col] = [f"工作站{i+1}" for i in range(len(df_source))]
+                elif col == 'processTime': df_source[col] = 0.1
+                elif col == 'timeLimit': df_source[col] = 100
+                else: df_source[col] = "[]"
+
+        target_order = ['name', 'p', 'working_power', 'idle_power', 'processTime', 'timeLimit', 'capacities', 'probs']
+        remaining_cols = [c for c in df_source.columns if c not in target_order]
+        df_source = df_source[target_order + remaining_cols]
+
+        c1, c2, c3 = st.columns([1, 1, 2])
+        with c1:
+            time_unit = st.selectbox("ProcessTime 來源單位", ["Hour (小時)", "Minute (分鐘)"], index=0)
     
-    st.markdown("---")
+        st.markdown("---")
 
-    df_display = df_source.copy()
-    df_display['name'] = df_display['name'].astype(str)
+        df_display = df_source
+        df_display['name'] = df_display['name'].astype(str)
     
-    if "Minute" in time_unit:
-        df_display['processTime'] = df_display['processTime'] * 60.0
-
-    edited_df = st.data_editor(
-        df_display,
-        num_rows="dynamic",
-        use_container_width=True,
-        key="editor_key", 
-        column_config={
-            "name": st.column_config.TextColumn("工作站名稱", required=True),
-            "p": st.column_config.NumberColumn("成功率 p", help="範圍 (0, 1]，預設 0.96", min_value=0.000001, max_value=1.0, required=True),
-            "working_power": st.column_config.NumberColumn("加工功率 (kW)", min_value=0.0, required=True),
-            "idle_power": st.column_config.NumberColumn("閒置功率 (kW)", min_value=0.0, required=True),
-            "processTime": st.column_config.NumberColumn(f"加工時間 ({'hr' if 'Hour' in time_unit else 'min'})", min_value=0.0, required=True),
-            "timeLimit": st.column_config.NumberColumn("時間上限 (hr)", min_value=0.0, required=True),
-            "capacities": st.column_config.TextColumn("產能列表 (List)", help="格式: 1,2,3 或 [1,2,3]"),
-            "probs": st.column_config.TextColumn("機率列表 (List)", help="格式: 0.1, 0.2... 加總需為 1")
-        }
-    )
-
-    df_normalized = edited_df.copy()
-    if "Minute" in time_unit:
-        df_normalized['processTime'] = df_normalized['processTime'] / 60.0
+        if "Minute" in time_unit:
+            df_display['processTime'] = df_display['processTime'] * 60.0
+
+        edited_df = st.data_editor(
+            df_display,
+            num_rows="dynamic",
+            use_container_width=True,
+            key="editor_key", 
+            column_config={
+                "name": st.column_config.TextColumn("工作站名稱", required=True),
+                "p": st.column_config.NumberColumn("成功率 p", help="範圍 (0, 1]，預設 0.96", min_value=0.000001, max_value=1.0, required=True),
+                "working_power": st.column_config.NumberColumn("加工功率 (kW)", min_value=0.0, required=True),
+                "idle_power": st.column_config.NumberColumn("閒置功率 (kW)", min_value=0.0, required=True),
+                "processTime": st.column_config.NumberColumn(f"加工時間 ({'hr' if 'Hour' in time_unit else 'min'})", min_value=0.0, required=True),
+                "timeLimit": st.column_config.NumberColumn("時間上限 (hr)", min_value=0.0, required=True),
+                "capacities": st.column_config.TextColumn("產能列表 (List)", help="格式: 1,2,3 或 [1,2,3]"),
+                "probs": st.column_config.TextColumn("機率列表 (List)", help="格式: 0.1, 0.2... 加總需為 1")
+            }
+        )
 
-    try:
-        if not df_normalized.equals(st.session_state.df_data):
-            st.session_state.df_data = df_normalized
-    except Exception:
-        st.session_state.df_data = df_normalized
-
-    # 按鈕區域
-    col_reset, col_save = st.columns([1, 1])
-
-    # === 重置按鈕 ===
-    with col_reset:
-        if st.button("🔄 重置為預設資料", use_container_width=True):
-            st.session_state.df_data = get_default_data()
-            st.session_state.save_modal_state = "reset"
-            st.rerun()
+        # 只套用編輯器的變更集 (修改 / 新增 / 刪除的列)，工作站模型也只重新編譯這些列；
+        # 同一組變更只套用一次，套用後重跑編輯器，讓表格以新資料重新掛載 (變更集歸零)
+        changes = st.session_state.get("editor_key")
+        base_df = st.session_state.df_data
+        if has_changes(changes):
+            change_key = (base_df, change_signature(changes))
+            last_key = st.session_state.get("editor_applied")
+            if last_key is None or last_key[0] is not change_key[0] or last_key[1] != change_key[1]:
+                with perf_rec.span("editor_patch"):
+                    patch = apply_editor_changes(base_df, edited_df, changes, {"processTime": 60.0} if "Minute" in time_unit else None)
+                    if patch is None:
+                        # 原表格缺欄位 (由上方補上預設值) 時改為整表替換
+                        new_df = edited_df.copy()
+                        if "Minute" in time_unit:
+                            new_df['processTime'] = new_df['processTime'] / 60.0
+                    else:
+                        new_df, touched, deleted = patch
+                        if st.session_state.get("station_model_src") is base_df:
+                            st.session_state.station_model = st.session_state.station_model.patch(new_df, touched, deleted)
+                            st.session_state.station_model_src = new_df
+                st.session_state.df_data = new_df
+                st.session_state.editor_applied = (new_df, change_key[1])
+                _rerun_editor()
+
+        # 表格編輯只重跑編輯器；資料與儀表板目前使用的版本不同時，提示並提供整頁更新
+        if (st.session_state.df_data is not st.session_state.get("station_model_src")
+                or st.session_state.get("station_model") is not st.session_state.get("dashboard_model")):
+            col_pending, col_apply = st.columns([3, 1])
+            with col_pending:
+                st.info("✏️ 表格已修改，儀表板尚未套用這些變更。")
+            with col_apply:
+                if st.button("📊 套用到儀表板", use_container_width=True):
+                    st.rerun()
 
-    # === 儲存按鈕 ===
-    with col_save:
-        if st.button("💾 儲存並更新", use_container_width=True):
-            # 1. 優先檢查上傳狀態：如果目前有上傳檔案，但狀態為讀取失敗 (False)，則禁止儲存
-            if uploaded_file and not st.session_state.get("upload_read_ok", True):
-                st.session_state.save_modal_state = "upload_error"
+        # 儲存目標：上傳檔寫回同名檔案，否則寫入預設檔；副檔名依儲存格式 (預設與來源相同)
+        base_dir = os.path.dirname(os.path.abspath(DEFAULT_EXCEL_PATH))
+        source_path = os.path.join(base_dir, uploaded_file.name) if uploaded_file else os.path.abspath(core.default_scenario_path())
+        with col_settings:
+            save_format = st.selectbox(
+                "儲存格式", ["Parquet (.parquet)", "Excel (.xlsx)"],
+                index=0 if is_parquet_path(source_path) else 1,
+                help="Parquet 以原生列表欄位儲存產能與機率，讀寫較快；Excel 供匯入 / 匯出相容使用"
+            )
+        save_path = os.path.splitext(source_path)[0] + (".parquet" if "Parquet" in save_format else ".xlsx")
+
+        # 按鈕區域
+        col_reset, col_save = st.columns([1, 1])
+
+        # === 重置按鈕 ===
+        with col_reset:
+            if st.button("🔄 重置為預設資料", use_container_width=True):
+                st.session_state.df_data = get_default_data()
+                st.session_state.save_modal_state = "reset"
                 st.rerun()
+
+        # === 儲存按鈕 ===
+        with col_save:
+            if st.button("💾 儲存並更新", use_container_width=True):
+                # 1. 優先檢查上傳狀態：如果目前有上傳檔案，但狀態為讀取失敗 (False)，則禁止儲存
+                if uploaded_file and not st.session_state.get("upload_read_ok", True):
+                    st.session_state.save_modal_state = "upload_error"
+                    st.rerun()
             
-            # 2. 執行驗證與寫入
-            errors = []
-            try:
-                check_df = df_normalized.copy()
-                for idx, row in check_df.iterrows():
-                    if not str(row['name']).strip(): errors.append(f"行 {idx+1}: 名稱不可為空")
-                    if not (0 < row['p'] <= 1): errors.append(f"行 {idx+1}: p 必須在 (0, 1] 之間")
-                    if row['processTime'] <= 0: errors.append(f"行 {idx+1}: 加工時間必須 > 0")
-                    if row['timeLimit'] < 0: errors.append(f"行 {idx+1}: 時間上限必須 >= 0")
-                    if row['working_power'] < 0 or row['idle_power'] < 0: errors.append(f"行 {idx+1}: 功率不可為負")
-                    
-                    caps = parse_list_from_string(row['capacities'])
-                    probs = parse_list_from_string(row['probs'])
-                    
-                    if not isinstance(caps, list) or not all(isinstance(x, (int, float)) for x in caps):
-                        errors.append(f"行 {idx+1}: 產能列表格式錯誤")
-                    elif len(caps) > 1 and not all(x < y for x, y in zip(caps, caps[1:])):
-                        errors.append(f"行 {idx+1}: 產能列表必須嚴格遞增")
-                    
-                    if not isinstance(probs, list) or not all(isinstance(x, (int, float)) for x in probs):
-                        errors.append(f"行 {idx+1}: 機率列表格式錯誤")
-                    elif probs and not math.isclose(sum(probs), 1.0, abs_tol=1e-3):
-                        errors.append(f"行 {idx+1}: 機率加總必須約為 1 (目前 {sum(probs):.3f})")
-                    
-                    if isinstance(caps, list) and isinstance(probs, list) and len(caps) != len(probs):
-                        errors.append(f"行 {idx+1}: 產能與機率列表長度不一致")
-
-                if errors:
-                    st.session_state.save_error_msgs = errors
-                    st.session_state.save_modal_state = "error"
-                else:
-                    base_dir = os.path.dirname(os.path.abspath(DEFAULT_EXCEL_PATH))
-                    os.makedirs(base_dir, exist_ok=True)
-                    
-                    save_path = os.path.join(base_dir, uploaded_file.name) if uploaded_file else os.path.abspath(DEFAULT_EXCEL_PATH)
-                    
-                    if os.path.exists(save_path):
-                        try:
-                            ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-                            bk_path = os.path.join(base_dir, f"backup_{ts}_{os.path.basename(save_path)}")
-                            shutil.copy(save_path, bk_path)
-                        except: pass
-
-                    df_normalized.to_excel(save_path, index=False)
-                    st.session_state.df_data = df_normalized
-                    st.session_state.last_save_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    st.session_state.save_modal_state = "success"
+                # 2. 執行驗證與寫入
+                try:
+                    # 整欄向量化驗證，錯誤清單存入 session 供 Modal 分頁瀏覽
+                    df_normalized = st.session_state.df_data
+                    with perf_rec.span("validation"):
+                        report = validate_station_table(df_normalized)
+
+                    if report["error_count"]:
+                        st.session_state.save_error_report = report
+                        st.session_state.save_error_page = 0
+                        st.session_state.save_modal_state = "error"
+                    else:
+                        # 版本記錄與寫入交給背景執行緒 (原子替換)，完成狀態由下方的 save_status 回報
+                        st.session_state.save_job = submit_save(df_normalized, save_path)
+                        st.session_state.save_modal_state = "hidden"
             
+                except Exception as e:
+                    st.session_state.io_error_msg = str(e)
+                    st.session_state.save_modal_state = "io_error"
+            
+                st.rerun()
+
+        # === 版本歷史 ===
+        with st.expander("🕘 版本歷史", expanded=False):
+            history = get_history(base_dir) if os.path.isdir(base_dir) else None
+            versions = history.list_versions(save_path, limit=50) if history is not None else []
+
+            if not versions:
+                st.caption(f"{os.path.basename(save_path)} 尚無版本紀錄，儲存後會自動建立。")
+            else:
+                st.dataframe(
+                    pd.DataFrame(versions)[["id", "created_at", "rows", "note"]].rename(
+                        columns={"id": "版本", "created_at": "時間", "rows": "工作站數", "note": "備註"}
+                    ),
+                    hide_index=True, use_container_width=True
+                )
+                version_ids = [v["id"] for v in versions]
+                version_labels = {v["id"]: f"v{v['id']} · {v['created_at']}" for v in versions}
+
+                col_restore, col_restore_btn = st.columns([2, 1])
+                with col_restore:
+                    restore_id = st.selectbox("還原版本", version_ids, format_func=version_labels.get, key="history_restore_id")
+                with col_restore_btn:
+                    st.write("")
+                    if st.button("↩️ 還原此版本", use_container_width=True):
+                        st.session_state.df_data = history.load_version(restore_id)
+                        st.toast(f"已還原 v{restore_id}，確認後請按「儲存並更新」寫入檔案", icon="🕘")
+                        st.rerun()
+
+                if len(version_ids) >= 2:
+                    col_a, col_b = st.columns(2)
+                    with col_a:
+                        diff_a = st.selectbox("比較 A", version_ids, index=1, format_func=version_labels.get, key="history_diff_a")
+                    with col_b:
+                        diff_b = st.selectbox("比較 B", version_ids, index=0, format_func=version_labels.get, key="history_diff_b")
+
+                    diff = history.diff_versions(diff_a, diff_b)
+                    if diff["added"]: st.caption(f"➕ 新增：{', '.join(diff['added'])}")
+                    if diff["removed"]: st.caption(f"➖ 移除：{', '.join(diff['removed'])}")
+                    if diff["changed"]:
+                        st.dataframe(pd.DataFrame([
+                            {"工作站": item["key"], "欄位": col, "A": str(a_val), "B": str(b_val)}
+                            for item in diff["changed"] for col, (a_val, b_val) in item["changes"].items()
+                        ]), hide_index=True, use_container_width=True)
+                    elif not diff["added"] and not diff["removed"]:
+                        st.caption("兩個版本內容相同。")
+
+                col_keep, col_compact = st.columns([2, 1])
+                with col_keep:
+                    keep_last = st.number_input("保留最近版本數", min_value=1, value=history.keep_last, step=10)
+                with col_compact:
+                    st.write("")
+                    if st.button("🧹 壓縮歷史", use_container_width=True):
+                        removed = history.compact(keep_last=int(keep_last), vacuum=True)
+                        st.toast(f"已刪除 {removed} 個舊版本", icon="🧹")
+                        st.rerun()
+                hist_stats = history.stats()
+                st.caption(f"歷史庫：{hist_stats['versions']} 個版本、{hist_stats['row_blobs']} 筆不重複列資料，{hist_stats['bytes'] / 1024:.0f} KB")
+
+        # === 背景儲存狀態 ===
+        # 儲存進行中時每 0.5 秒檢查一次 (只重跑此區塊)，完成後寫回 session state 並整頁重跑顯示結果
+        @st.fragment(run_every=0.5 if st.session_state.get("save_job") is not None else None)
+        def save_status():
+            job = st.session_state.get("save_job")
+            if job is None:
+                return
+            if not job.done():
+                st.caption("💾 背景儲存中…")
+                return
+
+            st.session_state.save_job = None
+            try:
+                result = job.result()
+                st.session_state.last_save_time = result["saved_at"]
+                st.session_state.save_warning = result.get("history_warning")
+                st.session_state.save_modal_state = "success"
             except Exception as e:
                 st.session_state.io_error_msg = str(e)
                 st.session_state.save_modal_state = "io_error"
-            
-            st.rerun()
+            st.rerun(scope="app")
+
+        save_status()
 
-    # === Modal Render Logic ===
-    modal_container = st.empty()
+        # === Modal Render Logic ===
+        modal_container = st.empty()
     
-    if st.session_state.save_modal_state == "error":
-        with modal_container.container():
-            st.markdown("""<style>div[data-testid="stVerticalBlock"]:has(div#modal-marker){position:fixed;top:50%;left:50%;transform:translate(-50%,-50%);width:550px;background:rgba(40,10,10,0.98);border:2px solid #ff6b6b;border-radius:12px;padding:30px;z-index:1000001;box-shadow:0 0 50px rgba(0,0,0,0.8);}div[data-testid="stVerticalBlock"]:has(div#modal-marker)::before{content:"";position:fixed;top:-100vh;left:-100vw;width:300vw;height:300vh;background:rgba(0,0,0,0.6);backdrop-filter:blur(3px);z-index:-1;}div#modal-marker{display:none;}</style><div id="modal-marker"></div>""", unsafe_allow_html=True)
-            error_html = "".join([f"<li style='margin-bottom:5px;'>{e}</li>" for e in st.session_state.save_error_msgs])
-            st.markdown(f"<div style='text-align:center;color:#fff;'><div style='font-size:50px;'>⚠️</div><h3 style='color:#ff6b6b;'>驗證失敗</h3><ul style='text-align:left;max-height:200px;overflow-y:auto;background:rgba(0,0,0,0.3);padding:15px;color:#ffcccc;'>{error_html}</ul></div>", unsafe_allow_html=True)
-            st.markdown('<div id="modal-btn-marker"></div>', unsafe_allow_html=True)
-            c1, c2, c3 = st.columns([1, 1, 1]) 
-            with c2:
-                if st.button("❌ 關閉視窗"):
-                    st.session_state.save_modal_state = "hidden"
-                    st.rerun()
+        if st.session_state.save_modal_state == "error":
+            with modal_container.container():
+                st.markdown("""<style>div[data-testid="stVerticalBlock"]:has(div#modal-marker){position:fixed;top:50%;left:50%;transform:translate(-50%,-50%);width:550px;background:rgba(40,10,10,0.98);border:2px solid #ff6b6b;border-radius:12px;padding:30px;z-index:1000001;box-shadow:0 0 50px rgba(0,0,0,0.8);}div[data-testid="stVerticalBlock"]:has(div#modal-marker)::before{content:"";position:fixed;top:-100vh;left:-100vw;width:300vw;height:300vh;background:rgba(0,0,0,0.6);backdrop-filter:blur(3px);z-index:-1;}div#modal-marker{display:none;}</style><div id="modal-marker"></div>""", unsafe_allow_html=True)
+                report = st.session_state.save_error_report
+                n_pages = page_count(report)
+                page = min(st.session_state.save_error_page, n_pages - 1)
+                error_html = "".join([f"<li style='margin-bottom:5px;'>{e['message']}</li>" for e in error_page(report, page)])
+                summary = f"共 {report['error_count']} 項錯誤 ({report['rows_with_errors']} / {report['row_count']} 列)，第 {page + 1} / {n_pages} 頁"
+                st.markdown(f"<div style='text-align:center;color:#fff;'><div style='font-size:50px;'>⚠️</div><h3 style='color:#ff6b6b;'>驗證失敗</h3><div style='color:#ffcccc;font-size:13px;'>{summary}</div><ul style='text-align:left;max-height:200px;overflow-y:auto;background:rgba(0,0,0,0.3);padding:15px;color:#ffcccc;'>{error_html}</ul></div>", unsafe_allow_html=True)
+                st.markdown('<div id="modal-btn-marker"></div>', unsafe_allow_html=True)
+                c1, c2, c3 = st.columns([1, 1, 1]) 
+                with c1:
+                    if st.button("◀ 上一頁", disabled=page == 0):
+                        st.session_state.save_error_page = page - 1
+                        st.rerun(scope="fragment")
+                with c2:
+                    if st.button("❌ 關閉視窗"):
+                        st.session_state.save_modal_state = "hidden"
+                        st.rerun(scope="fragment")
+                with c3:
+                    if st.button("下一頁 ▶", disabled=page >= n_pages - 1):
+                        st.session_state.save_error_page = page + 1
+                        st.rerun(scope="fragment")
+
+        elif st.session_state.save_modal_state == "io_error":
+            with modal_container.container():
+                st.markdown("""<style>div[data-testid="stVerticalBlock"]:has(div#modal-marker){position:fixed;top:50%;left:50%;transform:translate(-50%,-50%);width:500px;background:rgba(60,10,10,0.98);border:2px solid #ff0000;border-radius:15px;padding:30px;z-index:1000001;box-shadow:0 0 50px rgba(0,0,0,0.8);}div[data-testid="stVerticalBlock"]:has(div#modal-marker)::before{content:"";position:fixed;top:-100vh;left:-100vw;width:300vw;height:300vh;background:rgba(0,0,0,0.6);backdrop-filter:blur(3px);z-index:-1;}div#modal-marker{display:none;}</style><div id="modal-marker"></div>""", unsafe_allow_html=True)
+                st.markdown(f"<div style='text-align:center;color:#fff;'><div style='font-size:60px;'>🚫</div><h3 style='color:#ff6b6b;'>儲存失敗</h3><div style='background:rgba(0,0,0,0.4);padding:10px;margin:15px 0;font-family:monospace;color:#ffaaaa;'>{st.session_state.io_error_msg}</div></div>", unsafe_allow_html=True)
+                st.markdown('<div id="modal-btn-marker"></div>', unsafe_allow_html=True)
+                c1, c2, c3 = st.columns([1, 1, 1])
+                with c2:
+                    if st.button("❌ 關閉視窗"):
+                        st.session_state.save_modal_state = "hidden"
+                        st.rerun(scope="fragment")
+
+        elif st.session_state.save_modal_state == "upload_error":
+            with modal_container.container():
+                st.markdown("""<style>div[data-testid="stVerticalBlock"]:has(div#modal-marker){position:fixed;top:50%;left:50%;transform:translate(-50%,-50%);width:550px;background:rgba(40,10,10,0.98);border:2px solid #ff6b6b;border-radius:12px;padding:30px;z-index:1000001;box-shadow:0 0 50px rgba(0,0,0,0.8);}div[data-testid="stVerticalBlock"]:has(div#modal-marker)::before{content:"";position:fixed;top:-100vh;left:-100vw;width:300vw;height:300vh;background:rgba(0,0,0,0.6);backdrop-filter:blur(3px);z-index:-1;}div#modal-marker{display:none;}</style><div id="modal-marker"></div>""", unsafe_allow_html=True)
+                st.markdown(f"<div style='text-align:center;color:#fff;'><div style='font-size:60px;'>⚠️</div><h3 style='color:#ff6b6b;'>資料讀取錯誤</h3><p style='color:#ccc;'>請確認 Excel 檔案格式是否正確。</p><div style='background:rgba(0,0,0,0.4);padding:10px;margin:15px 0;font-family:monospace;color:#ffaaaa;text-align:left;max-height:150px;overflow-y:auto;'>{st.session_state.upload_error_msg}</div></div>", unsafe_allow_html=True)
+                st.markdown('<div id="modal-btn-marker"></div>', unsafe_allow_html=True)
+                c1, c2, c3 = st.columns([1, 1, 1])
+                with c2:
+                    if st.button("關閉"):
+                        st.session_state.save_modal_state = "hidden"
+                        st.rerun(scope="fragment")
+
+        # 成功 / 重置提示只顯示一次：淡出由瀏覽器端 CSS animation-delay 控制，不佔用伺服器執行緒
+        elif st.session_state.save_modal_state == "success":
+            st.balloons()
+            fade_css = """<style>@keyframes fadeOutAnim {0%{opacity:1;}100%{opacity:0;transform:translate(-50%,-50%) scale(0.9);visibility:hidden;}}.modal-fade-out{animation:fadeOutAnim 1s ease-out 3s forwards;}</style>"""
+            success_html = f"""{fade_css}<div id="success-modal" class="modal-fade-out" style="position:fixed;top:50%;left:50%;transform:translate(-50%,-50%);z-index:999999;background:linear-gradient(135deg,rgba(11,22,38,0.98),rgba(28,69,50,0.95));border:2px solid #4cd37a;border-radius:20px;padding:40px;text-align:center;width:450px;box-shadow:0 0 60px rgba(76,211,122,0.4);backdrop-filter:blur(10px);pointer-events:none;"><div style="font-size:70px;margin-bottom:15px;">✅</div><h2 style="color:#4cd37a;">儲存成功！</h2><p style="color:#e6eef6;">資料已更新並寫入檔案</p><div style="margin-top:20px;border-top:1px solid rgba(255,255,255,0.1);padding-top:10px;color:#88f2ff;font-size:13px;font-family:monospace;">{st.session_state.last_save_time}</div></div>"""
+        
+            modal_container.markdown(success_html, unsafe_allow_html=True)
+            if st.session_state.get("save_warning"):
+                st.warning(f"⚠️ {st.session_state.save_warning}")
+                st.session_state.save_warning = None
+            st.session_state.save_modal_state = "hidden"
+
+        elif st.session_state.save_modal_state == "reset":
+            fade_css = """<style>@keyframes fadeOutAnim {0%{opacity:1;}100%{opacity:0;transform:translate(-50%,-50%) scale(0.9);visibility:hidden;}}.modal-fade-out{animation:fadeOutAnim 1s ease-out 1.5s forwards;}</style>"""
+            reset_html = f"""{fade_css}<div id="reset-modal" class="modal-fade-out" style="position:fixed;top:50%;left:50%;transform:translate(-50%,-50%);z-index:999999;background:rgba(10,30,60,0.95);border:2px solid #3fe6ff;border-radius:15px;padding:30px;text-align:center;width:400px;box-shadow:0 0 50px rgba(63,230,255,0.3);backdrop-filter:blur(5px);pointer-events:none;"><div style="font-size:50px;margin-bottom:10px;">🔄</div><h3 style="color:#3fe6ff;">已重置為預設資料</h3></div>"""
+        
+            modal_container.markdown(reset_html, unsafe_allow_html=True)
+            st.session_state.save_modal_state = "hidden"
+
+    editor_view()
+
+# --- TAB 3: 廠區總覽 (多產線) ---
+# 上傳多個產線定義 (xlsx 的每個工作表或每個 Parquet 檔各為一條產線)，各產線以 calculate_metrics 計算後彙總；
+# 點選產線可載入到戰情儀表板 / 資料編輯器查看細節
+with tab_plant:
+    @st.fragment
+    @perf_rec.timed("plant")
+    def plant_view():
+        import plotly.graph_objects as go
+
+        st.subheader("多產線廠區總覽")
+        p1, p2 = st.columns([2, 1])
+        with p1:
+            plant_files = st.file_uploader(
+                "📂 上傳產線定義 (xlsx 每個工作表為一條產線，或多個 Parquet / xlsx 檔)",
+                type=["xlsx", "parquet"], accept_multiple_files=True, key="plant_upload"
+            )
+        with p2:
+            include_current = st.checkbox("納入目前編輯中的產線", value=True, key="plant_include_current")
+            plant_demand = st.number_input("預設輸出量 (d)", min_value=1, value=2500, step=100, key="plant_demand")
+            plant_factor = st.number_input("CO₂ 係數 (kg/kWh)", min_value=0.001, value=0.474, step=0.001, format="%.3f", key="plant_factor")
+
+        lines = []
+        if include_current and st.session_state.get("station_model") is not None:
+            lines.append({
+                "name": "目前產線", "df": st.session_state.df_data, "excel_auth": st.session_state.get("excel_authority"),
+                "model": st.session_state.station_model, "error": None, "current": True
+            })
+        if plant_files:
+            sources = [(f.name, f.getvalue()) for f in plant_files]
+            digests = tuple(core.upload_digest(data) for _, data in sources)
+            try:
+                with perf_rec.span("plant_load"):
+                    lines += core.get_upload_cache().get_or_compute(("plant", digests), lambda: load_plant_lines(sources))
+            except Exception as e:
+                st.error(f"產線定義讀取失敗：{str(e)[:300]}")
+
+        for line in lines:
+            if line["error"]:
+                st.warning(f"⚠️ {line['name']} 無法編譯，已略過：{line['error']}")
+        lines = [line for line in lines if line["model"] is not None and line["model"].n > 0]
+        if not lines:
+            st.info("請上傳產線定義檔，或勾選「納入目前編輯中的產線」。")
+            return
+
+        # 各產線輸出量：預設為權威格式的 d (B1)，否則使用預設輸出量
+        def default_demand(line):
+            auth_d = (line["excel_auth"] or {}).get("d")
+            return float(auth_d) if isinstance(auth_d, (int, float)) and auth_d > 0 else float(plant_demand)
+
+        demand_table = st.data_editor(
+            pd.DataFrame({"產線": [line["name"] for line in lines], "輸出量 d": [default_demand(line) for line in lines]}),
+            disabled=["產線"], hide_index=True, use_container_width=True, key="plant_demands",
+            column_config={"輸出量 d": st.column_config.NumberColumn(min_value=1.0, step=100.0, required=True)}
+        )
+        demands = demand_table["輸出量 d"].astype(float).tolist()
 
-    elif st.session_state.save_modal_state == "io_error":
-        with modal_container.container():
-            st.markdown("""<style>div[data-testid="stVerticalBlock"]:has(div#modal-marker){position:fixed;top:50%;left:50%;transform:translate(-50%,-50%);width:500px;background:rgba(60,10,10,0.98);border:2px solid #ff0000;border-radius:15px;padding:30px;z-index:1000001;box-shadow:0 0 50px rgba(0,0,0,0.8);}div[data-testid="stVerticalBlock"]:has(div#modal-marker)::before{content:"";position:fixed;top:-100vh;left:-100vw;width:300vw;height:300vh;background:rgba(0,0,0,0.6);backdrop-filter:blur(3px);z-index:-1;}div#modal-marker{display:none;}</style><div id="modal-marker"></div>""", unsafe_allow_html=True)
-            st.markdown(f"<div style='text-align:center;color:#fff;'><div style='font-size:60px;'>🚫</div><h3 style='color:#ff6b6b;'>儲存失敗</h3><div style='background:rgba(0,0,0,0.4);padding:10px;margin:15px 0;font-family:monospace;color:#ffaaaa;'>{st.session_state.io_error_msg}</div></div>", unsafe_allow_html=True)
-            st.markdown('<div id="modal-btn-marker"></div>', unsafe_allow_html=True)
-            c1, c2, c3 = st.columns([1, 1, 1])
-            with c2:
-                if st.button("❌ 關閉視窗"):
-                    st.session_state.save_modal_state = "hidden"
-                    st.rerun()
+        plant_key = (
+            "plant_eval", tuple(line["model"].fingerprint for line in lines), tuple(demands), float(plant_factor),
+            tuple(core.authority_fingerprint(line["excel_auth"]) for line in lines)
+        )
+        with perf_rec.span("plant_eval"):
+            result = get_metrics_cache().get_or_compute(plant_key, lambda: evaluate_plant(lines, demands, plant_factor))
+        summary = result["plant"]
+
+        k1, k2, k3, k4 = st.columns(4)
+        k1.metric("廠區可靠度 (全部產線達標)", f"{summary['reliability']:.4f}")
+        k2.metric("期望產出達成率", f"{summary['expected_fulfilment']:.2%}" if summary["expected_fulfilment"] is not None else "-")
+        k3.metric("總能耗 (kWh)", f"{summary['total_energy']:,.2f}")
+        k4.metric("總碳排放 (kg)", f"{summary['carbon_emission']:,.2f}")
+        st.caption(
+            f"{summary['lines']} 條產線、{summary['stations']:,} 個工作站；產能不足的產線 {summary['blocked_lines']} 條 · "
+            f"計算 {result['elapsed'] * 1000:.1f} ms ({result['workers']} 個行程)"
+        )
 
-    elif st.session_state.save_modal_state == "upload_error":
-        with modal_container.container():
-            st.markdown("""<style>div[data-testid="stVerticalBlock"]:has(div#modal-marker){position:fixed;top:50%;left:50%;transform:translate(-50%,-50%);width:550px;background:rgba(40,10,10,0.98);border:2px solid #ff6b6b;border-radius:12px;padding:30px;z-index:1000001;box-shadow:0 0 50px rgba(0,0,0,0.8);}div[data-testid="stVerticalBlock"]:has(div#modal-marker)::before{content:"";position:fixed;top:-100vh;left:-100vw;width:300vw;height:300vh;background:rgba(0,0,0,0.6);backdrop-filter:blur(3px);z-index:-1;}div#modal-marker{display:none;}</style><div id="modal-marker"></div>""", unsafe_allow_html=True)
-            st.markdown(f"<div style='text-align:center;color:#fff;'><div style='font-size:60px;'>⚠️</div><h3 style='color:#ff6b6b;'>資料讀取錯誤</h3><p style='color:#ccc;'>請確認 Excel 檔案格式是否正確。</p><div style='background:rgba(0,0,0,0.4);padding:10px;margin:15px 0;font-family:monospace;color:#ffaaaa;text-align:left;max-height:150px;overflow-y:auto;'>{st.session_state.upload_error_msg}</div></div>", unsafe_allow_html=True)
-            st.markdown('<div id="modal-btn-marker"></div>', unsafe_allow_html=True)
-            c1, c2, c3 = st.columns([1, 1, 1])
-            with c2:
-                if st.button("關閉"):
-                    st.session_state.save_modal_state = "hidden"
-                    st.rerun()
+        line_rows = result["lines"]
+        fig = go.Figure(go.Bar(
+            x=[r["name"] for r in line_rows], y=[r["carbon_emission"] for r in line_rows],
+            customdata=[r["reliability"] for r in line_rows], name="碳排放 (kg)",
+            marker=dict(color=[r["reliability"] for r in line_rows], colorscale="RdYlGn", cmin=0.5, cmax=1.0,
+                        colorbar=dict(title="Rd")),
+            hovertemplate="%{x}<br>CO₂=%{y:.1f} kg<br>Rd=%{customdata:.4f}<extra></extra>"
+        ))
+        fig.update_layout(
+            title=dict(text="各產線碳排放 (顏色為可靠度)", x=0.5, xanchor="center", font=dict(size=18, color="#000000", family="Inter")),
+            height=340, margin=dict(l=40, r=20, t=55, b=40),
+            paper_bgcolor="#ffffff", plot_bgcolor="#ffffff", font=dict(color="#333333")
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
+        selection = st.dataframe(
+            pd.DataFrame([{
+                "產線": r["name"], "工作站數": r["n"], "輸出量 d": r["demand"], "可靠度 Rd": r["reliability"],
+                "總能耗 (kWh)": r["total_energy"], "碳排放 (kg)": r["carbon_emission"], "產能不足站數": r["blocked"]
+            } for r in line_rows]).style.format(
+                subset=["可靠度 Rd", "總能耗 (kWh)", "碳排放 (kg)"], formatter="{:.4f}"
+            ),
+            hide_index=True, use_container_width=True, key="plant_table", on_select="rerun", selection_mode="single-row"
+        )
 
-    elif st.session_state.save_modal_state == "success":
-        st.balloons()
-        fade_css = """<style>@keyframes fadeOutAnim {0%{opacity:1;}100%{opacity:0;transform:translate(-50%,-50%) scale(0.9);}}.modal-fade-out{animation:fadeOutAnim 1s ease-out forwards;}</style>"""
-        success_html = f"""{fade_css}<div id="success-modal" style="position:fixed;top:50%;left:50%;transform:translate(-50%,-50%);z-index:999999;background:linear-gradient(135deg,rgba(11,22,38,0.98),rgba(28,69,50,0.95));border:2px solid #4cd37a;border-radius:20px;padding:40px;text-align:center;width:450px;box-shadow:0 0 60px rgba(76,211,122,0.4);backdrop-filter:blur(10px);"><div style="font-size:70px;margin-bottom:15px;">✅</div><h2 style="color:#4cd37a;">儲存成功！</h2><p style="color:#e6eef6;">資料已更新並寫入檔案</p><div style="margin-top:20px;border-top:1px solid rgba(255,255,255,0.1);padding-top:10px;color:#88f2ff;font-size:13px;font-family:monospace;">{st.session_state.last_save_time}</div></div>"""
-        
-        modal_container.markdown(success_html, unsafe_allow_html=True)
-        time.sleep(3)
-        modal_container.markdown(success_html.replace('id="success-modal"', 'id="success-modal" class="modal-fade-out"'), unsafe_allow_html=True)
-        time.sleep(1)
-        st.session_state.save_modal_state = "hidden"
-        st.rerun()
+        # 點選產線：載入到戰情儀表板 (目前的編輯資料會被取代)
+        picked = selection.selection.rows if selection is not None else []
+        if picked and picked[0] < len(lines) and not lines[picked[0]].get("current"):
+            line = lines[picked[0]]
+            if st.button(f"🔍 在戰情儀表板開啟「{line['name']}」", use_container_width=True):
+                line_df = line["df"].copy()
+                st.session_state.df_data = line_df
+                st.session_state.station_model = line["model"]
+                st.session_state.station_model_src = line_df
+                st.session_state.excel_authority = line["excel_auth"]
+                st.toast(f"已載入 {line['name']}，請切換到「戰情儀表板」分頁", icon="🏭")
+                st.rerun()
 
-    elif st.session_state.save_modal_state == "reset":
-        fade_css = """<style>@keyframes fadeOutAnim {0%{opacity:1;}100%{opacity:0;transform:translate(-50%,-50%) scale(0.9);}}.modal-fade-out{animation:fadeOutAnim 1s ease-out forwards;}</style>"""
-        reset_html = f"""{fade_css}<div id="reset-modal" style="position:fixed;top:50%;left:50%;transform:translate(-50%,-50%);z-index:999999;background:rgba(10,30,60,0.95);border:2px solid #3fe6ff;border-radius:15px;padding:30px;text-align:center;width:400px;box-shadow:0 0 50px rgba(63,230,255,0.3);backdrop-filter:blur(5px);"><div style="font-size:50px;margin-bottom:10px;">🔄</div><h3 style="color:#3fe6ff;">已重置為預設資料</h3></div>"""
-        
-        modal_container.markdown(reset_html, unsafe_allow_html=True)
-        time.sleep(1.5)
-        modal_container.markdown(reset_html.replace('id="reset-modal"', 'id="reset-modal" class="modal-fade-out"'), unsafe_allow_html=True)
-        time.sleep(1)
-        st.session_state.save_modal_state = "hidden"
-        st.rerun()
+    plant_view()
+
+# --- 效能量測面板 (開發人員) ---
+# 顯示到上一次完整重跑為止的統計 (本次的 rerun_total 在頁面畫完後才記錄)
+with st.expander("🛠️ 效能量測 (開發人員)", expanded=False):
+    perf_stats = perf_rec.stats()
+    if perf_stats:
+        st.dataframe(
+            pd.DataFrame(perf_stats).rename(columns={
+                "name": "區段", "count": "次數", "last_ms": "最近 (ms)", "p50_ms": "p50 (ms)", "p95_ms": "p95 (ms)", "max_ms": "max (ms)"
+            }).style.format(precision=2),
+            hide_index=True, use_container_width=True
+        )
+    col_json, col_csv, col_clear = st.columns(3)
+    with col_json:
+        st.download_button("⬇️ 匯出 JSON", perf_rec.export_json(), file_name="perf_trace.json", mime="application/json", on_click="ignore", use_container_width=True)
+    with col_csv:
+        st.download_button("⬇️ 匯出 CSV", perf_rec.export_csv(), file_name="perf_trace.csv", mime="text/csv", on_click="ignore", use_container_width=True)
+    with col_clear:
+        if st.button("🧹 清除量測", use_container_width=True):
+            perf_rec.clear()
+            st.rerun()
+
+perf_rec.record("rerun_total", (time.perf_counter() - rerun_start) * 1000.0)
 #在終端機輸入：python -m streamlit run "C:\Users\user\OneDrive\桌面\dashboard.py"
\ No newline at end of file
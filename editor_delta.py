@@ -0,0 +1,77 @@
+import json
+import math
+
+import numpy as np
+
+# --- 資料編輯器變更集 ---
+# st.data_editor 的 session_state 值為 {"edited_rows": {列: {欄: 值}}, "added_rows": [{欄: 值}...], "deleted_rows": [列...]}，
+# 列號皆指傳入編輯器的表格位置。Streamlit 依「修改 -> 刪除 -> 新增」的順序產生 edited_df，
+# 這裡只把有變動的儲存格 / 列套用到原本的表格，回傳變動列的位置供 StationModel.patch 局部更新。
+
+
+def has_changes(changes):
+    return bool(changes) and any(changes.get(k) for k in ("edited_rows", "added_rows", "deleted_rows"))
+
+
+# 變更集的穩定表示 (判斷同一組變更是否已套用過)
+def change_signature(changes):
+    return json.dumps(changes, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+# 套用變更集：base_df 為原表格 (儲存單位)，edited_df 為編輯器回傳的表格 (顯示單位)，
+# display_scale 為 {欄位: 顯示值 / 儲存值} (例如加工時間以分鐘顯示時為 {"processTime": 60})
+# 回傳 (new_df, touched, deleted)：touched 為新表格中被修改的列位置 (不含新增列)，deleted 為原表格中被刪除的列位置；
+# 編輯器欄位與原表格對不上 (例如原表格缺欄位、由顯示端補上預設值) 時回傳 None，由呼叫端改為整表替換
+def apply_editor_changes(base_df, edited_df, changes, display_scale=None):
+    import pandas as pd
+
+    display_scale = display_scale or {}
+    n = len(base_df)
+    deleted = sorted({int(i) for i in changes.get("deleted_rows") or [] if 0 <= int(i) < n})
+    edited = {int(r): cols for r, cols in (changes.get("edited_rows") or {}).items()}
+    n_added = len(edited_df) - (n - len(deleted))
+
+    if n_added < 0 or not set(base_df.columns) <= set(edited_df.columns):
+        return None
+    if any(col not in base_df.columns for cols in edited.values() for col in cols):
+        return None
+
+    if deleted:
+        keep = np.ones(n, dtype=bool)
+        keep[deleted] = False
+        new_df = base_df.iloc[np.nonzero(keep)[0]].copy()
+    else:
+        new_df = base_df.copy()
+
+    deleted_rows = set(deleted)
+    touched = []
+    for row, cols in sorted(edited.items()):
+        if row >= n or row in deleted_rows:
+            continue
+        pos = row - int(np.searchsorted(deleted, row))
+        for col in cols:
+            # 取 edited_df 的值 (已由 Streamlit 依欄位型別轉換)，只換算被修改的儲存格，其餘儲存格維持原值
+            value = edited_df[col].iat[pos]
+            numeric = new_df[col].dtype.kind in "iufb"
+            if _is_missing(value):
+                value = np.nan if numeric else None
+            elif col in display_scale:
+                value = value / display_scale[col]
+            if new_df[col].dtype.kind in "iub" and (_is_missing(value) or not float(value).is_integer()):
+                new_df[col] = new_df[col].astype(float)
+            new_df.iat[pos, new_df.columns.get_loc(col)] = value
+        touched.append(pos)
+
+    if n_added:
+        added = edited_df.iloc[len(new_df):][list(base_df.columns)].copy()
+        for col, scale in display_scale.items():
+            if col in added.columns:
+                added[col] = added[col] / scale
+        new_df = pd.concat([new_df, added])
+
+    new_df.index = edited_df.index
+    return new_df, touched, deleted
@@ -0,0 +1,242 @@
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+# --- 情境版本歷史 (SQLite) ---
+# 取代每次儲存都整份複製的 backup_<時間戳>_*.xlsx：
+#   row_blobs     : 每一列工作站資料以內容雜湊存一次 (跨版本、跨檔案共用)
+#   versions      : 每個版本的欄位順序、列數與整體摘要
+#   version_rows  : 版本 -> 依序的列雜湊，只有變動的列會新增 row_blobs
+# 內容與最新版本相同時不新增版本；超過保留數量的舊版本可壓縮刪除。
+
+HISTORY_DB_NAME = ".scenario_history.sqlite"
+DEFAULT_KEEP_LAST = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS row_blobs (
+    hash TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS versions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    columns TEXT NOT NULL,
+    row_count INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    note TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_versions_path ON versions (path, id);
+CREATE TABLE IF NOT EXISTS version_rows (
+    version_id INTEGER NOT NULL REFERENCES versions (id) ON DELETE CASCADE,
+    pos INTEGER NOT NULL,
+    row_hash TEXT NOT NULL REFERENCES row_blobs (hash),
+    PRIMARY KEY (version_id, pos)
+);
+CREATE INDEX IF NOT EXISTS idx_version_rows_hash ON version_rows (row_hash);
+"""
+
+
+# NaN / NumPy 純量轉成可 JSON 序列化且比較穩定的值
+def _plain(value):
+    if hasattr(value, "item") and not isinstance(value, (list, tuple, dict)):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+
+def _encode_rows(df):
+    columns = [str(c) for c in df.columns]
+    encoded = []
+    for values in df.itertuples(index=False, name=None):
+        data = json.dumps([_plain(v) for v in values], ensure_ascii=False, default=str)
+        encoded.append((hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest(), data))
+    digest = hashlib.blake2b(
+        json.dumps([columns, [h for h, _ in encoded]]).encode("utf-8"), digest_size=16
+    ).hexdigest()
+    return columns, encoded, digest
+
+
+class ScenarioHistory:
+    def __init__(self, db_path, keep_last=DEFAULT_KEEP_LAST):
+        self.db_path = db_path
+        self.keep_last = keep_last
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    # 每次操作各自開連線 (背景儲存執行緒與 UI 執行緒都會使用)，結束時提交並關閉
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("PRAGMA foreign_keys = ON")
+            conn.execute("PRAGMA journal_mode = WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # 記錄一個版本，回傳版本 id；內容與該檔案最新版本相同時直接回傳最新版本 id
+    def record(self, df, path, note=None):
+        path = os.path.abspath(path)
+        columns, encoded, digest = _encode_rows(df)
+
+        with self._lock, self._connect() as conn:
+            latest = conn.execute(
+                "SELECT id, digest FROM versions WHERE path = ? ORDER BY id DESC LIMIT 1", (path,)
+            ).fetchone()
+            if latest is not None and latest[1] == digest:
+                return latest[0]
+
+            conn.executemany("INSERT OR IGNORE INTO row_blobs (hash, data) VALUES (?, ?)", encoded)
+            cur = conn.execute(
+                "INSERT INTO versions (path, created_at, columns, row_count, digest, note) VALUES (?, ?, ?, ?, ?, ?)",
+                (path, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), json.dumps(columns, ensure_ascii=False),
+                 len(encoded), digest, note)
+            )
+            version_id = cur.lastrowid
+            conn.executemany(
+                "INSERT INTO version_rows (version_id, pos, row_hash) VALUES (?, ?, ?)",
+                [(version_id, pos, h) for pos, (h, _) in enumerate(encoded)]
+            )
+
+        if self.keep_last:
+            self.compact(path, self.keep_last)
+        return version_id
+
+    def has_versions(self, path):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT 1 FROM versions WHERE path = ? LIMIT 1", (os.path.abspath(path),)
+            ).fetchone() is not None
+
+    # 版本清單 (新到舊)；path 為 None 時列出所有檔案
+    def list_versions(self, path=None, limit=100):
+        sql = "SELECT id, path, created_at, row_count, note FROM versions"
+        params = []
+        if path is not None:
+            sql += " WHERE path = ?"
+            params.append(os.path.abspath(path))
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [
+            {"id": r[0], "path": r[1], "created_at": r[2], "rows": r[3], "note": r[4]}
+            for r in rows
+        ]
+
+    def _load_records(self, conn, version_id):
+        head = conn.execute("SELECT columns FROM versions WHERE id = ?", (version_id,)).fetchone()
+        if head is None:
+            raise KeyError(f"找不到版本 {version_id}")
+        rows = conn.execute(
+            "SELECT b.hash, b.data FROM version_rows r JOIN row_blobs b ON b.hash = r.row_hash "
+            "WHERE r.version_id = ? ORDER BY r.pos", (version_id,)
+        ).fetchall()
+        return json.loads(head[0]), [(h, json.loads(data)) for h, data in rows]
+
+    # 還原指定版本為 DataFrame
+    def load_version(self, version_id):
+        import pandas as pd
+
+        with self._connect() as conn:
+            columns, rows = self._load_records(conn, version_id)
+        return pd.DataFrame([values for _, values in rows], columns=columns)
+
+    # 比較兩個版本：以 name 欄位 (不重複時) 對齊，否則依列位置對齊
+    # 回傳 {"added": [key...], "removed": [key...], "changed": [{"key", "changes": {欄位: (A 值, B 值)}}]}
+    def diff_versions(self, version_a, version_b):
+        with self._connect() as conn:
+            cols_a, rows_a = self._load_records(conn, version_a)
+            cols_b, rows_b = self._load_records(conn, version_b)
+
+        def keyed(columns, rows):
+            if "name" in columns:
+                idx = columns.index("name")
+                names = [values[idx] for _, values in rows]
+                if len(set(names)) == len(names):
+                    return {str(n): row for n, row in zip(names, rows)}
+            return {f"#{pos + 1}": row for pos, row in enumerate(rows)}
+
+        map_a = keyed(cols_a, rows_a)
+        map_b = keyed(cols_b, rows_b)
+        all_cols = cols_a + [c for c in cols_b if c not in cols_a]
+
+        changed = []
+        for key in map_a.keys() & map_b.keys():
+            (hash_a, values_a), (hash_b, values_b) = map_a[key], map_b[key]
+            if hash_a == hash_b and cols_a == cols_b:
+                continue
+            rec_a = dict(zip(cols_a, values_a))
+            rec_b = dict(zip(cols_b, values_b))
+            changes = {c: (rec_a.get(c), rec_b.get(c)) for c in all_cols if rec_a.get(c) != rec_b.get(c)}
+            if changes:
+                changed.append({"key": key, "changes": changes})
+
+        order = {key: i for i, key in enumerate(list(map_a) + list(map_b))}
+        changed.sort(key=lambda item: order[item["key"]])
+        return {
+            "added": [k for k in map_b if k not in map_a],
+            "removed": [k for k in map_a if k not in map_b],
+            "changed": changed
+        }
+
+    # 壓縮：每個檔案只保留最新 keep_last 個版本，並清掉不再被引用的列資料
+    def compact(self, path=None, keep_last=None, vacuum=False):
+        keep_last = self.keep_last if keep_last is None else keep_last
+        if not keep_last:
+            return 0
+        with self._lock, self._connect() as conn:
+            paths = [os.path.abspath(path)] if path is not None else [
+                r[0] for r in conn.execute("SELECT DISTINCT path FROM versions")
+            ]
+            removed = 0
+            for p in paths:
+                cur = conn.execute(
+                    "DELETE FROM versions WHERE path = ? AND id NOT IN "
+                    "(SELECT id FROM versions WHERE path = ? ORDER BY id DESC LIMIT ?)",
+                    (p, p, keep_last)
+                )
+                removed += cur.rowcount
+            if removed:
+                conn.execute("DELETE FROM row_blobs WHERE hash NOT IN (SELECT DISTINCT row_hash FROM version_rows)")
+        if vacuum:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                conn.execute("VACUUM")
+            finally:
+                conn.close()
+        return removed
+
+    def stats(self):
+        with self._connect() as conn:
+            versions = conn.execute("SELECT COUNT(*) FROM versions").fetchone()[0]
+            blobs = conn.execute("SELECT COUNT(*) FROM row_blobs").fetchone()[0]
+            refs = conn.execute("SELECT COUNT(*) FROM version_rows").fetchone()[0]
+        size = os.path.getsize(self.db_path) if os.path.exists(self.db_path) else 0
+        return {"versions": versions, "row_blobs": blobs, "row_refs": refs, "bytes": size}
+
+
+_HISTORIES = {}
+_HISTORIES_LOCK = threading.Lock()
+
+
+# 每個資料目錄共用一個歷史庫 (放在該目錄下的 .scenario_history.sqlite)
+def get_history(base_dir, keep_last=DEFAULT_KEEP_LAST):
+    db_path = os.path.join(os.path.abspath(base_dir), HISTORY_DB_NAME)
+    with _HISTORIES_LOCK:
+        history = _HISTORIES.get(db_path)
+        if history is None:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            history = _HISTORIES[db_path] = ScenarioHistory(db_path, keep_last)
+        return history
@@ -0,0 +1,310 @@
+import math
+import time
+
+import numpy as np
+
+from reliability import build_state_arrays
+from station_model import as_station_model
+from core import calculate_metrics_batch
+
+# --- 產能升級最佳化 (碳排 / 能耗預算下最大化 Rd) ---
+# 每站有數個候選方案 (產能倍率、狀態分佈提升階數、p 提升、功率倍率)，全部組合可達數百萬以上。
+# 串聯線的 Rd = Π_i P(C_i >= ceil(f_i))、能耗 = Σ_i E_i，且 f_i = d / Π_{j>=i} p_j 只與「自己及下游」的 p 有關，
+# 因此由最後一站往前做動態規劃：標籤 = (下游 p 乘積 S, log Rd, 能耗, 升級項目數)，
+# 每一站一次以向量運算展開 (標籤 x 方案)，再以預算下界 / 可靠度上界剪枝並只保留 Pareto 非支配標籤。
+# 加工功率 >= 閒置功率時，S 越大上游輸入量越小、Rd 不降且能耗不增，S 也納入支配比較；否則只在 S 相同時比較。
+
+DEFAULT_CAP_SCALES = (1.0, 1.1, 1.2)
+DEFAULT_TIER_SHIFTS = (0, 1)
+DEFAULT_P_STEPS = (0.0, 0.01, 0.02)
+DEFAULT_POWER_SCALES = (1.0, 0.9)
+
+_CHUNK = 256
+
+
+# 狀態分佈往高容量移動 shift 階 (最高狀態累積)，代表保養 / 可用度提升
+def shift_probs(probs, shift):
+    probs = [float(x) for x in probs]
+    if shift <= 0 or len(probs) <= 1:
+        return tuple(probs)
+    shift = min(shift, len(probs) - 1)
+    moved = [0.0] * shift + probs[:-shift]
+    moved[-1] += sum(probs[-shift:])
+    return tuple(moved)
+
+
+# 第 i 站的候選方案 (第一個固定為「不變更」)；cost 為升級項目數：各項取用設定中的第幾階就計幾單位，
+# 例如 p 提升 0.02 (第 2 階) 計 2。產能放大時功率依 capacity_power_exponent 次方同步放大
+def station_options(model, i, cap_scales=DEFAULT_CAP_SCALES, tier_shifts=DEFAULT_TIER_SHIFTS,
+                    p_steps=DEFAULT_P_STEPS, power_scales=DEFAULT_POWER_SCALES, capacity_power_exponent=1.0):
+    base_caps = model.capacities[i]
+    base_probs = model.probs[i]
+    base_p = float(model.p[i])
+    base_wp = float(model.working_power[i])
+    base_ip = float(model.idle_power[i])
+
+    def levels(values, neutral):
+        return [neutral] + [v for v in values if v != neutral]
+
+    options = []
+    seen = set()
+    for cap_level, cap_scale in enumerate(levels(cap_scales, 1.0)):
+        for shift_level, shift in enumerate(levels(tier_shifts, 0)):
+            for p_level, step in enumerate(levels(p_steps, 0.0)):
+                for power_level, power_scale in enumerate(levels(power_scales, 1.0)):
+                    capacities = tuple(float(math.floor(c * cap_scale)) for c in base_caps)
+                    probs = shift_probs(base_probs, shift)
+                    p = min(1.0, round(base_p + step, 6))
+                    factor = power_scale * cap_scale ** capacity_power_exponent
+                    key = (capacities, probs, p, factor)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    options.append({
+                        "cap_scale": cap_scale,
+                        "tier_shift": shift if len(base_probs) > 1 else 0,
+                        "p": p,
+                        "power_scale": power_scale,
+                        "capacities": capacities,
+                        "probs": probs,
+                        "working_power": base_wp * factor,
+                        "idle_power": base_ip * factor,
+                        "cost": cap_level + shift_level + p_level + power_level
+                    })
+    return options
+
+
+# 方案說明文字 (與原設定比較)
+def describe_option(model, i, option):
+    parts = []
+    if option["cap_scale"] != 1.0:
+        parts.append(f"產能 ×{option['cap_scale']:g}")
+    if option["tier_shift"]:
+        parts.append(f"狀態分佈 +{option['tier_shift']} 階")
+    if option["p"] != float(model.p[i]):
+        parts.append(f"p {float(model.p[i]):g}→{option['p']:g}")
+    if option["power_scale"] != 1.0:
+        parts.append(f"功率 ×{option['power_scale']:g}")
+    return "、".join(parts) or "不變更"
+
+
+# 將一站的方案整理成陣列，並先剔除被同站其他方案支配者：
+# 成本不高、p 不低 (功率非單調時需相同)、兩種功率皆不高、且尾端機率處處不低 => 任何情境下都不會更差
+def _option_table(options, monotone):
+    caps, tails = build_state_arrays([o["capacities"] for o in options], [o["probs"] for o in options])
+    cost = np.array([o["cost"] for o in options], dtype=np.int64)
+    p = np.array([o["p"] for o in options], dtype=float)
+    working_power = np.array([o["working_power"] for o in options], dtype=float)
+    idle_power = np.array([o["idle_power"] for o in options], dtype=float)
+
+    keys = np.column_stack((cost, -p, working_power, idle_power) if monotone else (cost, -p, p, working_power, idle_power))
+    # 尾端機率為階梯函數，只需在所有容量點上比較
+    points = np.unique(caps[np.isfinite(caps)])
+    tail_at = np.array([tails[k, np.searchsorted(caps[k], points, side="left")] for k in range(len(options))])
+
+    better = (keys[:, None, :] <= keys[None, :, :]).all(axis=2) & (tail_at[:, None, :] >= tail_at[None, :, :]).all(axis=2)
+    # better[a, b]：a 不比 b 差；完全相同的方案只保留索引較小者
+    same = better & better.T
+    dominated = better & ~np.eye(len(options), dtype=bool) & ~(same & np.tri(len(options), k=-1, dtype=bool))
+    kept = np.nonzero(~dominated.any(axis=0))[0]
+    return {
+        "index": kept,
+        "p": p[kept],
+        "working_power": working_power[kept],
+        "idle_power": idle_power[kept],
+        "cost": cost[kept],
+        "caps": caps[kept],
+        "tails": tails[kept]
+    }
+
+
+# 單站能耗 (與 calculate_metrics 相同：加工時間 = 取整輸入量 x 平均加工時間，閒置時間不為負)
+def _station_energy(rounded, process_time, time_limit, working_power, idle_power):
+    process_times = rounded * process_time
+    return working_power * process_times + idle_power * np.maximum(0, time_limit - process_times)
+
+
+# Pareto 非支配篩選：keys 為 m x q 陣列 (每欄皆越小越好)，回傳保留的列索引
+# 依字典序排序後分塊比較：被已保留者或同塊中排序在前者弱支配即淘汰 (完全相同者只留第一個)
+def pareto_indices(keys):
+    m = len(keys)
+    if m == 0:
+        return np.zeros(0, dtype=np.int64)
+    order = np.lexsort(keys.T[::-1])
+    ordered = keys[order]
+    kept = []
+    kept_keys = np.empty((0, keys.shape[1]))
+    for start in range(0, m, _CHUNK):
+        chunk = ordered[start:start + _CHUNK]
+        alive = np.ones(len(chunk), dtype=bool)
+        if len(kept_keys):
+            alive &= ~(kept_keys[None, :, :] <= chunk[:, None, :]).all(axis=2).any(axis=1)
+        within = np.tril((chunk[None, :, :] <= chunk[:, None, :]).all(axis=2), k=-1)
+        alive &= ~within.any(axis=1)
+        kept.append(order[start:start + _CHUNK][alive])
+        kept_keys = np.vstack((kept_keys, chunk[alive]))
+    return np.concatenate(kept)
+
+
+# 以方案更新工作站模型 (只替換有變更的站)
+def apply_plan(model, choices, options):
+    updates = {}
+    for i, k in enumerate(choices):
+        option = options[i][k]
+        if option["cost"]:
+            updates[i] = {key: option[key] for key in ("capacities", "probs", "p", "working_power", "idle_power")}
+    return model.with_updates(updates) if updates else model
+
+
+# 搜尋升級方案
+# carbon_budget (kg) / energy_budget (kWh) 為上限 (可只給其一)，max_cost 為升級項目數上限，
+# min_reliability 為 Rd 下限 (上界已低於此值的部分方案提早剪除)
+# 標籤數隨升級項目數上限快速成長，站數多時建議設定 max_cost
+# 回傳 {"baseline", "best", "pareto": [方案...], "candidates", "evaluated", "labels_peak", "elapsed"}
+# pareto 為 (Rd, 碳排放, 升級項目數) 的非支配方案，依 Rd 由高到低排列；best 為其中 Rd 最高者
+# 每個方案 {"choices", "cost", "stations": [{"index", "name", "change"}], "reliability", "total_energy", "carbon_emission"}
+def optimize_upgrades(_station_data, demand, carbon_factor, carbon_budget=None, energy_budget=None,
+                      max_cost=None, min_reliability=None, options=None, **option_kwargs):
+    start = time.perf_counter()
+    model = as_station_model(_station_data)
+    n = model.n
+    d = float(demand)
+    if options is None:
+        options = [station_options(model, i, **option_kwargs) for i in range(n)]
+
+    monotone = all(o["working_power"] >= o["idle_power"] for opts in options for o in opts)
+    tables = [_option_table(opts, monotone) for opts in options]
+
+    energy_limit = math.inf
+    if carbon_budget is not None and carbon_factor > 0:
+        energy_limit = carbon_budget / carbon_factor
+    if energy_budget is not None:
+        energy_limit = min(energy_limit, energy_budget)
+    energy_limit *= 1 + 1e-12
+    max_cost = math.inf if max_cost is None else max_cost
+    log_floor = math.log(min_reliability) - 1e-12 if min_reliability else -math.inf
+
+    # 上游各站 (尚未決定) 的能耗下界與可靠度上界：p <= 1，上游輸入量至少為 ceil(d)
+    r0 = math.ceil(d)
+    min_energy = np.zeros(n)
+    max_log_tail = np.zeros(n)
+    for i, t in enumerate(tables):
+        e_at_r0 = _station_energy(r0, model.process_time[i], model.time_limit[i], t["working_power"], t["idle_power"])
+        if not monotone and model.process_time[i] > 0:
+            # 加工功率低於閒置功率時，能耗在加工時間等於時間上限處最低
+            r_fill = max(float(r0), model.time_limit[i] / model.process_time[i])
+            e_at_r0 = np.minimum(e_at_r0, _station_energy(
+                r_fill, model.process_time[i], model.time_limit[i], t["working_power"], t["idle_power"]
+            ))
+        min_energy[i] = e_at_r0.min()
+        best_tail = max(
+            float(t["tails"][k, np.searchsorted(t["caps"][k], r0, side="left")]) for k in range(len(t["p"]))
+        )
+        max_log_tail[i] = math.log(best_tail) if best_tail > 0 else -math.inf
+    energy_before = np.concatenate(([0.0], np.cumsum(min_energy)))[:n]
+    log_tail_before = np.concatenate(([0.0], np.cumsum(max_log_tail)))[:n]
+
+    # 標籤：下游 p 乘積、log Rd、能耗、升級項目數
+    suffix_p = np.ones(1)
+    log_rd = np.zeros(1)
+    energy = np.zeros(1)
+    cost = np.zeros(1, dtype=np.int64)
+    trail = []
+    evaluated = 0
+    labels_peak = 1
+
+    for i in reversed(range(n)):
+        t = tables[i]
+        k = len(t["p"])
+        m = len(suffix_p)
+        evaluated += m * k
+
+        new_suffix = suffix_p[:, None] * t["p"][None, :]
+        rounded = np.ceil(d / new_suffix)
+        tail = np.empty((m, k))
+        for o in range(k):
+            tail[:, o] = t["tails"][o, np.searchsorted(t["caps"][o], rounded[:, o], side="left")]
+        station_energy = _station_energy(rounded, model.process_time[i], model.time_limit[i],
+                                         t["working_power"][None, :], t["idle_power"][None, :])
+
+        new_energy = (energy[:, None] + station_energy).ravel()
+        new_cost = (cost[:, None] + t["cost"][None, :]).ravel()
+        with np.errstate(divide="ignore"):
+            new_log = (log_rd[:, None] + np.log(tail)).ravel()
+        keep = (
+            (tail.ravel() > 0)
+            & (new_energy + energy_before[i] <= energy_limit)
+            & (new_cost <= max_cost)
+            & (new_log + log_tail_before[i] >= log_floor)
+        )
+        cand = np.nonzero(keep)[0]
+
+        cols = [-new_log[cand], new_energy[cand], new_cost[cand].astype(float)]
+        if i > 0:
+            s = new_suffix.ravel()[cand]
+            cols.append(-s)
+            if not monotone:
+                cols.append(s)
+        cand = cand[pareto_indices(np.column_stack(cols))]
+
+        trail.append((cand // k, t["index"][cand % k]))
+        suffix_p = new_suffix.ravel()[cand]
+        log_rd = new_log[cand]
+        energy = new_energy[cand]
+        cost = new_cost[cand]
+        labels_peak = max(labels_peak, len(cand))
+        if len(cand) == 0:
+            break
+
+    # 回溯每個最終標籤的各站方案 (trail 由最後一站往前記錄)
+    finals = len(log_rd) if len(trail) == n else 0
+    choices = np.zeros((finals, n), dtype=np.int64)
+    if finals:
+        pos = np.arange(finals)
+        for step, (parent, option) in enumerate(reversed(trail)):
+            choices[:, step] = option[pos]
+            pos = parent[pos]
+
+    # 以 calculate_metrics 的運算順序重新計算 (標籤的 log / 乘積在斷點附近可能有浮點誤差)
+    base = calculate_metrics_batch(d, carbon_factor, model)
+    plans = []
+    for row in choices:
+        res = calculate_metrics_batch(d, carbon_factor, apply_plan(model, row, options))
+        total_energy = float(res["total_energy"])
+        if total_energy > energy_limit:
+            continue
+        changed = [i for i in range(n) if options[i][row[i]]["cost"]]
+        plans.append({
+            "choices": [int(x) for x in row],
+            "cost": int(sum(options[i][row[i]]["cost"] for i in changed)),
+            "stations": [
+                {"index": i, "name": model.names[i], "change": describe_option(model, i, options[i][row[i]])}
+                for i in changed
+            ],
+            "reliability": float(res["reliability"]),
+            "total_energy": total_energy,
+            "carbon_emission": float(res["carbon_emission"])
+        })
+    # 重新計算後可能出現互相支配的方案 (輸入量恰為整數時取整可能差一單位)，再篩選一次
+    if plans:
+        keys = np.array([[-p["reliability"], p["total_energy"], p["cost"]] for p in plans])
+        plans = [plans[j] for j in pareto_indices(keys)]
+    plans.sort(key=lambda p: (-p["reliability"], p["carbon_emission"], p["cost"]))
+
+    candidates = 1
+    for opts in options:
+        candidates *= len(opts)
+
+    return {
+        "baseline": {
+            "reliability": float(base["reliability"]),
+            "total_energy": float(base["total_energy"]),
+            "carbon_emission": float(base["carbon_emission"])
+        },
+        "best": plans[0] if plans else None,
+        "pareto": plans,
+        "candidates": candidates,
+        "evaluated": evaluated,
+        "labels_peak": labels_peak,
+        "elapsed": time.perf_counter() - start
+    }
@@ -0,0 +1,102 @@
+import csv
+import functools
+import io
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# --- 效能量測 (具名區段) ---
+# 以 with recorder.span("名稱"): 包住要量測的階段；每個名稱保留最近 window 筆耗時計算 p50 / p95 / max，
+# 另保留最近 max_traces 筆原始紀錄 (含所屬的重跑編號) 供匯出 JSON / CSV。
+
+TRACE_FIELDS = ("run", "name", "start", "duration_ms")
+
+
+class PerfRecorder:
+    def __init__(self, window=200, max_traces=2000):
+        self.window = window
+        self._durations = {}
+        self._counts = {}
+        self._traces = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+        self.run_id = 0
+
+    # 每次重跑開始時呼叫，之後的紀錄都歸在新的重跑編號下
+    def new_run(self):
+        with self._lock:
+            self.run_id += 1
+        return self.run_id
+
+    def record(self, name, duration_ms, start=None):
+        with self._lock:
+            if name not in self._durations:
+                self._durations[name] = deque(maxlen=self.window)
+                self._counts[name] = 0
+            self._durations[name].append(duration_ms)
+            self._counts[name] += 1
+            self._traces.append({
+                "run": self.run_id,
+                "name": name,
+                "start": time.time() if start is None else start,
+                "duration_ms": duration_ms
+            })
+
+    @contextmanager
+    def span(self, name):
+        start_wall = time.time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000.0, start_wall)
+
+    # 裝飾器版本：整個函式呼叫視為一個區段 (例如 fragment 函式，單獨重跑時也會被量測)
+    def timed(self, name):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # 各區段統計 (依第一次出現的順序)：count 為累計次數，p50 / p95 / max 取自最近 window 筆
+    def stats(self):
+        with self._lock:
+            items = [(name, list(d), self._counts[name]) for name, d in self._durations.items()]
+        rows = []
+        for name, durations, count in items:
+            arr = np.asarray(durations)
+            rows.append({
+                "name": name,
+                "count": count,
+                "last_ms": float(arr[-1]),
+                "p50_ms": float(np.percentile(arr, 50)),
+                "p95_ms": float(np.percentile(arr, 95)),
+                "max_ms": float(arr.max())
+            })
+        return rows
+
+    def traces(self):
+        with self._lock:
+            return list(self._traces)
+
+    def export_json(self):
+        return json.dumps({"stats": self.stats(), "traces": self.traces()}, ensure_ascii=False, indent=2)
+
+    def export_csv(self):
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=TRACE_FIELDS)
+        writer.writeheader()
+        writer.writerows(self.traces())
+        return buf.getvalue()
+
+    def clear(self):
+        with self._lock:
+            self._durations.clear()
+            self._counts.clear()
+            self._traces.clear()
@@ -0,0 +1,104 @@
+import io
+import os
+import time
+
+import numpy as np
+
+import core
+from columnar import is_parquet_path, is_parquet_bytes, read_scenario
+from reliability import _get_pool
+
+# --- 多產線廠區 ---
+# 每條產線為一張工作站表格 (xlsx 的一個工作表，或一個 Parquet 檔)，各自編譯為 StationModel；
+# 各產線以 calculate_metrics 計算後彙總成廠區 KPI。
+# 廠區可靠度 = Π 各產線 Rd (各產線獨立，全部達成各自輸出量的機率)，
+# 期望達成率 = Σ d_i·Rd_i / Σ d_i；能耗與碳排放直接加總。
+
+# 全廠工作站數低於此值時直接在本行程計算：單條產線只要數十微秒，行程間傳遞模型反而較慢
+PARALLEL_MIN_STATIONS = 20_000
+
+
+# 讀取產線定義：sources 為 [(名稱, 路徑或 bytes)...]；xlsx 的每個非空工作表各為一條產線
+# 回傳 [{"name", "df", "excel_auth", "model", "error"}...] (model 為 None 時 error 為原因)
+def load_plant_lines(sources):
+    lines = []
+    for label, source in sources:
+        is_bytes = isinstance(source, (bytes, bytearray))
+        if (is_bytes and is_parquet_bytes(source)) or (not is_bytes and is_parquet_path(source)):
+            df, excel_auth, model = read_scenario(source)
+            sheets = [(None, df, excel_auth or None, model)]
+        else:
+            parsed = core.parse_workbook_sheets(io.BytesIO(source) if is_bytes else source)
+            sheets = [(sheet, df, excel_auth, None) for sheet, df, excel_auth in parsed]
+
+        for sheet, df, excel_auth, model in sheets:
+            name = label if sheet is None or len(sheets) == 1 else f"{label} / {sheet}"
+            error = None
+            if model is None:
+                try:
+                    model = core.compile_station_model(df)
+                except Exception as e:
+                    error = str(e)[:200]
+            lines.append({"name": name, "df": df, "excel_auth": excel_auth, "model": model, "error": error})
+    return lines
+
+
+# 單條產線的摘要 (行程池呼叫，必須是模組層級函式)
+def evaluate_line(model, demand, carbon_factor, excel_auth=None):
+    res = core.calculate_metrics(demand, carbon_factor, model, excel_auth)
+    blocked = int(np.count_nonzero(np.asarray(res["rounded_inputs"]) > model.max_caps))
+    return {
+        "reliability": float(res["reliability"]),
+        "total_energy": float(res["total_energy"]),
+        "carbon_emission": float(res["carbon_emission"]),
+        "total_process_time": float(res["total_process_time"]),
+        "total_idle_time": float(res["total_idle_time"]),
+        "blocked": blocked
+    }
+
+
+# 一個 worker 負責多條產線 (減少提交次數)
+def _evaluate_chunk(jobs, carbon_factor):
+    return [evaluate_line(model, demand, carbon_factor, excel_auth) for model, demand, excel_auth in jobs]
+
+
+# 計算所有產線並彙總：lines 為 load_plant_lines 的結果，demands 為各產線輸出量 (與 lines 同順序)
+# 回傳 {"lines": [{"name", "n", "demand", ...摘要}], "plant": {...}, "elapsed", "workers"}；無法編譯的產線略過
+def evaluate_plant(lines, demands, carbon_factor, workers=None):
+    start = time.perf_counter()
+    valid = [(line, float(d)) for line, d in zip(lines, demands) if line["model"] is not None and line["model"].n > 0]
+    jobs = [(line["model"], d, line["excel_auth"]) for line, d in valid]
+    total_stations = sum(line["model"].n for line, _ in valid)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(jobs))
+    if workers > 1 and total_stations >= PARALLEL_MIN_STATIONS:
+        pool = _get_pool(workers)
+        chunks = [jobs[i::workers] for i in range(workers)]
+        futures = [pool.submit(_evaluate_chunk, chunk, carbon_factor) for chunk in chunks]
+        chunk_results = [f.result() for f in futures]
+        summaries = [None] * len(jobs)
+        for i, results in enumerate(chunk_results):
+            summaries[i::workers] = results
+    else:
+        workers = 1
+        summaries = _evaluate_chunk(jobs, carbon_factor)
+
+    rows = [
+        dict(name=line["name"], n=line["model"].n, demand=d, **summary)
+        for (line, d), summary in zip(valid, summaries)
+    ]
+    rd = np.array([r["reliability"] for r in rows], dtype=float)
+    d = np.array([r["demand"] for r in rows], dtype=float)
+    plant = {
+        "lines": len(rows),
+        "stations": total_stations,
+        "reliability": float(np.prod(rd)) if len(rows) else None,
+        "expected_fulfilment": float((d * rd).sum() / d.sum()) if d.sum() > 0 else None,
+        "total_demand": float(d.sum()),
+        "total_energy": float(sum(r["total_energy"] for r in rows)),
+        "carbon_emission": float(sum(r["carbon_emission"] for r in rows)),
+        "blocked_lines": sum(1 for r in rows if r["blocked"])
+    }
+    return {"lines": rows, "plant": plant, "elapsed": time.perf_counter() - start, "workers": workers}
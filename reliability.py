@@ -0,0 +1,281 @@
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+
+# --- 可靠度計算引擎 (串聯生產線) ---
+# 串聯系統中各工作站狀態互相獨立，系統可運作 <=> 每一站的容量 >= 該站取整輸入量，
+# 因此 Rd = Π_i P(C_i >= f_i)，不需要列舉所有容量狀態組合。
+
+
+# 將各站 capacities / probs 整理成補齊長度的矩陣 (依容量遞增排序)
+# caps: n x K，不足處補 +inf；tails: n x (K+1)，tails[i, k] = P(C_i >= caps[i, k])，最後一欄為 0
+def build_state_arrays(capacities, probs):
+    n = len(capacities)
+    k_max = max((len(c) for c in capacities), default=0)
+
+    caps = np.full((n, k_max), np.inf)
+    tails = np.zeros((n, k_max + 1))
+
+    for i in range(n):
+        c = np.asarray(capacities[i], dtype=float)
+        p = np.asarray(probs[i], dtype=float)
+        m = min(len(c), len(p))
+        if m == 0:
+            continue
+        c, p = c[:m], p[:m]
+        order = np.argsort(c, kind="stable")
+        caps[i, :m] = c[order]
+        # 尾端機率：由大容量往小容量累加
+        tails[i, :m] = np.cumsum(p[order][::-1])[::-1]
+
+    return caps, tails
+
+
+# 依各站取整輸入量計算每站的尾端機率 P(C_i >= f_i)
+# rounded_inputs 可為長度 n 的向量，或 m x n 的矩陣 (m 組情境一次計算)
+def station_tail_probs(rounded_inputs, caps, tails):
+    r = np.asarray(rounded_inputs, dtype=float)
+    single = r.ndim == 1
+    r = np.atleast_2d(r)
+
+    n = caps.shape[0]
+    out = np.empty(r.shape)
+    for i in range(n):
+        # 第一個容量 >= 輸入量的狀態索引，其後所有狀態皆可承接
+        idx = np.searchsorted(caps[i], r[:, i], side="left")
+        out[:, i] = tails[i, idx]
+
+    return out[0] if single else out
+
+
+# 精確系統可靠度 Rd，回傳純量 (或 m 組情境的向量)
+def exact_reliability(rounded_inputs, caps, tails):
+    return np.prod(station_tail_probs(rounded_inputs, caps, tails), axis=-1)
+
+
+# --- 可靠度 vs 輸出量 斷點索引 ---
+# Rd 為輸出量 d 的遞減階梯函數：站 i 的取整輸入量 ceil(d * c_i) 一旦超過某個容量值，
+# 該站尾端機率就下降一階。預先算出所有斷點與各區間的 Rd，查詢只需二分搜尋。
+
+
+# 各站輸入量 (與 calculate_metrics 相同的浮點運算順序)，demands 可為純量或向量，回傳 m x n
+def input_chain(demands, p_list):
+    d = np.atleast_1d(np.asarray(demands, dtype=float))
+
+    product_p = 1.0
+    for p_val in p_list:
+        product_p *= p_val
+
+    # 以 n x m 排列沿第 0 軸累乘 (逐列連續記憶體)，再轉回 m x n 的連續陣列
+    chain = np.empty((len(p_list), len(d)))
+    if len(p_list) == 0:
+        return chain.T
+    chain[0] = d / product_p
+    chain[1:] = np.asarray(p_list[:-1], dtype=float)[:, None]
+    return np.ascontiguousarray(np.multiply.accumulate(chain, axis=0).T)
+
+
+def _reliability_at(demands, p_list, caps, tails):
+    rounded = np.ceil(input_chain(demands, p_list))
+    return exact_reliability(rounded, caps, tails)
+
+
+# 建立斷點索引：breakpoints 遞增，values[j] 為 d 落在 (breakpoints[j-1], breakpoints[j]] 時的 Rd
+def build_reliability_index(p_list, capacities, probs):
+    p_list = [float(p) for p in p_list]
+    caps, tails = build_state_arrays(capacities, probs)
+
+    # 站 i 的輸入量 = d * c_i，當 d > cap / c_i 時該容量狀態不再足夠
+    coef = input_chain([1.0], p_list)[0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        thresholds = caps / coef[:, None]
+    breakpoints = np.unique(thresholds[np.isfinite(thresholds)])
+
+    # 每個區間取一個代表點 (區間中點) 計算 Rd
+    if len(breakpoints):
+        reps = np.concatenate((
+            [breakpoints[0] - 1.0],
+            (breakpoints[:-1] + breakpoints[1:]) / 2.0,
+            [breakpoints[-1] + 1.0],
+        ))
+    else:
+        reps = np.array([1.0])
+    values = _reliability_at(reps, p_list, caps, tails)
+
+    return {
+        "breakpoints": breakpoints,
+        "values": values,
+        "p_list": p_list,
+        "caps": caps,
+        "tails": tails,
+    }
+
+
+# 查詢任意輸出量的 Rd (純量或向量)；落在斷點附近的點改以直接計算，避免浮點誤差
+def lookup_reliability(index, demands):
+    d = np.asarray(demands, dtype=float)
+    scalar = d.ndim == 0
+    d = np.atleast_1d(d)
+
+    bp = index["breakpoints"]
+    j = np.searchsorted(bp, d, side="left")
+    out = index["values"][j]
+
+    if len(bp):
+        lo = bp[np.clip(j - 1, 0, len(bp) - 1)]
+        hi = bp[np.clip(j, 0, len(bp) - 1)]
+        near = np.isclose(d, lo, rtol=1e-9, atol=0) | np.isclose(d, hi, rtol=1e-9, atol=0)
+        if near.any():
+            out = out.copy()
+            out[near] = _reliability_at(d[near], index["p_list"], index["caps"], index["tails"])
+
+    return float(out[0]) if scalar else out
+
+
+# 找出 Rd 跌破各門檻的臨界輸出量 (整數)：demand 為仍滿足 Rd >= level 的最大輸出量
+# 若任何輸出量皆低於門檻，或門檻永遠不會被跌破，則該門檻為 None
+def find_critical_demands(index, levels=(0.9, 0.8)):
+    bp = index["breakpoints"]
+    values = index["values"]
+    result = {}
+
+    for level in levels:
+        ok = np.nonzero(values >= level)[0]
+        if len(ok) == 0 or ok[-1] >= len(bp):
+            result[level] = None
+            continue
+
+        d_crit = math.floor(bp[ok[-1]])
+        # 以直接計算校正斷點上的浮點誤差
+        while d_crit > 0 and lookup_reliability(index, d_crit) < level:
+            d_crit -= 1
+        while lookup_reliability(index, d_crit + 1) >= level:
+            d_crit += 1
+        if d_crit < 1:
+            result[level] = None
+            continue
+
+        result[level] = {
+            "demand": d_crit,
+            "reliability": lookup_reliability(index, d_crit),
+            "reliability_after": lookup_reliability(index, d_crit + 1),
+        }
+
+    return result
+
+
+# --- 蒙地卡羅可靠度估計 ---
+# 依各站 capacities / probs 分佈抽樣容量狀態 (逆 CDF)，每個樣本檢查所有站是否皆能承接輸入量；
+# 以多個行程平行抽樣，直到信賴區間寬度達到要求或樣本數達上限。
+
+
+# 抽樣用的狀態表：cdf 為依容量遞增排序後的累積機率，caps 多一欄 -inf 代表「落在機率總和之外」(視為失效)
+def build_sampling_arrays(caps, tails):
+    probs_sorted = tails[:, :-1] - tails[:, 1:]
+    cdf = np.cumsum(probs_sorted, axis=1)
+    sample_caps = np.concatenate((caps, np.full((caps.shape[0], 1), -np.inf)), axis=1)
+    return cdf, sample_caps
+
+
+# 單一批次：回傳 (成功樣本數, 樣本數)；供行程池呼叫，必須是模組層級函式
+def _sample_batch(cdf, sample_caps, rounded_inputs, batch_size, seed):
+    rng = np.random.default_rng(seed)
+    ok = np.ones(batch_size, dtype=bool)
+    for i in range(cdf.shape[0]):
+        u = rng.random(batch_size)
+        state = np.searchsorted(cdf[i], u, side="right")
+        ok &= sample_caps[i, state] >= rounded_inputs[i]
+    return int(ok.sum()), batch_size
+
+
+_POOL = None
+_POOL_WORKERS = 0
+# 蒙地卡羅收斂所需的最少失敗 (或成功) 次數與最少樣本數
+MC_MIN_EVENTS = 10
+MC_MIN_SAMPLES = 1_000_000
+
+
+# 行程池在模組內共用 (Streamlit rerun 不會重建)，工作數改變時才重開
+def _get_pool(workers):
+    global _POOL, _POOL_WORKERS
+    if _POOL is None or _POOL_WORKERS != workers:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False, cancel_futures=True)
+        _POOL = ProcessPoolExecutor(max_workers=workers)
+        _POOL_WORKERS = workers
+    return _POOL
+
+
+# Wilson score 信賴區間：樣本中全部成功 (或全部失敗) 時區間寬度不會塌縮為 0 (Wald 區間會)
+def wilson_interval(successes, samples, z):
+    if samples <= 0:
+        return 0.0, 1.0
+    p = successes / samples
+    z2 = z * z
+    denom = 1 + z2 / samples
+    center = (p + z2 / (2 * samples)) / denom
+    half = z * math.sqrt(p * (1 - p) / samples + z2 / (4 * samples * samples)) / denom
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+# 收斂條件：區間寬度達標，且較少見的結果 (通常是失敗) 至少觀察到 MC_MIN_EVENTS 次，
+# 或樣本數已達 MC_MIN_SAMPLES (Rd 極接近 1、幾乎看不到失敗時)
+def _mc_converged(successes, samples, ci_low, ci_high, ci_width):
+    if ci_high - ci_low > ci_width:
+        return False
+    return min(successes, samples - successes) >= MC_MIN_EVENTS or samples >= MC_MIN_SAMPLES
+
+
+def monte_carlo_reliability(rounded_inputs, caps, tails, ci_width=0.002, confidence=0.95,
+                            batch_size=200_000, max_samples=20_000_000, workers=None, seed=None):
+    start = time.perf_counter()
+    r = np.asarray(rounded_inputs, dtype=float)
+    cdf, sample_caps = build_sampling_arrays(caps, tails)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pool = _get_pool(workers) if workers > 1 else None
+    seeds = np.random.SeedSequence(seed)
+
+    successes = 0
+    samples = 0
+    ci_low, ci_high, converged = 0.0, 1.0, False
+    while samples < max_samples:
+        # 每一輪每個 worker 各跑一個批次，再檢查信賴區間
+        n_batches = max(1, min(workers, math.ceil((max_samples - samples) / batch_size)))
+        batch_seeds = seeds.spawn(n_batches)
+        if pool is None:
+            results = [_sample_batch(cdf, sample_caps, r, batch_size, s) for s in batch_seeds]
+        else:
+            futures = [pool.submit(_sample_batch, cdf, sample_caps, r, batch_size, s) for s in batch_seeds]
+            results = [f.result() for f in futures]
+
+        for ok_count, count in results:
+            successes += ok_count
+            samples += count
+
+        ci_low, ci_high = wilson_interval(successes, samples, z)
+        converged = _mc_converged(successes, samples, ci_low, ci_high, ci_width)
+        if converged:
+            break
+
+    elapsed = time.perf_counter() - start
+    estimate = successes / samples
+    return {
+        "estimate": estimate,
+        "ci_low": ci_low,
+        "ci_high": ci_high,
+        "half_width": (ci_high - ci_low) / 2,
+        "confidence": confidence,
+        "samples": samples,
+        "successes": successes,
+        "converged": converged,
+        "elapsed": elapsed,
+        "throughput": samples / elapsed if elapsed > 0 else float("inf"),
+        "workers": workers
+    }
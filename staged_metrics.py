@@ -0,0 +1,172 @@
+import math
+
+import numpy as np
+
+from reliability import exact_reliability, lookup_reliability
+
+# --- 分階段計算 (Block B 拆解) ---
+# inputs      : 只與 d、p (以及 Excel 權威 I) 有關
+# energy      : 取整輸入量 + 加工時間 / 時間上限 / 功率
+# carbon      : 總能耗 × CO₂ 係數
+# reliability : 取整輸入量 + 容量 / 機率
+
+STAGES = ("inputs", "energy", "carbon", "reliability")
+
+
+# 判斷 (d, CO₂ 係數) 是否為 Excel 權威情境
+def is_excel_scenario(demand, carbon_factor, excel_auth):
+    if excel_auth is None:
+        return False
+    try:
+        d_match = math.isclose(demand, excel_auth['d'], abs_tol=1e-9)
+        c_match = math.isclose(carbon_factor, excel_auth['carbon_factor'], abs_tol=1e-9)
+        return d_match and c_match
+    except:
+        return False
+
+
+# 權威情境下要改用的 I (Excel 與程式算出的 I 不符時)，否則為 None
+def authority_input(demand, model, excel_scenario, excel_auth):
+    if not excel_scenario or excel_auth['I'] is None:
+        return None
+    total_input = demand / model.product_p
+    if abs(total_input - excel_auth['I']) > 1e-6:
+        return excel_auth['I']
+    return None
+
+
+def stage_inputs(demand, model, override_input=None):
+    total_input = demand / model.product_p if override_input is None else override_input
+
+    inputs = []
+    current_input = total_input
+    for p_val in model.p_list:
+        inputs.append(current_input)
+        current_input *= p_val
+
+    return {
+        "inputs": inputs,
+        "rounded_inputs": [math.ceil(x) for x in inputs],
+        "computed_input": demand / model.product_p
+    }
+
+
+def stage_energy(rounded_inputs, model):
+    r = np.asarray(rounded_inputs, dtype=float)
+    process_times = r * model.process_time
+    idle_times = np.maximum(0, model.time_limit - process_times)
+    energies = model.working_power * process_times + model.idle_power * idle_times
+
+    return {
+        "process_times": process_times.tolist(),
+        "idle_times": idle_times.tolist(),
+        "energies": energies.tolist(),
+        "total_energy": float(energies.sum()),
+        "time_max_limit": float(model.time_limit.sum()),
+        "total_process_time": float(process_times.sum()),
+        "total_idle_time": float(idle_times.sum())
+    }
+
+
+def stage_carbon(total_energy, carbon_factor):
+    return {"carbon_emission": total_energy * carbon_factor}
+
+
+# 有斷點索引時以輸出量二分搜尋查 Rd；權威 I 覆寫了輸入量時，取整輸入量不再由 d 決定，改為直接計算
+def stage_reliability(rounded_inputs, model, demand=None, index=None):
+    if index is not None and demand is not None:
+        return {"reliability": float(lookup_reliability(index, demand))}
+    return {"reliability": float(exact_reliability(rounded_inputs, model.caps, model.tails))}
+
+
+# Excel 權威值覆寫 (只在權威情境下套用)
+def apply_excel_authority(result, excel_auth):
+    if excel_auth['reliability'] is not None:
+        result["reliability"] = excel_auth['reliability']
+    if excel_auth['total_energy'] is not None:
+        result["total_energy"] = excel_auth['total_energy']
+    if excel_auth['carbon_emission'] is not None:
+        result["carbon_emission"] = excel_auth['carbon_emission']
+    return result
+
+
+def _assemble(demand, carbon_factor, model, excel_auth, run_stage, index=None):
+    excel_scenario = is_excel_scenario(demand, carbon_factor, excel_auth)
+    override_input = authority_input(demand, model, excel_scenario, excel_auth)
+
+    inputs_key = (float(demand), model.stage_fingerprints["chain"], override_input)
+    inputs = run_stage("inputs", inputs_key, lambda: stage_inputs(demand, model, override_input))
+    rounded_key = tuple(inputs["rounded_inputs"])
+
+    energy_key = (rounded_key, model.stage_fingerprints["energy"])
+    energy = run_stage("energy", energy_key, lambda: stage_energy(inputs["rounded_inputs"], model))
+
+    carbon_key = (energy_key, float(carbon_factor))
+    carbon = run_stage("carbon", carbon_key, lambda: stage_carbon(energy["total_energy"], carbon_factor))
+
+    reliability_key = (rounded_key, model.stage_fingerprints["states"])
+    lookup_demand = demand if override_input is None else None
+    reliability = run_stage("reliability", reliability_key, lambda: stage_reliability(inputs["rounded_inputs"], model, lookup_demand, index))
+
+    result = {
+        "inputs": inputs["inputs"],
+        "rounded_inputs": inputs["rounded_inputs"],
+        "process_times": energy["process_times"],
+        "idle_times": energy["idle_times"],
+        "energies": energy["energies"],
+        "total_energy": energy["total_energy"],
+        "carbon_emission": carbon["carbon_emission"],
+        "reliability": reliability["reliability"],
+        "time_max_limit": energy["time_max_limit"],
+        "total_process_time": energy["total_process_time"],
+        "total_idle_time": energy["total_idle_time"]
+    }
+    if excel_scenario:
+        apply_excel_authority(result, excel_auth)
+
+    # 程式算出的 I 與 Excel 不符時，由呼叫端決定如何提示
+    if override_input is not None:
+        result["input_mismatch"] = (inputs["computed_input"], override_input)
+    return result
+
+
+# 一次算完所有階段 (不快取)
+def evaluate_metrics(demand, carbon_factor, model, excel_auth=None, index=None):
+    return _assemble(demand, carbon_factor, model, excel_auth, lambda stage, key, compute: compute(), index)
+
+
+# 增量計算：每個階段記住上一次的輸入 key 與結果，key 不變就直接沿用
+# 例如只改 CO₂ 係數時，只重算 carbon，能耗與可靠度沿用上次結果
+class StagedEvaluator:
+    def __init__(self):
+        self._memo = {}
+        self.evaluations = 0
+        self.last_reused = ()
+        self.last_computed = ()
+        self.reuse_counts = dict.fromkeys(STAGES, 0)
+        self.compute_counts = dict.fromkeys(STAGES, 0)
+
+    def evaluate(self, demand, carbon_factor, model, excel_auth=None, index=None):
+        reused = []
+        computed = []
+
+        def run_stage(stage, key, compute):
+            memo = self._memo.get(stage)
+            if memo is not None and memo[0] == key:
+                reused.append(stage)
+                self.reuse_counts[stage] += 1
+                return memo[1]
+            value = compute()
+            self._memo[stage] = (key, value)
+            computed.append(stage)
+            self.compute_counts[stage] += 1
+            return value
+
+        result = _assemble(demand, carbon_factor, model, excel_auth, run_stage, index)
+        self.evaluations += 1
+        self.last_reused = tuple(reused)
+        self.last_computed = tuple(computed)
+        return result
+
+    def reset(self):
+        self._memo.clear()
@@ -0,0 +1,297 @@
+import hashlib
+import math
+from dataclasses import dataclass
+
+import numpy as np
+
+from reliability import build_state_arrays, input_chain
+
+
+# 空值判斷 (等同 pd.isna)：只有遇到 pd.NA / NaT 等特殊值時才載入 pandas
+def _is_missing(s):
+    if s is None:
+        return True
+    if isinstance(s, float):
+        return math.isnan(s)
+    if isinstance(s, (str, int)):
+        return False
+    import pandas as pd
+    return bool(pd.isna(s))
+
+
+def parse_list_from_string(s):
+    if isinstance(s, list):
+        return s
+    if isinstance(s, tuple):
+        return list(s)
+    if _is_missing(s) or s == "":
+        return []
+    s = str(s).strip()
+    # 修改重點：先移除可能存在的方括號，統一格式
+    s = s.replace('[', '').replace(']', '')
+    try:
+        # 直接用逗號分隔並轉為浮點數列表
+        return [float(x.strip()) for x in s.split(',') if x.strip()]
+    except:
+        return None
+
+
+def _digest(*parts):
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part)
+    return h.hexdigest()
+
+
+# --- 工作站模型 (編譯後、不可變) ---
+# 將 df_data 一次轉成 NumPy 陣列結構，計算、圖表、拓樸與狀態表共用
+@dataclass(frozen=True, eq=False)
+class StationModel:
+    names: tuple
+    process_time: np.ndarray
+    time_limit: np.ndarray
+    p: np.ndarray
+    working_power: np.ndarray
+    idle_power: np.ndarray
+    capacities: tuple          # 原始容量列表 (各站長度可不同)
+    probs: tuple               # 原始機率列表
+    caps: np.ndarray           # n x K，依容量遞增排序，不足處補 +inf
+    tails: np.ndarray          # n x (K+1)，尾端機率 P(C_i >= caps[i, k])
+    max_caps: np.ndarray       # 各站最大容量 (無容量資料時為 0)
+    product_p: float           # Π p_i
+    input_coef: np.ndarray     # 各站輸入量 / 輸出量 (累乘後的 p 係數)
+    fingerprint: str           # 設定指紋 (快取 key 使用)
+    stage_fingerprints: dict   # 各計算階段相關欄位的指紋：chain (p)、energy (時間與功率)、states (容量與機率)
+    row_digests: tuple         # 各站整列設定的摘要 (局部更新時只重算變動的站)
+    state_digests: tuple       # 各站容量 / 機率的摘要
+
+    @property
+    def n(self):
+        return len(self.names)
+
+    @property
+    def p_list(self):
+        return self.p.tolist()
+
+    # 由 dict 列表 (舊版 STATION_DATA 格式) 建立模型
+    @classmethod
+    def from_records(cls, records):
+        names = tuple(str(r["name"]) for r in records)
+        capacities = []
+        probs = []
+        for r in records:
+            caps = parse_list_from_string(r["capacities"])
+            prob = parse_list_from_string(r["probs"])
+            capacities.append(tuple(float(x) for x in caps) if caps else ())
+            probs.append(tuple(float(x) for x in prob) if prob else ())
+
+        def column(key, default=None):
+            if default is None:
+                return np.array([float(r[key]) for r in records], dtype=float)
+            return np.array([float(r.get(key, default)) for r in records], dtype=float)
+
+        return cls._build(
+            names,
+            column("processTime"), column("timeLimit"),
+            column("p", 0.96), column("working_power", 2.89), column("idle_power", 0.4335),
+            tuple(capacities), tuple(probs)
+        )
+
+    # 由已拆好的欄位建立模型 (例如 Parquet 的 list<float64> 欄位)，列表不必再經過字串解析
+    @classmethod
+    def from_columns(cls, names, process_time, time_limit, p, working_power, idle_power, capacities, probs):
+        def column(values):
+            return np.array(values, dtype=float)
+
+        return cls._build(
+            tuple(str(x) for x in names),
+            column(process_time), column(time_limit),
+            column(p), column(working_power), column(idle_power),
+            tuple(tuple(float(x) for x in c) for c in capacities),
+            tuple(tuple(float(x) for x in c) for c in probs)
+        )
+
+    # 替換部分工作站設定 (updates: {站索引: {"p", "working_power", "idle_power", "capacities", "probs", ...}})，回傳新模型；
+    # 只重新編譯被更新的站
+    def with_updates(self, updates):
+        positions = sorted(int(i) for i in updates)
+        rows = {
+            key: getattr(self, key)[positions].copy()
+            for key in ("process_time", "time_limit", "p", "working_power", "idle_power")
+        }
+        rows["names"] = tuple(self.names[i] for i in positions)
+        capacities = [self.capacities[i] for i in positions]
+        probs = [self.probs[i] for i in positions]
+        for j, i in enumerate(positions):
+            for key, value in updates[i].items():
+                if key in rows and key != "names":
+                    rows[key][j] = float(value)
+                elif key == "capacities":
+                    capacities[j] = tuple(float(x) for x in value)
+                elif key == "probs":
+                    probs[j] = tuple(float(x) for x in value)
+        rows["capacities"] = tuple(capacities)
+        rows["probs"] = tuple(probs)
+        return self._splice(np.ones(self.n, dtype=bool), 0, positions, rows)
+
+    # 局部更新：df 為已套用變更的新表格，deleted 為舊模型中被刪除的站索引，
+    # touched 為新表格中內容有變動的列 (新增的列一律視為變動)；只重新解析 / 編譯這些列
+    def patch(self, df, touched=(), deleted=()):
+        keep = np.ones(self.n, dtype=bool)
+        keep[[int(i) for i in deleted]] = False
+        n_new = len(df)
+        n_kept = int(keep.sum())
+        if n_new < n_kept:
+            raise ValueError("新表格列數少於保留的工作站數")
+        extra = n_new - n_kept
+
+        positions = sorted({int(i) for i in touched} | set(range(n_kept, n_new)))
+        return self._splice(keep, extra, positions, _station_rows(df, positions) if positions else None)
+
+    # 保留 keep 標記的站、在尾端補 extra 個空位，再以 rows (格式同 _station_rows) 覆寫 positions 的站
+    def _splice(self, keep, extra, positions, rows):
+        def extend(arr, fill):
+            return np.concatenate((arr[keep], np.full((extra,) + arr.shape[1:], fill)))
+
+        arrays = {
+            key: extend(getattr(self, key), np.nan)
+            for key in ("process_time", "time_limit", "p", "working_power", "idle_power")
+        }
+        max_caps = extend(self.max_caps, 0.0)
+        caps = extend(self.caps, np.inf)
+        tails = extend(self.tails, 0.0)
+
+        def kept(values):
+            return [v for v, k in zip(values, keep) if k] + [None] * extra
+
+        names = kept(self.names)
+        capacities = kept(self.capacities)
+        probs = kept(self.probs)
+        row_digests = kept(self.row_digests)
+        state_digests = kept(self.state_digests)
+
+        if positions:
+            for key in arrays:
+                arrays[key][positions] = rows[key]
+            row_caps, row_tails = build_state_arrays(rows["capacities"], rows["probs"])
+            k = row_caps.shape[1]
+            if k > caps.shape[1]:
+                caps = np.pad(caps, ((0, 0), (0, k - caps.shape[1])), constant_values=np.inf)
+                tails = np.pad(tails, ((0, 0), (0, k - tails.shape[1] + 1)), constant_values=0.0)
+            caps[positions] = np.inf
+            caps[positions, :k] = row_caps
+            tails[positions] = 0.0
+            tails[positions, :k + 1] = row_tails
+            for j, i in enumerate(positions):
+                names[i] = rows["names"][j]
+                capacities[i] = rows["capacities"][j]
+                probs[i] = rows["probs"][j]
+                max_caps[i] = max(capacities[i]) if capacities[i] else 0
+                row_digests[i], state_digests[i] = _row_digests(
+                    names[i], *(arrays[key][i] for key in ("process_time", "time_limit")),
+                    capacities[i], probs[i], *(arrays[key][i] for key in ("p", "working_power", "idle_power"))
+                )
+
+        return StationModel._assemble(
+            names, arrays["process_time"], arrays["time_limit"], arrays["p"],
+            arrays["working_power"], arrays["idle_power"], tuple(capacities), tuple(probs),
+            caps, tails, max_caps, row_digests, state_digests
+        )
+
+    @classmethod
+    def _build(cls, names, process_time, time_limit, p, working_power, idle_power, capacities, probs):
+        caps, tails = build_state_arrays(capacities, probs)
+        digests = [
+            _row_digests(names[i], process_time[i], time_limit[i], capacities[i], probs[i], p[i], working_power[i], idle_power[i])
+            for i in range(len(names))
+        ]
+        return cls._assemble(
+            names, process_time, time_limit, p, working_power, idle_power, capacities, probs,
+            caps, tails, np.array([max(c) if c else 0 for c in capacities], dtype=float),
+            [d for d, _ in digests], [s for _, s in digests]
+        )
+
+    # 由已備妥的陣列組成模型 (整體指紋由各站摘要合成，局部更新不必重新序列化整張表)
+    @classmethod
+    def _assemble(cls, names, process_time, time_limit, p, working_power, idle_power, capacities, probs,
+                  caps, tails, max_caps, row_digests, state_digests):
+        product_p = 1.0
+        for p_val in p.tolist():
+            product_p *= p_val
+
+        arrays = dict(
+            process_time=process_time, time_limit=time_limit, p=p,
+            working_power=working_power, idle_power=idle_power,
+            caps=caps, tails=tails, max_caps=max_caps,
+            input_coef=input_chain([1.0], p.tolist())[0]
+        )
+        for arr in arrays.values():
+            arr.flags.writeable = False
+
+        stage_fingerprints = {
+            "chain": _digest(p.tobytes()),
+            "energy": _digest(process_time.tobytes(), time_limit.tobytes(), working_power.tobytes(), idle_power.tobytes()),
+            "states": _digest(*(d.encode("ascii") for d in state_digests))
+        }
+
+        return cls(
+            names=tuple(names), capacities=capacities, probs=probs,
+            product_p=product_p,
+            fingerprint=_digest(*(d.encode("ascii") for d in row_digests)),
+            stage_fingerprints=stage_fingerprints,
+            row_digests=tuple(row_digests), state_digests=tuple(state_digests),
+            **arrays
+        )
+
+
+# 單站摘要：(整列設定, 容量 / 機率)；以 tuple 的 repr 序列化 (比逐列 json.dumps 快)
+def _row_digests(name, process_time, time_limit, capacities, probs, p, working_power, idle_power):
+    state_digest = _digest(repr((tuple(capacities), tuple(probs))).encode("utf-8"))
+    scalars = (str(name), float(process_time), float(time_limit), float(p), float(working_power), float(idle_power))
+    return _digest(repr(scalars).encode("utf-8"), state_digest.encode("ascii")), state_digest
+
+
+# 讀取 df 中指定位置的列 (positions 為 None 時讀取全部)，欄位缺少時使用預設值
+def _station_rows(df, positions=None):
+    sub = df if positions is None else df.iloc[positions]
+    n = len(sub)
+
+    def column(key, default=None):
+        if key not in sub.columns:
+            return np.full(n, default, dtype=float)
+        return sub[key].astype(float).to_numpy(copy=True)
+
+    capacities = []
+    probs = []
+    for cap_cell, prob_cell in zip(sub['capacities'].tolist(), sub['probs'].tolist()):
+        caps = parse_list_from_string(cap_cell)
+        prob = parse_list_from_string(prob_cell)
+        capacities.append(tuple(float(x) for x in caps) if caps else ())
+        probs.append(tuple(float(x) for x in prob) if prob else ())
+
+    return {
+        "names": tuple(str(x) for x in sub['name'].tolist()),
+        "process_time": column('processTime'), "time_limit": column('timeLimit'),
+        "p": column('p', 0.96), "working_power": column('working_power', 2.89), "idle_power": column('idle_power', 0.4335),
+        "capacities": tuple(capacities), "probs": tuple(probs)
+    }
+
+
+# 由 df_data 編譯工作站模型 (以欄位向量讀取取代 iterrows)
+def compile_station_model(df):
+    rows = _station_rows(df)
+    return StationModel._build(
+        rows["names"],
+        rows["process_time"], rows["time_limit"],
+        rows["p"], rows["working_power"], rows["idle_power"],
+        rows["capacities"], rows["probs"]
+    )
+
+
+# 接受 StationModel、DataFrame 或 dict 列表
+def as_station_model(_station_data):
+    if isinstance(_station_data, StationModel):
+        return _station_data
+    if hasattr(_station_data, "columns"):
+        return compile_station_model(_station_data)
+    return StationModel.from_records(_station_data)
@@ -0,0 +1,133 @@
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import core
+from columnar import is_parquet_path, write_parquet
+from history import get_history
+
+logger = logging.getLogger(__name__)
+
+# --- 檔案寫入 (背景執行、原子替換、版本歷史) ---
+# 寫入先落在同目錄的暫存檔，完成並 fsync 後才以 os.replace 取代目標檔，
+# 中途當機或失敗時目標檔維持原狀，不會留下寫到一半的活頁簿。
+# 依目標副檔名寫成 xlsx 或 Parquet。
+
+# 第一次覆寫既有檔案時，原始檔複本存放的子目錄 (與歷史庫同一資料目錄)
+ORIGINALS_DIR = ".scenario_originals"
+
+
+# 原子寫入：write(f) 寫入同目錄暫存檔，fsync 後再取代目標檔
+def _atomic_write(path, suffix, write):
+    path = os.path.abspath(path)
+    base_dir = os.path.dirname(path)
+    os.makedirs(base_dir, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=base_dir, prefix=".~saving_", suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return path
+
+
+# 原子寫入 DataFrame 為 xlsx
+def atomic_write_excel(df, path):
+    return _atomic_write(path, ".xlsx", lambda f: df.to_excel(f, index=False))
+
+
+# 原子寫入 DataFrame 為 Parquet (capacities / probs 存為 list<float64>，見 columnar)
+def atomic_write_parquet(df, path, excel_scalars=None):
+    return _atomic_write(path, ".parquet", lambda f: write_parquet(df, f, excel_scalars))
+
+
+# 依副檔名選擇格式 (.parquet / .pq 為 Parquet，其餘為 xlsx)
+def write_scenario(df, path):
+    if is_parquet_path(path):
+        return atomic_write_parquet(df, path)
+    return atomic_write_excel(df, path)
+
+
+# 讀取既有情境檔的工作站表格 (xlsx 依權威格式解析：B1–B6 純量、第 8 列起為工作站)
+# 回傳 (df, excel_scalars)；無法解析或為空時拋出 ValueError，不退回內建預設資料
+def read_scenario_frame(path):
+    def fail(level, message):
+        raise ValueError(message)
+
+    return core.load_data_from_excel_authority(path, notify=fail)
+
+
+# 第一次覆寫既有檔案前保留一份逐位元組相同的原始檔 (B1–B6 與格式都在其中)，回傳複本路徑
+def _keep_original(path):
+    originals_dir = os.path.join(os.path.dirname(path), ORIGINALS_DIR)
+    os.makedirs(originals_dir, exist_ok=True)
+    copy_path = os.path.join(originals_dir, f"{datetime.now():%Y%m%d_%H%M%S}_{os.path.basename(path)}")
+    shutil.copy2(path, copy_path)
+    return copy_path
+
+
+# 一次完整的儲存工作：記錄版本歷史 + 原子寫入，回傳結果摘要 (於背景執行緒中執行)
+# 第一次覆寫尚未納入歷史的既有檔案時，先把舊內容記為一個版本 (取代過去的 backup_<時間戳> 複本)
+def save_workbook(df, path):
+    start = time.perf_counter()
+    path = os.path.abspath(path)
+    history = get_history(os.path.dirname(path))
+
+    # 覆寫前先保留原始檔複本，並把其中的工作站表格記為一個版本；失敗時不中斷儲存，但要回報
+    history_warning = None
+    if os.path.exists(path) and not history.has_versions(path):
+        original = None
+        try:
+            original = _keep_original(path)
+        except Exception as e:
+            logger.warning("無法保留既有檔案 %s 的原始複本：%s", path, e)
+            history_warning = f"覆寫前無法複製既有檔案：{e}"
+        try:
+            seed_df, excel_scalars = read_scenario_frame(path)
+            note = "既有檔案"
+            if original is not None:
+                note += f" (原始檔：{os.path.relpath(original, os.path.dirname(path))})"
+            if excel_scalars:
+                note += "；B1–B6：" + ", ".join(f"{k}={v}" for k, v in excel_scalars.items())
+            history.record(seed_df, path, note=note)
+        except Exception as e:
+            logger.warning("無法將既有檔案 %s 記入版本歷史：%s", path, e)
+            history_warning = f"覆寫前無法將既有檔案記入版本歷史：{e}"
+
+    # 先寫入檔案，成功後才記錄版本 (寫入失敗時歷史中不會出現從未落地的版本)
+    saved_path = write_scenario(df, path)
+    version_id = None
+    try:
+        version_id = history.record(df, path, note="儲存")
+    except Exception as e:
+        logger.warning("檔案 %s 已寫入，但無法記入版本歷史：%s", path, e)
+        history_warning = f"檔案已寫入，但無法記入版本歷史：{e}"
+    return {
+        "path": saved_path,
+        "version_id": version_id,
+        "history_warning": history_warning,
+        "rows": len(df),
+        "elapsed": time.perf_counter() - start,
+        "saved_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+
+# 單一背景執行緒依序處理所有寫入 (同一檔案不會同時被兩個工作寫入)
+_SAVE_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="excel-save")
+
+
+# 送出背景儲存，回傳 Future；寫入的是 DataFrame 的複本，送出後繼續編輯不受影響
+def submit_save(df, path):
+    return _SAVE_EXECUTOR.submit(save_workbook, df.copy(), path)
@@ -0,0 +1,298 @@
+import csv
+import io
+import json
+import math
+import os
+import socket
+import time
+from collections import deque
+
+# --- 即時遙測串流 ---
+# 來源為持續增長的 CSV / JSONL 檔 (tail) 或本機 UDP socket (每個封包一或多行 JSON)；
+# 事件格式：{"station": 名稱或索引, "capacity": 目前容量, "capacity_level": 容量等級 (原設定的第幾個容量),
+#            "p": 觀測良率, "power": 量測加工功率, "idle_power": 量測閒置功率, "reset": 還原為原設定}
+# 每次輪詢讀完所有新事件後，同一站的事件先合併 (後到的覆蓋先到的)，再一次以 StationModel.with_updates
+# 只重新編譯有變動的站；Rd / 碳排放交給 StagedEvaluator，只重算指紋有變動的階段。
+# 已知目前容量的站，其容量分佈改為單一狀態 (機率 1)，Rd 即為給定目前狀態下的條件可靠度。
+
+EVENT_FIELDS = ("capacity", "capacity_level", "p", "power", "idle_power")
+# 單次輪詢最多處理的事件數 (其餘留到下一次)，避免來源暴增時單次更新過久
+MAX_EVENTS_PER_POLL = 200_000
+
+
+# 持續增長的檔案：記住讀取位置，只讀完整的新行；檔案被截斷或換檔時從頭讀起
+class FileTailSource:
+    def __init__(self, path, from_start=False):
+        self.path = path
+        self.jsonl = not path.lower().endswith(".csv")
+        self._offset = None if from_start else self._size()
+        self._inode = self._stat_inode()
+        self._header = None
+        self._pending = b""
+        if not from_start and not self.jsonl:
+            self._header = self._read_header()
+
+    def _size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def _stat_inode(self):
+        try:
+            return os.stat(self.path).st_ino
+        except OSError:
+            return None
+
+    def _read_header(self):
+        try:
+            with open(self.path, "rb") as f:
+                first = f.readline()
+        except OSError:
+            return None
+        if not first.endswith(b"\n"):
+            return None
+        return next(csv.reader([first.decode("utf-8-sig").strip()]), None)
+
+    def read(self, limit=MAX_EVENTS_PER_POLL):
+        inode = self._stat_inode()
+        size = self._size()
+        if inode is None:
+            return []
+        if self._offset is None or inode != self._inode or size < (self._offset or 0):
+            self._offset, self._inode, self._header, self._pending = 0, inode, None, b""
+        if size == self._offset:
+            return []
+
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            chunk = f.read(size - self._offset)
+        self._offset += len(chunk)
+        data = self._pending + chunk
+        cut = data.rfind(b"\n") + 1
+        self._pending = data[cut:]
+        lines = data[:cut].decode("utf-8-sig", errors="replace").splitlines()
+
+        if len(lines) > limit:
+            # 超過上限的行退回未讀，下次輪詢再處理
+            rest = ("\n".join(lines[limit:]) + "\n").encode("utf-8")
+            self._pending = rest + self._pending
+            lines = lines[:limit]
+
+        if self.jsonl:
+            return _parse_json_lines(lines)
+        if self._header is None and lines:
+            self._header = next(csv.reader([lines[0]]), None)
+            lines = lines[1:]
+        if not self._header:
+            return []
+        return [row for row in csv.DictReader(io.StringIO("\n".join(lines)), fieldnames=self._header)]
+
+    def close(self):
+        pass
+
+
+# 本機 UDP：非阻塞讀完所有已到達的封包
+class UdpSource:
+    def __init__(self, host, port):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+
+    def read(self, limit=MAX_EVENTS_PER_POLL):
+        lines = []
+        while len(lines) < limit:
+            try:
+                data = self.sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                break
+            lines.extend(data.decode("utf-8", errors="replace").splitlines())
+        return _parse_json_lines(lines)
+
+    def close(self):
+        self.sock.close()
+
+
+def _parse_json_lines(lines):
+    events = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            event = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(event, dict):
+            events.append(event)
+    return events
+
+
+# 來源字串：udp://host:port 或檔案路徑 (.csv 以外一律視為 JSONL)
+def open_source(spec, from_start=False):
+    spec = str(spec).strip()
+    if spec.startswith("udp://"):
+        host, _, port = spec[len("udp://"):].rpartition(":")
+        return UdpSource(host or "127.0.0.1", int(port))
+    return FileTailSource(spec, from_start=from_start)
+
+
+# 欄位值 -> float；未提供 (None / 空字串) 回傳 None，無法解析或非有限值拋出 ValueError
+def _number(value):
+    if value is None or value == "":
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"無法解析的數值：{value!r}")
+    if not math.isfinite(number):
+        raise ValueError(f"非有限數值：{value!r}")
+    return number
+
+
+# 與資料編輯器 (validation.py) 相同的範圍：p 在 (0, 1]、功率與容量不可為負
+def _in_range(key, value):
+    if key == "p":
+        return 0 < value <= 1
+    return value >= 0
+
+
+# 解析單一事件的欄位；任何欄位無效時回傳 None (整筆事件不套用)
+def _event_fields(event):
+    fields = {}
+    for key in EVENT_FIELDS:
+        try:
+            value = _number(event.get(key))
+        except ValueError:
+            return None
+        if value is None:
+            continue
+        if not _in_range(key, value):
+            return None
+        fields[key] = value
+    return fields
+
+
+# capacity 與 capacity_level 以最後收到的為準
+def _drop_other_capacity(fields, key):
+    if key == "capacity":
+        fields.pop("capacity_level", None)
+    elif key == "capacity_level":
+        fields.pop("capacity", None)
+
+
+# 即時狀態：以原始模型為基準，記錄各站的遙測覆寫值並產生目前的模型
+class TelemetryFeed:
+    def __init__(self, base_model, source, rate_window=5.0):
+        self.base_model = base_model
+        self.model = base_model
+        self.source = source
+        self.overrides = {}
+        self._index = {name: i for i, name in enumerate(base_model.names)}
+        self.events = 0
+        self.rejected = 0
+        self.last_batch = 0
+        self.last_touched = 0
+        self.last_apply_ms = 0.0
+        self._rate = deque()
+        self._rate_window = rate_window
+
+    def _station(self, key):
+        if key is None:
+            return None
+        try:
+            if key in self._index:
+                return self._index[key]
+        except TypeError:
+            # list / dict 等無法雜湊的值
+            return None
+        key = str(key).strip()
+        if key in self._index:
+            return self._index[key]
+        try:
+            i = int(float(key))
+        except (TypeError, ValueError, OverflowError):
+            return None
+        return i if 0 <= i < self.base_model.n else None
+
+    # 把事件合併成 {站索引: 覆寫欄位}；無法辨識站別或欄位值無效 (非有限值、超出範圍) 的事件整筆計入 rejected
+    def _merge(self, events):
+        merged = {}
+        for event in events:
+            i = self._station(event.get("station"))
+            event_fields = _event_fields(event) if i is not None else None
+            if event_fields is None:
+                self.rejected += 1
+                continue
+            fields = merged.setdefault(i, {})
+            if str(event.get("reset", "")).lower() in ("1", "true"):
+                fields.clear()
+                fields["reset"] = True
+            for key, value in event_fields.items():
+                fields[key] = value
+                _drop_other_capacity(fields, key)
+        return merged
+
+    # 單站的覆寫值 -> with_updates 的欄位 (未覆寫的欄位回到原設定)
+    def _station_update(self, i, override):
+        base = self.base_model
+        update = {
+            "p": override.get("p", base.p[i]),
+            "working_power": override.get("power", base.working_power[i]),
+            "idle_power": override.get("idle_power", base.idle_power[i]),
+            "capacities": base.capacities[i],
+            "probs": base.probs[i]
+        }
+        capacity = override.get("capacity")
+        level = override.get("capacity_level")
+        if capacity is None and level is not None and base.capacities[i]:
+            capacity = base.capacities[i][min(max(int(level), 0), len(base.capacities[i]) - 1)]
+        if capacity is not None:
+            update["capacities"] = (capacity,)
+            update["probs"] = (1.0,)
+        return update
+
+    # 讀取並套用所有新事件，回傳本次處理的事件數
+    def poll(self):
+        events = self.source.read()
+        now = time.perf_counter()
+        self.last_batch = len(events)
+        self._rate.append((now, len(events)))
+        while self._rate and now - self._rate[0][0] > self._rate_window:
+            self._rate.popleft()
+        if not events:
+            self.last_touched = 0
+            return 0
+
+        start = time.perf_counter()
+        merged = self._merge(events)
+        updates = {}
+        for i, fields in merged.items():
+            override = {} if fields.pop("reset", False) else dict(self.overrides.get(i, {}))
+            for key, value in fields.items():
+                override[key] = value
+                _drop_other_capacity(override, key)
+            if override == self.overrides.get(i, {}):
+                continue
+            if override:
+                self.overrides[i] = override
+            else:
+                self.overrides.pop(i, None)
+            updates[i] = self._station_update(i, override)
+        if updates:
+            self.model = self.model.with_updates(updates)
+        self.events += len(events)
+        self.last_touched = len(updates)
+        self.last_apply_ms = (time.perf_counter() - start) * 1000.0
+        return len(events)
+
+    # 最近 rate_window 秒內的平均事件速率 (events / s)
+    def rate(self):
+        if len(self._rate) < 2:
+            return 0.0
+        span = self._rate[-1][0] - self._rate[0][0]
+        return sum(n for _, n in list(self._rate)[1:]) / span if span > 0 else 0.0
+
+    def close(self):
+        self.source.close()
@@ -0,0 +1,107 @@
+import math
+
+# --- 生產線拓樸圖 (單一 Plotly 圖) ---
+# 所有工作站畫在同一張圖：每列 per_row 站、蛇形換行 (奇數列由右往左) 讓連線保持最短，
+# 站數再多也只是一個元件，可拖曳平移、滾輪縮放。節點顏色沿用 node_states 的 CSS class。
+
+STATE_COLORS = {
+    "node-green": "#4cd37a",
+    "node-yellow": "#ffd86b",
+    "node-red": "#ff6b6b",
+    "node-fail": "#8B0000",
+}
+SELECTED_COLOR = "#3fe6ff"
+
+
+# 第 i 站的 (x, y) 座標
+def node_positions(n, per_row):
+    xs, ys = [], []
+    for i in range(n):
+        row, col = divmod(i, per_row)
+        xs.append(col if row % 2 == 0 else per_row - 1 - col)
+        ys.append(-row)
+    return xs, ys
+
+
+# 建立拓樸圖；node_states 為各站的 CSS class (例如 "node-green kpi-pulse"、"node-fail")
+# 節點的 customdata 為工作站索引，供點選事件判斷
+def build_topology_figure(names, node_states, rounded_inputs, max_caps, p, selected=None, per_row=10):
+    import plotly.graph_objects as go
+
+    n = len(names)
+    per_row = max(1, min(per_row, n))
+    n_rows = max(1, math.ceil(n / per_row))
+    xs, ys = node_positions(n, per_row)
+    states = [s.split()[0] if s else "node-green" for s in node_states]
+    failed = [s == "node-fail" for s in states]
+
+    # 連線：相鄰兩站一段，以 None 斷開，整條線只用一個 trace
+    line_x, line_y = [], []
+    for i in range(n - 1):
+        line_x += [xs[i], xs[i + 1], None]
+        line_y += [ys[i], ys[i + 1], None]
+
+    size = 38 if n <= 20 else (28 if n <= 80 else 20)
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=line_x, y=line_y, mode="lines",
+        line=dict(color="rgba(255,255,255,0.25)", width=2),
+        hoverinfo="skip", showlegend=False
+    ))
+    fig.add_trace(go.Scatter(
+        x=xs, y=ys, mode="markers+text",
+        text=[str(name) for name in names],
+        textposition="bottom center",
+        textfont=dict(color="#e6eef6", size=11 if n <= 40 else 9),
+        customdata=list(range(n)),
+        marker=dict(
+            size=[size * 1.25 if i == selected else size for i in range(n)],
+            color=[STATE_COLORS.get(s, STATE_COLORS["node-green"]) for s in states],
+            line=dict(
+                color=[SELECTED_COLOR if i == selected else ("#ff0000" if failed[i] else "rgba(255,255,255,0.3)") for i in range(n)],
+                width=[4 if i == selected or failed[i] else 2 for i in range(n)]
+            )
+        ),
+        hovertext=[
+            f"{names[i]}<br>輸入量：{rounded_inputs[i]}<br>最大產能：{max_caps[i]:g}<br>成功率 p：{float(p[i])}"
+            + ("<br><b>產能不足 (FAIL)</b>" if failed[i] else "")
+            for i in range(n)
+        ],
+        hoverinfo="text",
+        showlegend=False
+    ))
+    if any(failed):
+        fig.add_trace(go.Scatter(
+            x=[xs[i] for i in range(n) if failed[i]],
+            y=[ys[i] + 0.28 for i in range(n) if failed[i]],
+            mode="text", text=["FAIL"] * sum(failed),
+            textfont=dict(color="#ff6b6b", size=12),
+            hoverinfo="skip", showlegend=False
+        ))
+
+    fig.update_layout(
+        height=min(900, 130 * n_rows + 60),
+        margin=dict(l=10, r=10, t=20, b=10),
+        paper_bgcolor="rgba(0,0,0,0)",
+        plot_bgcolor="rgba(0,0,0,0)",
+        dragmode="pan",
+        clickmode="event+select",
+        xaxis=dict(visible=False, range=[-0.6, per_row - 0.4]),
+        yaxis=dict(visible=False, range=[-n_rows + 0.4, 0.6])
+    )
+    return fig
+
+
+# 從 st.plotly_chart 的選取事件取出被點選的工作站索引 (沒有點選時為 None)
+def selected_station(event):
+    if not event:
+        return None
+    try:
+        points = event["selection"]["points"]
+    except (KeyError, TypeError):
+        return None
+    for point in points:
+        if point.get("customdata") is not None:
+            idx = point["customdata"]
+            return int(idx[0] if isinstance(idx, (list, tuple)) else idx)
+    return None
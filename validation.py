@@ -0,0 +1,157 @@
+import math
+
+import numpy as np
+
+# --- 工作站表格驗證 (向量化) ---
+# 數值範圍以整欄運算檢查；產能 / 機率列表整欄一次拆解成 (列號, 數值) 陣列，
+# 遞增、加總與長度檢查都在陣列上完成，不逐列呼叫 parse_list_from_string。
+# 錯誤訊息與原本逐列檢查相同，依 (列, 檢查順序) 排列。
+
+# 檢查順序 (同一列內的錯誤依此排列) 與訊息
+CHECKS = (
+    ("name", "名稱不可為空"),
+    ("p", "p 必須在 (0, 1] 之間"),
+    ("processTime", "加工時間必須 > 0"),
+    ("timeLimit", "時間上限必須 >= 0"),
+    ("power", "功率不可為負"),
+    ("capacities_format", "產能列表格式錯誤"),
+    ("capacities_order", "產能列表必須嚴格遞增"),
+    ("probs_format", "機率列表格式錯誤"),
+    ("probs_sum", "機率加總必須約為 1"),
+    ("length", "產能與機率列表長度不一致"),
+)
+_CHECK_ORDER = {code: i for i, (code, _) in enumerate(CHECKS)}
+_CHECK_MESSAGE = dict(CHECKS)
+
+DEFAULT_PAGE_SIZE = 20
+
+
+def _numeric_column(df, col):
+    import pandas as pd
+
+    if col not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+
+
+def _list_column(df, col):
+    import pandas as pd
+
+    if col not in df.columns:
+        return pd.Series("", index=df.index, dtype=object)
+    return df[col]
+
+
+# 整欄拆解列表字串：回傳 (row_ids, values, bad)
+# row_ids / values 為所有數值的列號與值 (依列、依原順序)，bad[i] 表示第 i 列含無法解析的項目
+def parse_list_column(series):
+    import pandas as pd
+
+    n = len(series)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0, dtype=bool)
+
+    text = series.astype(object).where(series.notna(), "").astype(str)
+    text = text.str.replace("[", "", regex=False).str.replace("]", "", regex=False)
+    tokens = text.str.split(",").explode()
+    tokens = tokens.str.strip()
+    row_ids = np.repeat(np.arange(n), text.str.count(",").to_numpy() + 1)
+
+    keep = (tokens != "").to_numpy()
+    tokens = tokens[keep]
+    row_ids = row_ids[keep]
+
+    values = pd.to_numeric(tokens, errors="coerce").to_numpy(dtype=float)
+    # to_numeric 對 "nan" 也回傳 NaN，與 float("nan") 一樣視為可解析
+    failed = np.isnan(values) & (tokens.str.lower().str.lstrip("+-") != "nan").to_numpy()
+    bad = np.bincount(row_ids[failed], minlength=n) > 0
+    return row_ids, values, bad
+
+
+# 每列數值個數與加總
+def _counts_and_sums(row_ids, values, n):
+    return np.bincount(row_ids, minlength=n), np.bincount(row_ids, weights=values, minlength=n)
+
+
+# 每列是否嚴格遞增 (同一列相鄰兩值比較)
+def _strictly_increasing(row_ids, values, n):
+    same_row = row_ids[1:] == row_ids[:-1]
+    not_increasing = same_row & ~(values[:-1] < values[1:])
+    violated = np.zeros(n, dtype=bool)
+    violated[row_ids[1:][not_increasing]] = True
+    return ~violated
+
+
+# 驗證工作站表格，回傳結構化報告：
+# {"errors": [{"row", "column", "code", "message"}...], "error_count", "row_count", "rows_with_errors"}
+# row 為 1 起算的列號 (與表格顯示一致)
+def validate_station_table(df):
+    n = len(df)
+    flagged = []
+
+    def flag(code, mask, column, detail=None):
+        rows = np.nonzero(mask)[0]
+        if len(rows):
+            flagged.append((code, rows, column, detail))
+
+    if "name" in df.columns:
+        flag("name", (df["name"].astype(str).str.strip() == "").to_numpy(), "name")
+
+    p = _numeric_column(df, "p")
+    flag("p", ~((p > 0) & (p <= 1)), "p")
+    flag("processTime", _numeric_column(df, "processTime") <= 0, "processTime")
+    flag("timeLimit", _numeric_column(df, "timeLimit") < 0, "timeLimit")
+    flag("power", (_numeric_column(df, "working_power") < 0) | (_numeric_column(df, "idle_power") < 0), "working_power")
+
+    cap_ids, cap_vals, cap_bad = parse_list_column(_list_column(df, "capacities"))
+    prob_ids, prob_vals, prob_bad = parse_list_column(_list_column(df, "probs"))
+    cap_counts, _ = _counts_and_sums(cap_ids, cap_vals, n)
+    prob_counts, prob_sums = _counts_and_sums(prob_ids, prob_vals, n)
+
+    flag("capacities_format", cap_bad, "capacities")
+    flag("capacities_order", ~cap_bad & (cap_counts > 1) & ~_strictly_increasing(cap_ids, cap_vals, n), "capacities")
+    flag("probs_format", prob_bad, "probs")
+    sum_off = ~prob_bad & (prob_counts > 0) & ~np.isclose(prob_sums, 1.0, rtol=0, atol=1e-3)
+    flag("probs_sum", sum_off, "probs", prob_sums)
+    flag("length", ~cap_bad & ~prob_bad & (cap_counts != prob_counts), "capacities")
+
+    # 依 (列, 檢查順序) 排序後展開成錯誤清單
+    if flagged:
+        all_rows = np.concatenate([rows for _, rows, _, _ in flagged])
+        all_order = np.concatenate([np.full(len(rows), _CHECK_ORDER[code]) for code, rows, _, _ in flagged])
+        owners = np.concatenate([np.full(len(rows), k) for k, (_, rows, _, _) in enumerate(flagged)])
+        positions = np.concatenate([np.arange(len(rows)) for _, rows, _, _ in flagged])
+        sort_idx = np.lexsort((all_order, all_rows))
+    else:
+        all_rows = sort_idx = owners = positions = np.zeros(0, dtype=np.int64)
+
+    errors = []
+    for i in sort_idx:
+        code, rows, column, detail = flagged[owners[i]]
+        row = int(rows[positions[i]])
+        message = _CHECK_MESSAGE[code]
+        if code == "probs_sum":
+            message += f" (目前 {detail[row]:.3f})"
+        errors.append({
+            "row": row + 1,
+            "column": column,
+            "code": code,
+            "message": f"行 {row + 1}: {message}"
+        })
+
+    return {
+        "errors": errors,
+        "error_count": len(errors),
+        "row_count": n,
+        "rows_with_errors": int(len(np.unique(all_rows)))
+    }
+
+
+def page_count(report, page_size=DEFAULT_PAGE_SIZE):
+    return max(1, math.ceil(report["error_count"] / page_size))
+
+
+# 取出第 page 頁 (0 起算) 的錯誤
+def error_page(report, page, page_size=DEFAULT_PAGE_SIZE):
+    page = min(max(0, page), page_count(report, page_size) - 1)
+    return report["errors"][page * page_size:(page + 1) * page_size]